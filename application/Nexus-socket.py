@@ -1,40 +1,207 @@
 import asyncio
 import socketio
-import json
 import sys
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate, RTCDataChannel
+import time
+import statistics
+import itertools
+from collections import OrderedDict
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate
+from aiortc.exceptions import InvalidStateError
 import logging
+from file_transfer import FileReceiver, is_file_channel, send_file
+from outbound import OutboundQueue, BLOCK
+import protocol
+import broadcast
+from database import get_database, OUTBOX_PAGE
 
 logging.basicConfig(level=logging.WARNING)
 
+# ICE candidates for a peer are held this long and sent as one `signals`
+# frame; end-of-candidates or completed gathering flushes them early.
+SIGNAL_BATCH_WINDOW = 0.02
+CONNECT_CONCURRENCY = 8
+CONNECT_TIMEOUT = 20
+CONNECT_RETRIES = 2
+# A failed peer connection is redialled after each of these delays. aiortc
+# has no ICE restart, so recovery is a fresh offer on a new connection;
+# the peer's send queue is kept and replays into the new channel.
+RECONNECT_DELAYS = (0, 0.25, 0.5, 1, 2, 4, 8, 15)
+RECONNECT_WINDOW = 60
+REGISTER_RETRY_MAX = 10
+# Received message ids are acked in one frame per peer once this much time
+# has passed or this many ids are waiting.
+ACK_DELAY = 0.05
+ACK_BATCH = 1024
+RECENT_UIDS = 8192
+
 class P2PMessenger:
-    def __init__(self, peer_id, signaling_server):
+    def __init__(self, peer_id, signaling_server, send_policy=BLOCK, database=None, on_message=None):
         self.peer_id = peer_id
         self.signaling_server = signaling_server
+        self.send_policy = send_policy
+        # Without a database messages to a peer only live in its send queue.
+        self.database = database
+        # Called as on_message(peer_id, text, via) for every chat message
+        # shown, via being the relaying peer or None; the console prints
+        # them instead.
+        self.on_message = on_message
         
-        self.sio = socketio.AsyncClient()
+        # python-socketio doubles the delay between attempts up to the maximum.
+        self.sio = socketio.AsyncClient(reconnection_delay=0.5, reconnection_delay_max=30)
+        self.registered = False
+        self.greeted = False
+        self.register_attempts = 0
+        self.closing = False
+        self.migrate_task = None
         
         self.peer_connections = {}
         self.data_channels = {}
+        # The open chat channel per peer that signals go over; while a call
+        # replaces a connection it is still the old connection's channel.
+        self.control_channels = {}
+        self.replaced_connections = {}
         self.pending_candidates = {}
+        self.send_queues = {}
+        self.peer_features = {}
+        self.seen_relays = broadcast.SeenRelays()
+        self.message_ids = itertools.count(1)
+        self.pc_pool = []
+        self.answer_waiters = {}
+        self.connected_waiters = {}
+        self.reconnect_tasks = {}
+        self.dial_tasks = {}
+        self.online_peers = set()
+        self.presence_seq = None
+        self.presence_buffer = None
+        self.presence_mode = 'all'
+        self.signal_batching = False
+        self.signal_outbox = {}
+        self.signal_flush_tasks = {}
+        self.signal_locks = {}
+        self.signal_routes = {'channel': 0, 'server': 0}
+        self.ack_outbox = {}
+        self.ack_flush_tasks = {}
+        self.relay_ack_outbox = {}
+        self.relay_ack_tasks = {}
+        self.drain_tasks = {}
+        self.receive_locks = {}
+        self.recent_uids = OrderedDict()
+        self.contacts = set()
 
+        self.sio.on('connect', self.on_connect)
+        self.sio.on('disconnect', self.on_disconnect)
         self.sio.on('registered', self.on_registered)
         self.sio.on('peers_list', self.on_peers_list)
+        self.sio.on('presence_snapshot', self.on_presence_snapshot)
+        self.sio.on('presence_page', self.on_presence_page)
+        self.sio.on('presence', self.on_presence)
         self.sio.on('signal', self.on_signal)
+        self.sio.on('signals', self.on_signals)
         self.sio.on('error', self.on_error)
+        self.sio.on('server_migrate', self.on_server_migrate)
+
+
+    async def on_connect(self):
+        # Runs on every (re)connection, so the peer id is registered again
+        # after the server or the network drops us.
+        await self.register()
+
+    async def register(self):
+        await self.sio.emit('register', {'peer_id': self.peer_id, 'features': ['signals']})
 
+    async def retry_register(self, delay):
+        await asyncio.sleep(delay)
+        if not self.registered and self.sio.connected:
+            await self.register()
+
+    async def on_disconnect(self, *args):
+        self.registered = False
+        self.presence_seq = None
+        if self.migrate_task is not None:
+            print("\n🔄 Сервер перезапускается, переподключение...")
+        elif not self.closing:
+            print("\n⚠️  Соединение с сервером потеряно, переподключение...")
+
+    async def on_server_migrate(self, data):
+        # The server is shutting down and gave each client its own moment to
+        # reconnect, so the replacement isn't hit by everyone at once.
+        if self.migrate_task is None:
+            self.migrate_task = asyncio.create_task(self.migrate(data.get('reconnect_after', 0)))
+
+    async def migrate(self, delay):
+        try:
+            await asyncio.sleep(delay)
+            # If the server already cut us off, socketio is reconnecting on its own.
+            if self.closing or not self.sio.connected:
+                return
+            await self.sio.disconnect()
+            if not self.closing:
+                await self.sio.connect(self.signaling_server, retry=True)
+        except Exception as e:
+            print(f"❌ Не удалось переподключиться к серверу: {e}")
+        finally:
+            self.migrate_task = None
 
     async def on_registered(self, data):
+        # Older servers don't advertise features and only know `signal`.
+        self.signal_batching = 'signals' in data.get('features', ())
+        self.registered = True
+        self.register_attempts = 0
+        await self.sio.emit('subscribe_presence', {})
+        if self.greeted:
+            print(f"\n✅ Снова зарегистрированы как: {data['peer_id']}")
+            return
+        self.greeted = True
         print(f"✅ Зарегистрированы как: {data['peer_id']}")
         print("\nКоманды:")
         print("  list - показать онлайн пиров")
         print("  call <peer_id> - позвонить пиру")
+        print("  connect <peer_id> ... | connect all - подключиться к нескольким пирам")
+        print("  msg <peer_id> <текст> - отправить сообщение пиру (доставится, когда он будет в сети)")
+        print("  file <peer_id> <путь> - отправить файл")
+        print("  stats - статистика очередей отправки")
         print("  exit - выход")
         print("  любой текст - отправить сообщение всем\n")
-    
+
+    async def on_presence_snapshot(self, data):
+        # Deltas that arrive while the snapshot is still paging in are
+        # buffered and replayed on top of it.
+        self.online_peers = set(data['peers'])
+        self.presence_seq = data['seq']
+        self.presence_mode = data.get('mode', 'all')
+        self.presence_buffer = []
+        await self.on_presence_page(data)
+
+    async def on_presence_page(self, data):
+        self.online_peers.update(data['peers'])
+        if data.get('cursor'):
+            await self.sio.emit('get_presence_page', {'cursor': data['cursor']})
+            return
+        buffered, self.presence_buffer = self.presence_buffer or [], None
+        for delta in sorted(buffered, key=lambda delta: delta['seq']):
+            await self.on_presence(delta)
+
+    async def on_presence(self, data):
+        if self.presence_buffer is not None:
+            self.presence_buffer.append(data)
+            return
+        if self.presence_seq is None or data['seq'] <= self.presence_seq:
+            return
+        if self.presence_mode == 'all' and data['seq'] != self.presence_seq + 1:
+            # Missed an update: take a fresh snapshot instead of guessing.
+            # Contact-filtered subscriptions only see some seq numbers.
+            await self.sio.emit('subscribe_presence', {})
+            self.presence_buffer = []
+            return
+        self.presence_seq = data['seq']
+        self.online_peers.update(data.get('joined', ()))
+        self.online_peers.difference_update(data.get('left', ()))
+
 
     async def on_peers_list(self, data):
-        peers = data['peers']
+        self.print_peers(data['peers'])
+
+    def print_peers(self, peers):
         if peers:
             print("\n📋 Онлайн пиры:")
             for peer in peers:
@@ -45,6 +212,13 @@ class P2PMessenger:
     
 
     async def on_error(self, data):
+        if data.get('code') == 'peer_id_taken' and self.greeted and not self.registered:
+            # After a network blip the server may still hold our old session
+            # until its ping timeout; keep retrying until it lets go.
+            delay = min(0.5 * 2 ** self.register_attempts, REGISTER_RETRY_MAX)
+            self.register_attempts += 1
+            asyncio.create_task(self.retry_register(delay))
+            return
         print(f"\n❌ Ошибка: {data['message']}")
 
 
@@ -54,7 +228,15 @@ class P2PMessenger:
         signal_data = data['data']
         
         print(f"\n📡 Получен сигнал {signal_type} от {from_peer}")
-        
+        await self.dispatch_signal(from_peer, signal_type, signal_data)
+
+    async def on_signals(self, data):
+        from_peer = data['from']
+        print(f"\n📡 Получено сигналов: {len(data['signals'])} от {from_peer}")
+        for item in data['signals']:
+            await self.dispatch_signal(from_peer, item['type'], item['data'])
+
+    async def dispatch_signal(self, from_peer, signal_type, signal_data):
         if signal_type == 'offer':
             await self.handle_offer(from_peer, signal_data)
         elif signal_type == 'answer':
@@ -63,14 +245,29 @@ class P2PMessenger:
             await self.handle_ice_candidate(from_peer, signal_data)
 
 
+    def prewarm(self, count):
+        # RTCPeerConnection generates its DTLS certificate in the constructor;
+        # doing that ahead of time takes it off the connection setup path.
+        while len(self.pc_pool) < count:
+            self.pc_pool.append(RTCPeerConnection())
+
     async def create_peer_connection(self, peer_id):
-        pc = RTCPeerConnection()
+        pc = self.pc_pool.pop() if self.pc_pool else RTCPeerConnection()
+        was_connected = False
+        previous = self.peer_connections.get(peer_id)
+        if previous is not None and previous.connectionState == "connected":
+            # A new call to a connected peer: the old connection keeps
+            # carrying messages and signals until this one is up.
+            self.replaced_connections[peer_id] = previous
         
         self.peer_connections[peer_id] = pc
         self.pending_candidates[peer_id] = []
         
         @pc.on("datachannel")
         def on_datachannel(channel):
+            if is_file_channel(channel):
+                self.receive_file(peer_id, channel)
+                return
             asyncio.create_task(self.setup_data_channel(peer_id, channel))
         
         @pc.on("icecandidate")
@@ -80,57 +277,446 @@ class P2PMessenger:
                     'candidate': candidate. candidate,
                     'sdpMid': candidate.sdpMid,
                     'sdpMLineIndex': candidate.sdpMLineIndex
-                })
+                }, flush=False)
+            else:
+                await self.flush_signals(peer_id)
+
+        @pc.on("icegatheringstatechange")
+        async def on_icegatheringstatechange():
+            if pc.iceGatheringState == "complete":
+                await self.flush_signals(peer_id)
         
         @pc.on("connectionstatechange")
         async def on_connectionstatechange():
             print(f"\n🔗 Соединение с {peer_id}: {pc.connectionState}")
             
+            nonlocal was_connected
+            if pc.connectionState == "connected":
+                was_connected = True
+                waiter = self.connected_waiters.pop(peer_id, None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(None)
+                if self.peer_connections.get(peer_id) is pc and peer_id in self.replaced_connections:
+                    await self.replaced_connections.pop(peer_id).close()
             if pc.connectionState == "failed":
-                await pc.close()
-                if peer_id in self.peer_connections:
+                waiter = self.connected_waiters.pop(peer_id, None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_exception(ConnectionError(f"соединение с {peer_id} не установлено"))
+                self.drop_signals(peer_id)
+                current = self.peer_connections.get(peer_id) is pc
+                if current:
                     del self.peer_connections[peer_id]
-                if peer_id in self.data_channels:
-                    del self.data_channels[peer_id]
+                    self.data_channels.pop(peer_id, None)
+                    restored = await self.restore_replaced(peer_id)
+                    if not restored and was_connected and not self.closing and peer_id not in self.reconnect_tasks:
+                        self.reconnect_tasks[peer_id] = asyncio.create_task(self.reconnect_peer(peer_id))
+                await pc.close()
+            elif pc.connectionState == "closed" and self.peer_connections.get(peer_id) is pc:
+                # The peer hung up; nothing left to replay to.
+                await self.close_peer(peer_id)
         
         return pc
     
 
     async def setup_data_channel(self, peer_id, channel):
         self.data_channels[peer_id] = channel
+        queue = self.send_queues.get(peer_id)
+        if queue is None:
+            queue = self.send_queues[peer_id] = OutboundQueue(policy=self.send_policy)
+        queue.attach(channel)
+        self.apply_features(peer_id, self.peer_features.get(peer_id, ()))
         print(f"\n✅ Data channel открыт с {peer_id}")
+        if channel.readyState == "open":
+            self.on_channel_open(peer_id, channel)
+        else:
+            channel.on("open", lambda: self.on_channel_open(peer_id, channel))
         
         @channel.on("message")
         def on_message(message):
-            print(f"\n💬 {peer_id}: {message}")
-            print("Вы: ", end="", flush=True) 
+            try:
+                items = protocol.decode(message)
+            except ValueError as e:
+                print(f"\n⚠️  Некорректный кадр от {peer_id}: {e}")
+                return
+            reliable, plain = [], []
+            for item in items:
+                if isinstance(item, dict):
+                    self.handle_control(peer_id, item)
+                elif getattr(item, 'reliable', False):
+                    reliable.append(item)
+                else:
+                    plain.append(item)
+                    self.show_message(peer_id, item)
+            if plain and self.database is not None:
+                asyncio.ensure_future(asyncio.to_thread(
+                    self.store_received, peer_id, [(None, text) for text in plain]))
+            if reliable:
+                asyncio.ensure_future(self.receive_reliable(peer_id, reliable))
+            elif self.on_message is None:
+                print("Вы: ", end="", flush=True) 
         
         @channel.on("close")
         def on_close():
             print(f"\n❌ Data channel закрыт с {peer_id}")
-            if peer_id in self.data_channels:
+            if self.data_channels.get(peer_id) is channel:
                 del self.data_channels[peer_id]
+            if self.control_channels.get(peer_id) is channel:
+                del self.control_channels[peer_id]
+
+    def on_channel_open(self, peer_id, channel):
+        self.control_channels[peer_id] = channel
+        self.start_drain(peer_id)
 
     
+    async def receive_reliable(self, peer_id, texts):
+        # Every id is acked, including retransmissions we already have, so
+        # the sender can clear its outbox.
+        if await self.store_reliable(peer_id, [(f"{peer_id}:{text.message_id}", text) for text in texts]):
+            self.queue_acks(peer_id, [text.message_id for text in texts])
+
+    async def store_reliable(self, peer_id, messages, via=None):
+        # messages: (uid, text). Stores and shows the ones not seen before,
+        # each only once; returns True once all are committed and may be
+        # acked. Until then the sender's outbox is the only copy. The lock
+        # keeps frames from one peer in arrival order.
+        lock = self.receive_locks.setdefault(peer_id, asyncio.Lock())
+        async with lock:
+            fresh = [(uid, text) for uid, text in messages if uid not in self.recent_uids]
+            known = set()
+            try:
+                if fresh and self.database is not None:
+                    known = await asyncio.to_thread(self.store_received, peer_id, fresh)
+            except Exception as e:
+                print(f"\n❌ Не удалось сохранить сообщения от {peer_id}: {e}")
+                return False
+            for uid, text in fresh:
+                self.recent_uids[uid] = None
+                if len(self.recent_uids) > RECENT_UIDS:
+                    self.recent_uids.popitem(last=False)
+                if uid not in known:
+                    self.show_message(peer_id, text, via)
+        if self.database is not None:
+            try:
+                await self.database.flush_async()
+            except Exception as e:
+                # Unacked, so the sender resends them; the writer keeps
+                # retrying, and a resend that finds them stored is just acked.
+                for uid, _ in fresh:
+                    self.recent_uids.pop(uid, None)
+                print(f"\n❌ Сообщения от {peer_id} не записаны, подтверждение отложено: {e}")
+                return False
+        if fresh and self.on_message is None:
+            print("Вы: ", end="", flush=True)
+        return True
+
+    def show_message(self, peer_id, text, via=None):
+        if self.on_message is not None:
+            self.on_message(peer_id, str(text), via)
+        else:
+            via = f" (через {via})" if via else ""
+            print(f"\n💬 {peer_id}{via}: {text}")
+
+    def store_received(self, peer_id, messages):
+        # Runs in a worker thread; messages are (uid or None, text). Returns
+        # the uids already stored earlier, which the writer ignores again.
+        # Writes go through the database's batching writer.
+        if peer_id not in self.contacts:
+            self.database.add_contact(peer_id, added_by_user=False)
+            self.contacts.add(peer_id)
+        known = self.database.known_uids(uid for uid, _ in messages if uid is not None)
+        for uid, text in messages:
+            if uid not in known:
+                self.database.queue_message(peer_id, str(text), True, uid)
+        return known
+
+    def queue_acks(self, peer_id, message_ids):
+        pending = self.ack_outbox.setdefault(peer_id, [])
+        pending.extend(message_ids)
+        if len(pending) >= ACK_BATCH:
+            self.flush_acks(peer_id)
+        elif peer_id not in self.ack_flush_tasks:
+            self.ack_flush_tasks[peer_id] = asyncio.create_task(self.flush_acks_later(peer_id))
+
+    async def flush_acks_later(self, peer_id):
+        await asyncio.sleep(ACK_DELAY)
+        self.ack_flush_tasks.pop(peer_id, None)
+        self.flush_acks(peer_id)
+
+    def flush_acks(self, peer_id):
+        task = self.ack_flush_tasks.pop(peer_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        message_ids = self.ack_outbox.pop(peer_id, None)
+        queue = self.send_queues.get(peer_id)
+        if message_ids and queue is not None:
+            codec = self.codec_for(peer_id) or protocol.CODEC_NONE
+            asyncio.ensure_future(queue.put(protocol.encode_ack(message_ids, codec)))
+
+    def is_contact(self, peer_id):
+        # Files and relayed messages are only taken from contacts the user
+        # added; `contacts` also holds everyone who merely messaged us.
+        return self.database is not None and self.database.is_contact(peer_id)
+
+    def reliable(self, peer_id):
+        return self.database is not None and 'ack' in self.peer_features.get(peer_id, ())
+
+    def start_drain(self, peer_id):
+        if self.database is not None and peer_id not in self.drain_tasks:
+            self.drain_tasks[peer_id] = asyncio.create_task(self.drain_outbox(peer_id))
+
+    async def drain_outbox(self, peer_id):
+        # Resends everything the peer hasn't acked, oldest first. Pages go
+        # straight into the send queue, which batches the frames, and acks
+        # come back batched, so a backlog of thousands costs a few round
+        # trips rather than one per message. Messages still in the queue
+        # from before an outage may go out twice; the receiver drops repeats.
+        # Peers without acks get the backlog once and it is cleared.
+        reliable = self.reliable(peer_id)
+        after_id, total = 0, 0
+        try:
+            while True:
+                queue = self.send_queues.get(peer_id)
+                if queue is None:
+                    return
+                rows = await asyncio.to_thread(self.database.outbox_pending, peer_id, after_id)
+                codec = self.codec_for(peer_id)
+                for message_id, message in rows:
+                    if not await queue.put(protocol.encode_text(message, message_id, codec, reliable)):
+                        return
+                if rows and not reliable:
+                    await asyncio.to_thread(self.database.outbox_ack, peer_id, [row[0] for row in rows])
+                total += len(rows)
+                if len(rows) < OUTBOX_PAGE:
+                    break
+                after_id = rows[-1][0]
+        finally:
+            self.drain_tasks.pop(peer_id, None)
+        if total:
+            print(f"\n📤 Доставляем {total} отложенных сообщений для {peer_id}")
+
+    def receive_file(self, peer_id, channel):
+        if not self.is_contact(peer_id):
+            print(f"\n⚠️  Файл от {peer_id} отклонён: его нет в контактах")
+            channel.close()
+            return None
+        return FileReceiver(channel, on_complete=lambda result: self.on_file_received(peer_id, result))
+
+    def on_file_received(self, peer_id, result):
+        if result['ok']:
+            print(f"\n📁 Файл от {peer_id} сохранён: {result['path']} ({result['size']} байт)")
+        else:
+            print(f"\n❌ Файл {result['name']} от {peer_id} повреждён, приём отменён")
+        print("Вы: ", end="", flush=True)
+
+    async def send_file(self, peer_id, path):
+        pc = self.peer_connections.get(peer_id)
+        if pc is None or pc.connectionState != "connected":
+            print(f"❌ Нет соединения с {peer_id}. Используйте 'call {peer_id}'")
+            return
+        print(f"📤 Отправка {path} → {peer_id}...")
+        try:
+            result = await send_file(pc, path)
+        except Exception as e:
+            print(f"❌ Ошибка отправки файла: {e}")
+            return
+        if result['ok']:
+            resumed = f", продолжено с блока {result['resumed_from']}" if result['resumed_from'] else ""
+            print(f"✅ Файл отправлен: {result['size']} байт за {result['seconds']:.1f} с "
+                  f"({result['mb_per_s']:.1f} МБ/с{resumed})")
+        else:
+            print(f"❌ Получатель не подтвердил целостность файла {path}")
+
     async def call_peer(self, peer_id):
-        print(f"\n📞 Звоним {peer_id}...")
-        
+        if self.signal_channel(peer_id) is not None:
+            print(f"\n📞 Переустанавливаем соединение с {peer_id} (сигналы через data channel)...")
+        else:
+            print(f"\n📞 Звоним {peer_id}...")
+        await self.start_call(peer_id)
+
+    async def start_call(self, peer_id):
+        # Sends the offer and returns the futures for the answer and for the
+        # connection, plus when gathering finished, so callers can time stages.
+        loop = asyncio.get_running_loop()
+        connected = self.connected_waiters[peer_id] = loop.create_future()
+        answered = self.answer_waiters[peer_id] = loop.create_future()
         pc = await self.create_peer_connection(peer_id)
         
         channel = pc.createDataChannel("chat")
         await self.setup_data_channel(peer_id, channel)
         
         offer = await pc.createOffer()
+        # aiortc gathers ICE candidates inside setLocalDescription.
         await pc.setLocalDescription(offer)
+        gathered = time.perf_counter()
         
         await self.send_signal(peer_id, 'offer', {
             'sdp': pc.localDescription.sdp,
-            'type': pc.localDescription.type
-        })
+            'type': pc.localDescription.type,
+            'features': list(protocol.FEATURES)
+        }, flush=pc.iceGatheringState == "complete")
+        return answered, connected, gathered
+
+    async def establish(self, peer_id):
+        start = time.perf_counter()
+        answered, connected, gathered = await self.start_call(peer_id)
+        signalled = gathered
+        try:
+            await answered
+            signalled = time.perf_counter()
+            await connected
+        finally:
+            self.answer_waiters.pop(peer_id, None)
+            self.connected_waiters.pop(peer_id, None)
+        done = time.perf_counter()
+        return {
+            'gather_ms': (gathered - start) * 1000,
+            'signal_rtt_ms': (signalled - gathered) * 1000,
+            # ICE connectivity checks and the DTLS handshake.
+            'dtls_ms': (done - signalled) * 1000,
+            'total_ms': (done - start) * 1000
+        }
+
+    async def reconnect_peer(self, peer_id):
+        # Only the smaller peer id redials so the two sides don't keep
+        # colliding; the other one waits for the incoming offer.
+        print(f"\n🔄 Восстанавливаем соединение с {peer_id}...")
+        start = time.perf_counter()
+        restored = False
+        try:
+            if self.peer_id < peer_id:
+                for delay in RECONNECT_DELAYS:
+                    await asyncio.sleep(delay)
+                    if self.closing or self.is_connected(peer_id):
+                        break
+                    if self.presence_seq is not None and peer_id not in self.online_peers:
+                        continue
+                    try:
+                        await asyncio.wait_for(self.establish(peer_id), CONNECT_TIMEOUT)
+                        restored = True
+                        break
+                    except Exception:
+                        await self.discard_connection(peer_id)
+            else:
+                while not self.closing and not self.is_connected(peer_id):
+                    if time.perf_counter() - start > RECONNECT_WINDOW:
+                        break
+                    await asyncio.sleep(0.25)
+        finally:
+            self.reconnect_tasks.pop(peer_id, None)
+        if restored or self.is_connected(peer_id):
+            print(f"\n✅ Соединение с {peer_id} восстановлено за {(time.perf_counter() - start) * 1000:.0f} мс")
+        elif not self.closing:
+            print(f"\n❌ Не удалось восстановить соединение с {peer_id}")
+            await self.close_peer(peer_id)
+
+    async def discard_connection(self, peer_id):
+        # Drops the connection attempt but keeps the peer's send queue.
+        self.drop_signals(peer_id)
+        for waiters in (self.answer_waiters, self.connected_waiters):
+            waiter = waiters.pop(peer_id, None)
+            if waiter is not None:
+                waiter.cancel()
+        self.data_channels.pop(peer_id, None)
+        pc = self.peer_connections.pop(peer_id, None)
+        if pc is not None:
+            await pc.close()
+        await self.restore_replaced(peer_id)
+
+    async def restore_replaced(self, peer_id):
+        # A call that was to replace a working connection failed: go back to
+        # the old one if it is still up. Returns whether it was restored.
+        previous = self.replaced_connections.pop(peer_id, None)
+        if previous is None:
+            return False
+        channel = self.control_channels.get(peer_id)
+        if previous.connectionState != "connected" or channel is None or peer_id in self.peer_connections:
+            await previous.close()
+            return False
+        self.peer_connections[peer_id] = previous
+        self.data_channels[peer_id] = channel
+        if peer_id in self.send_queues:
+            self.send_queues[peer_id].attach(channel)
+        return True
+
+    async def close_peer(self, peer_id):
+        self.drop_signals(peer_id)
+        for waiters in (self.answer_waiters, self.connected_waiters):
+            waiter = waiters.pop(peer_id, None)
+            if waiter is not None:
+                waiter.cancel()
+        queue = self.send_queues.pop(peer_id, None)
+        if queue is not None:
+            queue.close()
+        self.data_channels.pop(peer_id, None)
+        self.control_channels.pop(peer_id, None)
+        for pc in (self.peer_connections.pop(peer_id, None), self.replaced_connections.pop(peer_id, None)):
+            if pc is not None:
+                await pc.close()
+
+    async def connect_many(self, peer_ids, concurrency=CONNECT_CONCURRENCY,
+                           timeout=CONNECT_TIMEOUT, retries=CONNECT_RETRIES):
+        # Connects to many peers at once, at most `concurrency` setups in
+        # flight, each bounded by `timeout` and retried `retries` times.
+        # Returns {peer_id: {'ok', 'attempts', stage timings or 'error'}}.
+        peer_ids = [peer_id for peer_id in dict.fromkeys(peer_ids)
+                    if peer_id != self.peer_id and not self.is_connected(peer_id)]
+        semaphore = asyncio.Semaphore(concurrency)
+        self.prewarm(min(concurrency, len(peer_ids)))
+
+        async def connect(peer_id):
+            async with semaphore:
+                error = None
+                for attempt in range(1, retries + 2):
+                    try:
+                        timings = await asyncio.wait_for(self.establish(peer_id), timeout)
+                        # Keep a warm connection ready for the next setup.
+                        self.prewarm(min(concurrency, len(peer_ids)))
+                        return {'ok': True, 'attempts': attempt, **timings}
+                    except Exception as e:
+                        error = str(e) or type(e).__name__
+                        await self.close_peer(peer_id)
+                        if self.is_connected(peer_id):
+                            # The peer called us meanwhile and that call won.
+                            return {'ok': True, 'attempts': attempt}
+                return {'ok': False, 'attempts': retries + 1, 'error': error}
+
+        results = await asyncio.gather(*(connect(peer_id) for peer_id in peer_ids))
+        return dict(zip(peer_ids, results))
+
+    def is_connected(self, peer_id):
+        channel = self.data_channels.get(peer_id)
+        return channel is not None and channel.readyState == "open"
+
+    async def connect_and_report(self, peer_ids):
+        print(f"\n📞 Подключение к {len(peer_ids)} пирам...")
+        start = time.perf_counter()
+        results = await self.connect_many(peer_ids)
+        elapsed = time.perf_counter() - start
+        ok = [result for result in results.values() if result['ok']]
+        print(f"\n✅ Подключено {len(ok)} из {len(results)} за {elapsed:.1f} с")
+        timed = [result for result in ok if 'total_ms' in result]
+        if timed:
+            for stage, title in (('gather_ms', 'сбор ICE'), ('signal_rtt_ms', 'сигнализация'),
+                                 ('dtls_ms', 'ICE + DTLS'), ('total_ms', 'всего')):
+                values = [result[stage] for result in timed]
+                print(f"  {title}: медиана {statistics.median(values):.0f} мс, макс. {max(values):.0f} мс")
+        for peer_id, result in results.items():
+            if not result['ok']:
+                print(f"  ❌ {peer_id}: {result['error']} (попыток: {result['attempts']})")
 
     async def handle_offer(self, peer_id, offer_data):
         print(f"\n📞 Входящий звонок от {peer_id}")
         
+        if peer_id in self.answer_waiters and peer_id in self.peer_connections:
+            # Both sides called each other. The smaller peer id keeps its own
+            # offer; the other side drops its attempt and answers instead.
+            if self.peer_id < peer_id:
+                return
+            self.answer_waiters.pop(peer_id).set_result(None)
+            self.drop_signals(peer_id)
+            await self.peer_connections.pop(peer_id).close()
+
+        self.apply_features(peer_id, offer_data.get('features', ()))
         pc = await self.create_peer_connection(peer_id)
         
         offer = RTCSessionDescription(sdp=offer_data['sdp'], type=offer_data['type'])
@@ -141,8 +727,9 @@ class P2PMessenger:
         
         await self.send_signal(peer_id, 'answer', {
             'sdp': pc.localDescription.sdp,
-            'type': pc.localDescription.type
-        })
+            'type': pc.localDescription.type,
+            'features': list(protocol.FEATURES)
+        }, flush=pc.iceGatheringState == "complete")
         
         if peer_id in self.pending_candidates:
             for candidate_data in self.pending_candidates[peer_id]:
@@ -157,6 +744,10 @@ class P2PMessenger:
         
         answer = RTCSessionDescription(sdp=answer_data['sdp'], type=answer_data['type'])
         await pc.setRemoteDescription(answer)
+        waiter = self.answer_waiters.get(peer_id)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+        self.apply_features(peer_id, answer_data.get('features', ()))
         
         if peer_id in self.pending_candidates:
             for candidate_data in self.pending_candidates[peer_id]:
@@ -183,31 +774,328 @@ class P2PMessenger:
             await pc.addIceCandidate(candidate)
 
 
-    async def send_signal(self, target_peer_id, signal_type, signal_data):
-        await self.sio.emit('signal', {
-            'target': target_peer_id,
-            'type': signal_type,
-            'data': signal_data
-        })
+    async def send_signal(self, target_peer_id, signal_type, signal_data, flush=True):
+        # Once a peer has an open channel to us, signals go over it and the
+        # server is only needed for the first contact.
+        if not self.signal_batching and self.signal_channel(target_peer_id) is None:
+            await self.sio.emit('signal', {
+                'target': target_peer_id,
+                'type': signal_type,
+                'data': signal_data
+            })
+            self.signal_routes['server'] += 1
+            return
+        self.signal_outbox.setdefault(target_peer_id, []).append({'type': signal_type, 'data': signal_data})
+        if flush:
+            await self.flush_signals(target_peer_id)
+        elif target_peer_id not in self.signal_flush_tasks:
+            self.signal_flush_tasks[target_peer_id] = asyncio.create_task(self.flush_signals_later(target_peer_id))
+
+    async def flush_signals_later(self, target_peer_id):
+        await asyncio.sleep(SIGNAL_BATCH_WINDOW)
+        self.signal_flush_tasks.pop(target_peer_id, None)
+        await self.flush_signals(target_peer_id)
+
+    async def flush_signals(self, target_peer_id):
+        task = self.signal_flush_tasks.pop(target_peer_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        batch = self.signal_outbox.pop(target_peer_id, None)
+        if not batch:
+            return
+        if self.send_inband(target_peer_id, batch):
+            return
+        self.signal_routes['server'] += len(batch)
+        if len(batch) == 1 or not self.signal_batching:
+            for item in batch:
+                await self.sio.emit('signal', {'target': target_peer_id, **item})
+        else:
+            await self.sio.emit('signals', {'target': target_peer_id, 'signals': batch})
+
+    def signal_channel(self, peer_id):
+        channel = self.control_channels.get(peer_id)
+        if channel is None or channel.readyState != "open" or 'signal' not in self.peer_features.get(peer_id, ()):
+            return None
+        return channel
+
+    def send_inband(self, peer_id, signals):
+        # Skips the send queue: signals are small and shouldn't wait behind
+        # a chat backlog. False sends them through the server instead.
+        channel = self.signal_channel(peer_id)
+        if channel is None:
+            return False
+        try:
+            channel.send(protocol.encode_signals(signals, self.codec_for(peer_id)))
+        except InvalidStateError:
+            return False
+        self.signal_routes['channel'] += len(signals)
+        return True
+
+    async def receive_inband(self, peer_id, signals):
+        # One frame at a time per peer, in arrival order, as the server's
+        # events are handled.
+        lock = self.signal_locks.setdefault(peer_id, asyncio.Lock())
+        async with lock:
+            print(f"\n📡 Получено сигналов по data channel: {len(signals)} от {peer_id}")
+            for item in signals:
+                if not isinstance(item.get('type'), str) or not isinstance(item.get('data'), dict):
+                    continue
+                try:
+                    await self.dispatch_signal(peer_id, item['type'], item['data'])
+                except Exception as e:
+                    print(f"\n⚠️  Некорректный сигнал {item['type']} от {peer_id}: {e}")
+
+    def drop_signals(self, target_peer_id):
+        task = self.signal_flush_tasks.pop(target_peer_id, None)
+        if task is not None:
+            task.cancel()
+        self.signal_outbox.pop(target_peer_id, None)
 
     async def send_message(self, message):
-        if not self.data_channels:
+        if not self.data_channels and not self.reconnect_tasks:
             print("❌ Нет активных соединений. Используйте 'list' и 'call <peer_id>'")
             return
         
-        for peer_id, channel in self.data_channels.items():
-            if channel.readyState == "open":
-                channel.send(message)
-        
-        print(f"✉️ Отправлено {len(self.data_channels)} пирам")
+        results = await self.broadcast(message)
+        delivered = sum(result in (broadcast.SENT, broadcast.RELAYED, broadcast.QUEUED) for result in results.values())
+        relayed = sum(result == broadcast.RELAYED for result in results.values())
+        via = f" (из них {relayed} через ретрансляторов)" if relayed else ""
+        print(f"✉️ Отправлено {delivered} из {len(results)} пирам{via}")
+
+    async def send_to(self, peer_id, message):
+        if self.is_connected(peer_id) or peer_id in self.reconnect_tasks:
+            result = (await self.broadcast(message, [peer_id])).get(peer_id)
+            if result in (broadcast.SENT, broadcast.QUEUED):
+                print(f"✉️ Отправлено {peer_id}")
+            else:
+                print(f"❌ Сообщение для {peer_id} не отправлено: {result}")
+        elif self.database is not None:
+            await asyncio.to_thread(self.database.outbox_add, message, [peer_id])
+            print(f"📥 {peer_id} не подключен, сообщение будет доставлено при подключении")
+            # The outbox drains as soon as the channel opens.
+            if peer_id in self.online_peers and peer_id not in self.peer_connections and peer_id not in self.dial_tasks:
+                task = self.dial_tasks[peer_id] = asyncio.create_task(self.connect_many([peer_id]))
+                task.add_done_callback(lambda _: self.dial_tasks.pop(peer_id, None))
+        else:
+            print(f"❌ Нет соединения с {peer_id}. Используйте 'call {peer_id}'")
+
+    def open_queues(self, peer_ids=None):
+        return {peer_id: queue for peer_id, queue in self.send_queues.items()
+                if (peer_ids is None or peer_id in peer_ids) and self.is_connected(peer_id)}
+
+    def apply_features(self, peer_id, features):
+        features = self.peer_features[peer_id] = set(features)
+        queue = self.send_queues.get(peer_id)
+        if queue is not None:
+            queue.coalesce = 'batch' in features
+            queue.codec = self.codec_for(peer_id) or protocol.CODEC_NONE
+
+    def codec_for(self, peer_id):
+        # None: legacy text frames; otherwise the envelope codec to use.
+        return protocol.pick_codec(self.peer_features.get(peer_id, ()))
+
+    def can_relay(self, peer_id):
+        return 'relay' in self.peer_features.get(peer_id, ())
+
+    async def broadcast(self, message, peer_ids=None, relay=True):
+        # Sends one message to many peers at once and returns
+        # {peer_id: broadcast.SENT | DROPPED | TIMEOUT | RELAYED | QUEUED}.
+        # The message is encoded once per wire format (legacy text or an
+        # envelope per codec) and that frame is shared by every queue. Large
+        # groups of relay-capable peers get a relay tree instead, so the
+        # uplink carries at most RELAY_FANOUT copies. With a database the
+        # message is first stored in the outbox for every peer that acks,
+        # under one id. Relay trees carry that id, and those peers ack it
+        # back up the tree with relay-acks; acking peers that can't do that
+        # get the message directly.
+        queues = self.open_queues(peer_ids)
+        reconnecting = [peer_id for peer_id in self.reconnect_tasks
+                        if peer_id in self.send_queues and (peer_ids is None or peer_id in peer_ids)]
+        acked = {peer_id for peer_id in [*queues, *reconnecting] if self.reliable(peer_id)}
+        if acked:
+            message_number = await asyncio.to_thread(self.database.outbox_add, message, sorted(acked))
+        else:
+            message_number = next(self.message_ids)
+        encoded = {}
+
+        def frame(peer_id):
+            key = (self.codec_for(peer_id), peer_id in acked)
+            if key not in encoded:
+                encoded[key] = protocol.encode_text(message, message_number, *key)
+            return encoded[key]
+
+        # Peers being reconnected get the message queued for replay, without
+        # waiting: the full queue of a peer that may never come back must not
+        # hold up this broadcast. Acking peers still have it in the outbox.
+        queued = {peer_id: broadcast.QUEUED if self.send_queues[peer_id].put_nowait(frame(peer_id))
+                  else broadcast.DROPPED for peer_id in reconnecting}
+        relays = [peer_id for peer_id in queues if self.can_relay(peer_id)
+                  and (peer_id not in acked or 'relay-ack' in self.peer_features.get(peer_id, ()))]
+        if not relay or len(relays) <= broadcast.RELAY_THRESHOLD:
+            results = await broadcast.fan_out({peer_id: (queue, frame(peer_id)) for peer_id, queue in queues.items()})
+            return {**results, **queued}
+        frames = {peer_id: (queue, frame(peer_id)) for peer_id, queue in queues.items() if peer_id not in relays}
+        message_id = broadcast.new_message_id()
+        item = {'id': message_id, 'origin': self.peer_id, 'text': message, 'fanout': broadcast.RELAY_FANOUT}
+        if acked:
+            item['ack'] = message_number
+        self.seen_relays.add(message_id, item, None)
+        groups = broadcast.split_groups(relays, broadcast.RELAY_FANOUT)
+        for head, *rest in groups:
+            self.seen_relays.hand_down(message_id, head, [head, *rest])
+            frames[head] = (queues[head], protocol.encode_relay(
+                message_id, self.peer_id, message, rest, broadcast.RELAY_FANOUT, self.codec_for(head), item.get('ack')))
+        results = await broadcast.fan_out(frames)
+        for head, *rest in groups:
+            for peer_id in rest:
+                results[peer_id] = broadcast.RELAYED if results[head] == broadcast.SENT else results[head]
+        return {**results, **queued}
+
+    def handle_control(self, peer_id, item):
+        kind = item['type']
+        if kind not in protocol.CONTROL_FIELDS:
+            return
+        if not protocol.check_control(item):
+            print(f"\n⚠️  Некорректная команда {kind} от {peer_id}")
+            return
+        if kind == 'relay':
+            if not self.seen_relays.add(item['id'], item, peer_id):
+                return
+            item['fanout'] = max(1, min(item['fanout'], broadcast.RELAY_FANOUT))
+            if item['targets']:
+                asyncio.ensure_future(self.forward_relay(peer_id, item))
+            asyncio.ensure_future(self.receive_relay(peer_id, item))
+        elif kind == 'relay-miss':
+            asyncio.ensure_future(self.resend_missed(item['id'], item['peers']))
+        elif kind == 'relay-ack':
+            self.on_relay_ack(peer_id, item['id'], item['peers'])
+        elif kind == 'signal':
+            asyncio.ensure_future(self.receive_inband(peer_id, item['signals']))
+        elif kind == 'ack' and self.database is not None:
+            asyncio.ensure_future(asyncio.to_thread(self.database.outbox_ack, peer_id, item['ids']))
+
+    async def receive_relay(self, upstream, item):
+        # Anyone in the tree could write any origin, so a relayed message is
+        # shown as the origin's only if the origin sent it to us itself or
+        # is a known contact. It is still forwarded either way.
+        origin = item['origin']
+        via = None if origin == upstream else upstream
+        if via is not None and not self.is_contact(origin):
+            print(f"\n⚠️  {upstream} переслал сообщение от {origin}, которого нет в контактах; не показано")
+            return
+        if 'ack' not in item or self.database is None:
+            self.show_message(origin, item['text'], via)
+            if self.database is not None:
+                await asyncio.to_thread(self.store_received, origin, [(None, item['text'])])
+            return
+        # Same uid as the origin's direct resend of this outbox entry would
+        # have, so the two are recognised as one message.
+        if await self.store_reliable(origin, [(f"{origin}:{item['ack']}", item['text'])], via):
+            self.queue_relay_ack(upstream, item['id'], [self.peer_id])
+
+    def on_relay_ack(self, downstream, message_id, peers):
+        # Acks travel back along the path the message came; at the origin
+        # they clear the outbox entry for those peers. A peer only acks for
+        # the subtree it was handed, so nobody can clear entries of peers
+        # that never got the message.
+        item, upstream = self.seen_relays.get(message_id)
+        if item is None:
+            return
+        subtree = self.seen_relays.subtree(message_id, downstream)
+        if any(peer_id not in subtree for peer_id in peers):
+            print(f"\n⚠️  {downstream} подтвердил доставку пирам вне своего поддерева; лишнее проигнорировано")
+            peers = [peer_id for peer_id in peers if peer_id in subtree]
+        if not peers:
+            return
+        if upstream is not None:
+            self.queue_relay_ack(upstream, message_id, peers)
+        elif 'ack' in item and self.database is not None:
+            asyncio.ensure_future(asyncio.to_thread(self.database.outbox_ack_peers, item['ack'], peers))
+
+    def queue_relay_ack(self, upstream, message_id, peers):
+        # A relay batches its own ack with those from its subtree.
+        key = (upstream, message_id)
+        self.relay_ack_outbox.setdefault(key, []).extend(peers)
+        if key not in self.relay_ack_tasks:
+            self.relay_ack_tasks[key] = asyncio.create_task(self.flush_relay_acks_later(key))
+
+    async def flush_relay_acks_later(self, key):
+        await asyncio.sleep(ACK_DELAY)
+        self.relay_ack_tasks.pop(key, None)
+        peers = self.relay_ack_outbox.pop(key, None)
+        upstream, message_id = key
+        queue = self.send_queues.get(upstream)
+        if peers and queue is not None:
+            await queue.put(protocol.encode_relay_ack(message_id, peers, self.codec_for(upstream)))
+
+    async def forward_relay(self, upstream, item):
+        queues = self.open_queues(item['targets'])
+        reachable = [peer_id for peer_id in item['targets'] if peer_id in queues and self.can_relay(peer_id)]
+        missed = [peer_id for peer_id in item['targets'] if peer_id not in reachable]
+        groups = broadcast.split_groups(reachable, item['fanout'])
+        for head, *rest in groups:
+            self.seen_relays.hand_down(item['id'], head, [head, *rest])
+        results = await broadcast.fan_out({head: (queues[head], protocol.encode_relay(
+            item['id'], item['origin'], item['text'], rest, item['fanout'], self.codec_for(head), item.get('ack')))
+            for head, *rest in groups})
+        for head, *rest in groups:
+            if results[head] != broadcast.SENT:
+                missed += [head, *rest]
+        if missed and upstream in self.send_queues:
+            await self.send_queues[upstream].put(
+                protocol.encode_relay_miss(item['id'], missed, self.codec_for(upstream)))
+
+    async def resend_missed(self, message_id, peers):
+        # Peers a relay could not reach get the message directly from us, or
+        # the miss goes further up the tree.
+        item, upstream = self.seen_relays.get(message_id)
+        if item is None:
+            return
+        queues = self.open_queues(peers)
+        frames = {peer_id: (queues[peer_id], protocol.encode_relay(
+            message_id, item['origin'], item['text'], [], item['fanout'], self.codec_for(peer_id), item.get('ack')))
+            for peer_id in peers if peer_id in queues and self.can_relay(peer_id)}
+        for peer_id in frames:
+            self.seen_relays.hand_down(message_id, peer_id, [peer_id])
+        results = await broadcast.fan_out(frames)
+        missed = [peer_id for peer_id in peers if results.get(peer_id) != broadcast.SENT]
+        if not missed:
+            return
+        if upstream in self.send_queues:
+            await self.send_queues[upstream].put(
+                protocol.encode_relay_miss(message_id, missed, self.codec_for(upstream)))
+        else:
+            print(f"\n⚠️  Сообщение не доставлено: {', '.join(missed)}")
+
+    def print_stats(self):
+        routes = self.signal_routes
+        print(f"\n📡 Сигналы: через data channel {routes['channel']}, через сервер {routes['server']}")
+        pending = self.database.outbox_counts() if self.database is not None else {}
+        if pending:
+            print("\n📥 Ждут подтверждения:")
+            for peer_id, count in sorted(pending.items(), key=lambda item: -item[1]):
+                print(f"  - {peer_id}: {count}")
+        if not self.send_queues:
+            print("\n📊 Нет очередей отправки")
+            return
+        print("\n📊 Очереди отправки:")
+        for peer_id, queue in sorted(self.send_queues.items(), key=lambda item: -item[1].depth):
+            stats = queue.stats()
+            p50, p99 = stats['latency_p50_ms'], stats['latency_p99_ms']
+            latency = f"{p50:.1f}/{p99:.1f} мс" if p50 is not None else "—"
+            print(f"  - {peer_id}: в очереди {stats['depth']} (макс. {stats['max_depth']}), "
+                  f"отправлено {stats['sent']} в {stats['frames']} кадрах, потеряно {stats['dropped']}, "
+                  f"буфер {stats['buffered_amount']} Б, задержка p50/p99 {latency}")
 
     async def connect_to_signaling(self):
+        # retry=True keeps trying with the client's exponential backoff
+        # instead of giving up when the server is not up yet. Whatever still
+        # fails is the caller's to report: the console exits, the GUI stays
+        # up with the local history.
         try:
-            await self.sio.connect(self.signaling_server)
-            await self.sio.emit('register', {'peer_id': self.peer_id})
+            await self.sio.connect(self.signaling_server, retry=True)
         except Exception as e:
-            print(f"❌ Не удалось подключиться к серверу: {e}")
-            sys.exit(1)
+            raise ConnectionError(f"Не удалось подключиться к серверу: {e}") from e
 
     async def input_loop(self):
         loop = asyncio.get_event_loop()
@@ -218,10 +1106,32 @@ class P2PMessenger:
                 if message.lower() == 'exit':
                     break
                 elif message.lower() == 'list':
-                    await self.sio.emit('get_peers', {})
+                    if self.presence_seq is None:
+                        await self.sio.emit('get_peers', {})
+                    else:
+                        self.print_peers(sorted(self.online_peers - {self.peer_id}))
                 elif message.lower(). startswith('call '):
                     peer_id = message. split()[1]
                     await self. call_peer(peer_id)
+                elif message.lower().startswith('connect '):
+                    targets = message.split()[1:]
+                    if targets == ['all']:
+                        targets = sorted(self.online_peers - {self.peer_id})
+                    asyncio.create_task(self.connect_and_report(targets))
+                elif message.lower() == 'stats':
+                    self.print_stats()
+                elif message.lower().startswith('msg '):
+                    parts = message.split(maxsplit=2)
+                    if len(parts) < 3:
+                        print("Использование: msg <peer_id> <текст>")
+                    else:
+                        await self.send_to(parts[1], parts[2])
+                elif message.lower().startswith('file '):
+                    parts = message.split(maxsplit=2)
+                    if len(parts) < 3:
+                        print("Использование: file <peer_id> <путь>")
+                    else:
+                        asyncio.create_task(self.send_file(parts[1], parts[2]))
                 else:
                     await self.send_message(message)
             except EOFError:
@@ -235,12 +1145,16 @@ class P2PMessenger:
         print(f"🌐 Сервер: {self.signaling_server}\n")
         await self.connect_to_signaling()
         await self.input_loop()
-        
-        for pc in self.peer_connections.values():
+        await self.close()
+        print("\n👋 До свидания!")
+
+    async def close(self):
+        self.closing = True
+        if self.migrate_task is not None:
+            self.migrate_task.cancel()
+        for pc in [*self.peer_connections.values(), *self.replaced_connections.values()]:
             await pc.close()
         await self.sio.disconnect()
-        
-        print("\n👋 До свидания!")
 
 async def main():
     if len(sys.argv) < 3:
@@ -251,8 +1165,13 @@ async def main():
     peer_id = sys.argv[1]
     signaling_server = sys.argv[2]
     
-    messenger = P2PMessenger(peer_id, signaling_server)
-    await messenger.run()
+    # One store per peer id, so several peers can run from one checkout.
+    messenger = P2PMessenger(peer_id, signaling_server, database=get_database(f'data/{peer_id}.db'))
+    try:
+        await messenger.run()
+    except ConnectionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     try:
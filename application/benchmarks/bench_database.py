@@ -0,0 +1,75 @@
+import sys
+import time
+import statistics
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database as db
+
+
+CONTACTS = 200
+MESSAGES_PER_CONTACT = 50
+ROUNDS = 200
+
+
+def seed(path):
+    store = db.Database(path)
+    with store.pool.connection() as connection, connection:
+        connection.executemany('INSERT INTO contacts (name) VALUES (?)',
+                               [(f"peer{i}",) for i in range(CONTACTS)])
+        connection.executemany('INSERT INTO messages (contact_id, message, direction) VALUES (?, ?, ?)',
+                               [(c + 1, f"message {m}", m % 2) for c in range(CONTACTS) for m in range(MESSAGES_PER_CONTACT)])
+    store.close()
+
+
+def measure(name, operation):
+    samples = []
+    for i in range(ROUNDS):
+        start = time.perf_counter()
+        operation(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<40} median {statistics.median(samples):8.3f} ms   p95 {p95:8.3f} ms")
+    return statistics.median(samples)
+
+
+def per_call(path, method):
+    # The old interface behaviour: a brand new Database for every click.
+    def operation(i):
+        store = db.Database(path)
+        method(store, i)
+        store.close()
+    return operation
+
+
+def shared(store, method):
+    def operation(i):
+        method(store, i)
+    return operation
+
+
+OPERATIONS = {
+    'get_contacts': lambda store, i: store.get_contacts(),
+    'get_messages': lambda store, i: store.get_messages(f"peer{i % CONTACTS}"),
+    'get_messages_before': lambda store, i: store.get_messages_before(f"peer{i % CONTACTS}"),
+    'add_message': lambda store, i: store.add_message(f"peer{i % CONTACTS}", "bench", direction=False),
+}
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'bench.db'
+        seed(path)
+        store = db.Database(path)
+        for name, method in OPERATIONS.items():
+            before = measure(f"{name} (Database() per call)", per_call(path, method))
+            after = measure(f"{name} (shared pool)", shared(store, method))
+            print(f"{'':<40} speedup x{before / after:.1f}\n")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
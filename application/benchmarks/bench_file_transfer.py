@@ -0,0 +1,94 @@
+import sys
+import os
+import asyncio
+import tempfile
+import logging
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiortc import RTCPeerConnection
+
+import file_transfer
+
+
+SIZE_MB = 32
+CHUNK_SIZES = (4 * 1024, 16 * 1024, 60 * 1024)
+
+logging.basicConfig(level=logging.WARNING)
+
+
+async def connect_pair():
+    # Two aiortc peers in one process, signalled directly over loopback.
+    sender, receiver = RTCPeerConnection(), RTCPeerConnection()
+    connected = asyncio.gather(*(wait_connected(pc) for pc in (sender, receiver)))
+    sender.createDataChannel('chat')
+    await sender.setLocalDescription(await sender.createOffer())
+    await receiver.setRemoteDescription(sender.localDescription)
+    await receiver.setLocalDescription(await receiver.createAnswer())
+    await sender.setRemoteDescription(receiver.localDescription)
+    await connected
+    return sender, receiver
+
+
+async def wait_connected(pc):
+    done = asyncio.get_running_loop().create_future()
+
+    @pc.on('connectionstatechange')
+    def on_state():
+        if pc.connectionState == 'connected' and not done.done():
+            done.set_result(None)
+    await done
+
+
+def accept_files(receiver, download_dir, results):
+    @receiver.on('datachannel')
+    def on_datachannel(channel):
+        if file_transfer.is_file_channel(channel):
+            file_transfer.FileReceiver(channel, download_dir, on_complete=results.put_nowait)
+
+
+async def transfer(sender, path, chunk_size, results):
+    sent = await file_transfer.send_file(sender, path, chunk_size)
+    received = await asyncio.wait_for(results.get(), 30)
+    return sent, received
+
+
+def report(name, sent, received):
+    status = "ok" if sent['ok'] and received['ok'] else "FAILED"
+    print(f"{name:<34} {sent['mb_per_s']:8.1f} MB/s   ({sent['seconds']:.2f} s, "
+          f"{sent['sent_bytes'] / 1e6:.0f} MB sent, {status})")
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source = tmp / 'payload.bin'
+        with open(source, 'wb') as f:
+            for _ in range(SIZE_MB):
+                f.write(os.urandom(1024 * 1024))
+        print(f"Loopback aiortc transfer of {SIZE_MB} MB\n")
+
+        sender, receiver = await connect_pair()
+        results = asyncio.Queue()
+        accept_files(receiver, tmp / 'downloads', results)
+
+        for chunk_size in CHUNK_SIZES:
+            sent, received = await transfer(sender, source, chunk_size, results)
+            report(f"chunk {chunk_size // 1024} KiB", sent, received)
+            received['path'].unlink()
+
+        # Resume: leave the first half of the file behind as a part file.
+        sha256 = file_transfer.file_sha256(source)
+        part = tmp / 'downloads' / f"{sha256[:16]}.part"
+        with open(source, 'rb') as f, open(part, 'wb') as out:
+            out.write(f.read(source.stat().st_size // 2))
+        sent, received = await transfer(sender, source, file_transfer.CHUNK_SIZE, results)
+        report(f"resume from chunk {sent['resumed_from']}", sent, received)
+
+        await sender.close()
+        await receiver.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
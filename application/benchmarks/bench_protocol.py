@@ -0,0 +1,75 @@
+import sys
+import time
+import random
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import protocol
+
+
+ROUNDS = 20000
+WORDS = ("привет как дела сегодня встреча в три часа ok hello see you soon "
+         "отправил файл посмотри пожалуйста спасибо").split()
+
+
+def sample(words):
+    return ' '.join(random.choice(WORDS) for _ in range(words))
+
+
+CASES = {
+    'short (≈55 B)': [sample(6) for _ in range(100)],
+    'medium (≈800 B)': [sample(80) for _ in range(100)],
+    'long (≈10 KB)': [sample(1000) for _ in range(20)],
+}
+
+
+def legacy_size(message):
+    # What the current plain-string frames put on the wire.
+    return len(message.encode())
+
+
+def bench(messages, codec):
+    rounds = max(1, ROUNDS // len(messages))
+    frames = [protocol.encode_text(message, n, codec) for n, message in enumerate(messages)]
+    size = sum(len(frame) if isinstance(frame, bytes) else legacy_size(frame) for frame in frames)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for n, message in enumerate(messages):
+            protocol.encode_text(message, n, codec)
+    encode = (time.perf_counter() - start) / (rounds * len(messages))
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for frame in frames:
+            protocol.decode(frame)
+    decode = (time.perf_counter() - start) / (rounds * len(messages))
+    return size / len(messages), encode, decode
+
+
+def bench_batch(messages, codec):
+    frames = [protocol.encode_text(message, n, codec) for n, message in enumerate(messages)]
+    batch = protocol.encode_batch(frames, codec)
+    return len(batch) if isinstance(batch, bytes) else legacy_size(batch)
+
+
+def main():
+    random.seed(1)
+    formats = [('legacy str', None), ('envelope', protocol.CODEC_NONE)]
+    formats += [(f'envelope+{protocol.CODEC_NAMES[codec]}', codec) for codec in protocol.CODECS]
+    print(f"{'':<18} {'format':<16} {'bytes/msg':>10} {'encode µs':>10} {'decode µs':>10}")
+    for case, messages in CASES.items():
+        for name, codec in formats:
+            size, encode, decode = bench(messages, codec)
+            print(f"{case:<18} {name:<16} {size:10.0f} {encode * 1e6:10.2f} {decode * 1e6:10.2f}")
+        print()
+
+    short = CASES['short (≈55 B)'][:50]
+    print("Batch of 50 short messages (one frame):")
+    for name, codec in formats:
+        print(f"  {name:<16} {bench_batch(short, codec):6d} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import sys
+import time
+import sqlite3
+import asyncio
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database as db
+
+
+CONTACTS = 50
+MESSAGES = 5000
+
+
+def seed(path):
+    store = db.Database(path)
+    for i in range(CONTACTS):
+        store.add_contact(f"peer{i}")
+    store.close()
+
+
+def report(name, elapsed):
+    print(f"{name:<45} {MESSAGES / elapsed:10.0f} msg/s   ({elapsed * 1000:.0f} ms)")
+    return elapsed
+
+
+def bench_legacy(path):
+    # The original add_message: rollback journal, SELECT + INSERT + commit per message.
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode = DELETE')
+    cursor = connection.cursor()
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        cursor.execute('SELECT id FROM contacts WHERE name = ?', (f"peer{i % CONTACTS}",))
+        contact_id = cursor.fetchone()[0]
+        cursor.execute('INSERT INTO messages (contact_id, message, direction) VALUES (?, ?, ?)', (contact_id, f"message {i}", True))
+        connection.commit()
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return elapsed
+
+
+def bench_add_message(path):
+    store = db.Database(path)
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        store.add_message(f"peer{i % CONTACTS}", f"message {i}")
+    elapsed = time.perf_counter() - start
+    store.close()
+    return elapsed
+
+
+def bench_write_behind(path):
+    store = db.Database(path)
+
+    async def fan_out():
+        for i in range(MESSAGES):
+            store.queue_message(f"peer{i % CONTACTS}", f"message {i}")
+        await store.flush_async(durable=True)
+
+    start = time.perf_counter()
+    asyncio.run(fan_out())
+    elapsed = time.perf_counter() - start
+    store.close()
+    return elapsed
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name, bench in (('per-message commit (before)', bench_legacy),
+                            ('add_message, WAL + cached contact ids', bench_add_message),
+                            ('queue_message + durable flush (after)', bench_write_behind)):
+            path = Path(tmp) / f"{bench.__name__}.db"
+            seed(path)
+            results[name] = report(name, bench(path))
+        before, after = results['per-message commit (before)'], results['queue_message + durable flush (after)']
+        print(f"\nspeedup x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import asyncio
+import uuid
+from collections import OrderedDict
+
+
+SENT = 'sent'
+DROPPED = 'dropped'
+TIMEOUT = 'timeout'
+RELAYED = 'relayed'
+QUEUED = 'queued'
+UNREACHABLE = 'unreachable'
+
+SEND_TIMEOUT = 10
+# Above this many recipients a broadcast goes out as a relay tree: the
+# sender uploads at most RELAY_FANOUT copies and relays forward the rest.
+RELAY_THRESHOLD = 16
+RELAY_FANOUT = 4
+SEEN_IDS = 4096
+
+
+def new_message_id():
+    return uuid.uuid4().hex
+
+
+def split_groups(targets, fanout):
+    # Contiguous groups of near-equal size; the head of each group relays the
+    # message to the rest of it.
+    groups = []
+    count = min(fanout, len(targets))
+    start = 0
+    for index in range(count):
+        size = (len(targets) - start) // (count - index)
+        groups.append(targets[start:start + size])
+        start += size
+    return groups
+
+
+async def fan_out(frames, timeout=SEND_TIMEOUT):
+    # frames: {peer_id: (queue, frame)}. Every frame is sent concurrently;
+    # returns {peer_id: SENT | DROPPED | TIMEOUT}.
+    async def send(queue, frame):
+        try:
+            return SENT if await asyncio.wait_for(queue.send(frame), timeout) else DROPPED
+        except asyncio.TimeoutError:
+            return TIMEOUT
+    peer_ids = list(frames)
+    results = await asyncio.gather(*(send(*frames[peer_id]) for peer_id in peer_ids))
+    return dict(zip(peer_ids, results))
+
+
+class SeenRelays:
+    # Bounded map of recent relay message ids to (message, upstream peer), so
+    # a message that reaches a peer twice is shown once and relay misses can
+    # be resent directly or passed further up the tree.
+    # Each message also remembers which peers every downstream peer was
+    # handed, so acks coming back up can only speak for those.
+    def __init__(self, size=SEEN_IDS):
+        self.size = size
+        self.items = OrderedDict()
+        self.subtrees = {}
+
+    def add(self, message_id, message, upstream):
+        if message_id in self.items:
+            return False
+        self.items[message_id] = (message, upstream)
+        self.subtrees[message_id] = {}
+        if len(self.items) > self.size:
+            oldest, _ = self.items.popitem(last=False)
+            del self.subtrees[oldest]
+        return True
+
+    def get(self, message_id):
+        return self.items.get(message_id, (None, None))
+
+    def hand_down(self, message_id, peer_id, peers):
+        subtrees = self.subtrees.get(message_id)
+        if subtrees is not None:
+            subtrees.setdefault(peer_id, set()).update(peers)
+
+    def subtree(self, message_id, peer_id):
+        return self.subtrees.get(message_id, {}).get(peer_id, ())
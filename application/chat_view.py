@@ -0,0 +1,223 @@
+from PySide6.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QRect, QRectF
+from PySide6.QtGui import QColor, QFont, QFontMetrics, QPainter
+import database as db
+
+
+MessageIdRole = Qt.UserRole + 1
+DirectionRole = Qt.UserRole + 2
+
+BUBBLE_MAX_WIDTH = 600
+BUBBLE_RADIUS = 15
+PADDING_H = 16
+PADDING_V = 12
+MARGIN = 20
+SPACING = 10
+INCOMING_COLOR = QColor("#2d3a3d")
+OUTGOING_COLOR = QColor("#2d4532")
+TEXT_COLOR = QColor("#ffffff")
+
+
+class MessageModel(QAbstractListModel):
+    # Holds only the pages the user has actually scrolled through. Rows are
+    # (id, message, direction); messages shown before they reach the database
+    # get negative local ids. Pages are read through a DatabaseWorker, so the
+    # GUI thread never waits on sqlite.
+    def __init__(self, worker, parent=None):
+        super().__init__(parent)
+        self.worker = worker
+        self.contact = None
+        self._rows = []
+        self._has_older = False
+        self._fetching = False
+        self._at_top = False
+        self._local_id = 0
+
+    def set_contact(self, contact):
+        self.beginResetModel()
+        self.contact = contact
+        self._rows = []
+        self._has_older = False
+        self._fetching = contact is not None
+        self.endResetModel()
+        if contact is None:
+            self.worker.cancel('history')
+            return
+        # Switching chats supersedes any page still loading for the old one.
+        self.worker.submit(self.worker.database.get_messages_before, contact,
+                           callback=self._on_latest_page, error_callback=self._on_page_failed, key='history')
+
+    def _on_latest_page(self, rows):
+        self._fetching = False
+        self._has_older = len(rows) == db.PAGE_SIZE
+        # Messages sent while the page was loading are already shown as local
+        # rows; the page may have picked some of them up from the database too.
+        local = [row[1:] for row in self._rows]
+        for count in range(min(len(local), len(rows)), 0, -1):
+            if [row[1:] for row in rows[-count:]] == local[:count]:
+                del rows[-count:]
+                break
+        if rows:
+            self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+            self._rows[0:0] = rows
+            self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        message_id, message, direction = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            return message
+        if role == MessageIdRole:
+            return message_id
+        if role == DirectionRole:
+            return direction
+        return None
+
+    def set_at_top(self, at_top):
+        self._at_top = at_top
+
+    def canFetchMore(self, parent):
+        # Older history is prepended, so only the top edge of the view may
+        # pull it in; Qt's own "last row visible" prefetch is ignored otherwise.
+        return not parent.isValid() and self._has_older and self._at_top and not self._fetching
+
+    def fetchMore(self, parent):
+        if parent.isValid() or not self._has_older or self._fetching or not self._rows:
+            return
+        self._fetching = True
+        self.worker.submit(self.worker.database.get_messages_before, self.contact, self._rows[0][0],
+                           callback=self._on_older_page, error_callback=self._on_page_failed, key='history')
+
+    def _on_page_failed(self, error):
+        # Not stuck "fetching": the next scroll to the top asks again.
+        self._fetching = False
+
+    def _on_older_page(self, rows):
+        self._fetching = False
+        self._has_older = len(rows) == db.PAGE_SIZE
+        if rows:
+            self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+            self._rows[0:0] = rows
+            self.endInsertRows()
+
+    def append_message(self, message, direction):
+        self.append_messages([message], direction)
+
+    def append_messages(self, messages, direction):
+        # A burst of messages is one row insertion, so the view lays out
+        # and repaints once.
+        if not messages:
+            return
+        row = len(self._rows)
+        self.beginInsertRows(QModelIndex(), row, row + len(messages) - 1)
+        for message in messages:
+            self._local_id -= 1
+            self._rows.append((self._local_id, message, direction))
+        self.endInsertRows()
+
+
+class MessageDelegate(QStyledItemDelegate):
+    # Paints bubbles directly instead of building a widget per message and
+    # caches the wrapped text size per message id for the current width.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.font = QFont()
+        self.font.setPixelSize(15)
+        self.metrics = QFontMetrics(self.font)
+        self._sizes = {}
+        self._width = None
+
+    def clear_cache(self):
+        self._sizes.clear()
+
+    def _text_size(self, index, width):
+        if width != self._width:
+            self._width = width
+            self._sizes.clear()
+        key = index.data(MessageIdRole)
+        size = self._sizes.get(key)
+        if size is None:
+            available = max(1, min(BUBBLE_MAX_WIDTH, width - 2 * MARGIN) - 2 * PADDING_H)
+            rect = self.metrics.boundingRect(QRect(0, 0, available, 1 << 20),
+                                             Qt.TextWordWrap, index.data(Qt.DisplayRole))
+            size = self._sizes[key] = QSize(min(rect.width(), available), rect.height())
+        return size
+
+    def sizeHint(self, option, index):
+        width = self.parent().viewport().width()
+        text_size = self._text_size(index, width)
+        return QSize(width, text_size.height() + 2 * PADDING_V + SPACING)
+
+    def paint(self, painter, option, index):
+        text_size = self._text_size(index, self.parent().viewport().width())
+        bubble_width = text_size.width() + 2 * PADDING_H
+        bubble_height = text_size.height() + 2 * PADDING_V
+        rect = option.rect
+        incoming = index.data(DirectionRole) == 1
+        left = rect.left() + MARGIN if incoming else rect.right() - MARGIN - bubble_width + 1
+        bubble = QRectF(left, rect.top() + SPACING / 2, bubble_width, bubble_height)
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(INCOMING_COLOR if incoming else OUTGOING_COLOR)
+        painter.drawRoundedRect(bubble, BUBBLE_RADIUS, BUBBLE_RADIUS)
+        painter.setPen(TEXT_COLOR)
+        painter.setFont(self.font)
+        painter.drawText(bubble.adjusted(PADDING_H, PADDING_V, -PADDING_H, -PADDING_V),
+                         Qt.TextWordWrap, index.data(Qt.DisplayRole))
+        painter.restore()
+
+
+class ChatView(QListView):
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.setItemDelegate(MessageDelegate(self))
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setFocusPolicy(Qt.NoFocus)
+        self.setUniformItemSizes(False)
+        self.setResizeMode(QListView.Adjust)
+        self._stick_to_bottom = True
+        self._anchor = None
+        scroll_bar = self.verticalScrollBar()
+        scroll_bar.rangeChanged.connect(self._on_range_changed)
+        model.modelReset.connect(self._on_model_reset)
+        model.rowsAboutToBeInserted.connect(self._on_rows_about_to_be_inserted)
+
+    def _on_model_reset(self):
+        self.itemDelegate().clear_cache()
+        self._stick_to_bottom = True
+        self._anchor = None
+        self.scrollToBottom()
+
+    def _on_rows_about_to_be_inserted(self, parent, first, last):
+        scroll_bar = self.verticalScrollBar()
+        if first == 0 and self.model().rowCount() > 0:
+            # Keep the message under the cursor in place while older rows
+            # are prepended above it.
+            self._anchor = scroll_bar.maximum() - scroll_bar.value()
+
+    def _on_range_changed(self, minimum, maximum):
+        scroll_bar = self.verticalScrollBar()
+        if self._anchor is not None:
+            scroll_bar.setValue(maximum - self._anchor)
+            self._anchor = None
+        elif self._stick_to_bottom:
+            scroll_bar.setValue(maximum)
+        self.model().set_at_top(scroll_bar.value() == minimum)
+
+    def verticalScrollbarValueChanged(self, value):
+        scroll_bar = self.verticalScrollBar()
+        self._stick_to_bottom = value == scroll_bar.maximum()
+        model = self.model()
+        model.set_at_top(value == scroll_bar.minimum())
+        if model.canFetchMore(QModelIndex()):
+            model.fetchMore(QModelIndex())
+        super().verticalScrollbarValueChanged(value)
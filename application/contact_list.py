@@ -0,0 +1,101 @@
+from PySide6.QtWidgets import QListView, QAbstractItemView
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex
+from PySide6.QtGui import QFont
+
+
+class ContactModel(QAbstractListModel):
+    # Contacts in insertion order. Adding appends a row, removing drops one
+    # and changing the active contact only repaints the two affected rows;
+    # nothing is rebuilt and no stylesheet is reparsed. Per-item state is
+    # exposed through model roles: Qt stylesheets cannot select list items by
+    # dynamic property, so the active contact is marked with FontRole while
+    # the shared APP_STYLESHEET covers everything else.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._names = []
+        self._rows = {}
+        self.active = None
+        self._active_font = QFont()
+        self._active_font.setPixelSize(16)
+        self._active_font.setBold(True)
+
+    def set_contacts(self, names):
+        self.beginResetModel()
+        self._names = list(dict.fromkeys(names))
+        self._rows = {name: row for row, name in enumerate(self._names)}
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        name = self._names[index.row()]
+        if role == Qt.DisplayRole:
+            return name
+        if role == Qt.FontRole and name == self.active:
+            return self._active_font
+        return None
+
+    def index_of(self, name):
+        row = self._rows.get(name)
+        if row is None:
+            return QModelIndex()
+        return self.index(row, 0)
+
+    def add_contact(self, name):
+        row = self._rows.get(name)
+        if row is not None:
+            return self.index(row, 0)
+        row = len(self._names)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._names.append(name)
+        self._rows[name] = row
+        self.endInsertRows()
+        return self.index(row, 0)
+
+    def remove_contact(self, name):
+        row = self._rows.pop(name, None)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._names[row]
+        # Only the rows after the removed one shift.
+        for tail, contact in enumerate(self._names[row:], row):
+            self._rows[contact] = tail
+        self.endRemoveRows()
+        if name == self.active:
+            self.active = None
+
+    def set_active(self, name):
+        previous, self.active = self.active, name
+        if previous == name:
+            return
+        for contact in (previous, name):
+            row = self._rows.get(contact)
+            if row is not None:
+                index = self.index(row, 0)
+                self.dataChanged.emit(index, index, [Qt.FontRole])
+
+
+class ContactListView(QListView):
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setObjectName("contacts")
+        self.setModel(model)
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.setSpacing(2)
+
+    def select_contact(self, name):
+        index = self.model().index_of(name)
+        if index.isValid():
+            self.setCurrentIndex(index)
+            self.scrollTo(index)
+        else:
+            self.clearSelection()
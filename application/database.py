@@ -1,79 +1,585 @@
 import sqlite3
+import sys
 import json
+import atexit
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 
+DEFAULT_DB_PATH = 'data/nexus.db'
+POOL_SIZE = 4
+PAGE_SIZE = 50
+WRITE_BATCH_SIZE = 500
+# A batch that fails to commit is kept and retried after these delays (the
+# last one repeats): received messages may already be acked to the sender,
+# so the writer never drops them.
+WRITE_RETRY_DELAYS = (0.1, 0.5, 1, 5)
+OUTBOX_PAGE = 500
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA busy_timeout = 5000',
+)
+
+# Applied in order on top of the base tables; PRAGMA user_version records
+# how many of them a database file has already seen.
+MIGRATIONS = [
+    '''
+    CREATE INDEX IF NOT EXISTS idx_messages_contact_id ON messages(contact_id, id);
+    ''',
+    # Full-text index over message bodies. New rows are indexed by triggers;
+    # rows that existed before the migration are picked up by
+    # backfill_search_index() up to `backfill_upto`.
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        message, content='messages', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    CREATE TABLE IF NOT EXISTS search_state (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    INSERT OR REPLACE INTO search_state (key, value) SELECT 'backfill_upto', COALESCE(MAX(id), 0) FROM messages;
+    INSERT OR REPLACE INTO search_state (key, value) VALUES ('backfill_position', 0);
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+    WHEN old.id > (SELECT value FROM search_state WHERE key = 'backfill_upto')
+      OR old.id <= (SELECT value FROM search_state WHERE key = 'backfill_position') BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message ON messages
+    WHEN old.id > (SELECT value FROM search_state WHERE key = 'backfill_upto')
+      OR old.id <= (SELECT value FROM search_state WHERE key = 'backfill_position') BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+    END;
+    ''',
+    # Store-and-forward: an outgoing message stays in the outbox for every
+    # recipient until that recipient acks it. Received messages carry the
+    # sender's uid so retransmissions are stored once. Outbox ids start at a
+    # random point so a fresh database never reuses ids that peers have
+    # already seen from this sender.
+    '''
+    ALTER TABLE messages ADD COLUMN uid TEXT;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_uid ON messages(uid) WHERE uid IS NOT NULL;
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS outbox_recipients (
+        peer TEXT NOT NULL,
+        message_id INTEGER NOT NULL REFERENCES outbox(id),
+        PRIMARY KEY (peer, message_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_outbox_recipients_message ON outbox_recipients(message_id);
+    INSERT INTO sqlite_sequence (name, seq) VALUES ('outbox', abs(random() % 281474976710656));
+    ''',
+    # Contacts the user added, as opposed to peers that only messaged us and
+    # got a row so their messages could be stored. Only the former may send
+    # files or be named as the origin of a relayed message. An existing
+    # contact counts as added if the user ever wrote to them.
+    '''
+    ALTER TABLE contacts ADD COLUMN added_by_user INTEGER NOT NULL DEFAULT 0;
+    UPDATE contacts SET added_by_user = 1 WHERE id IN (SELECT contact_id FROM messages WHERE direction = 0);
+    ''',
+    # History is paged by (contact_id, id); the timestamp index the first
+    # migration used to create served no query and only slowed down inserts.
+    '''
+    DROP INDEX IF EXISTS idx_messages_contact_timestamp;
+    ''',
+]
+SEARCH_BACKFILL_BATCH = 5000
+
+
+def fts_query(text):
+    # Every word is quoted so user input can't inject FTS5 syntax; the last
+    # one is a prefix match so results show up while typing.
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class ConnectionPool:
+    # Connections are opened lazily up to `size` and handed out LIFO so the
+    # hottest connection (with a warm page cache) is reused first.
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    def acquire(self, timeout=None):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError('Connection pool is closed')
+            if len(self._connections) < self.size:
+                connection = self._connect()
+                self._connections.append(connection)
+                return connection
+        return self._idle.get(timeout=timeout)
+
+    def release(self, connection):
+        if self._closed:
+            return
+        self._idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+class MessageWriter:
+    # Write-behind queue drained by a single thread. Everything that piles up
+    # while a transaction is in flight goes into the next executemany, so a
+    # burst of N messages costs a handful of commits instead of N.
+    def __init__(self, database, batch_size=WRITE_BATCH_SIZE):
+        self.database = database
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='nexus-db-writer', daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def put(self, contact_name, message, direction=True, uid=None):
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        self._queue.put((contact_name, message, direction, timestamp, uid))
+
+    def flush(self, durable=False):
+        # Resolves once everything queued before the call is committed; with
+        # durable=True the WAL is also checkpointed to the main database file.
+        future = Future()
+        self._queue.put((future, durable))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        pending, failures, stop = [], 0, False
+        while True:
+            batch, waiters, stopped = pending, [], False
+            while not stop and len(batch) < self.batch_size:
+                # Blocks only while there is nothing to write.
+                try:
+                    item = self._queue.get(block=not batch and not waiters)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = stopped = True
+                elif len(item) == 2:
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+            error = None
+            try:
+                if batch:
+                    self.database._write_messages(batch)
+                if any(durable for _, durable in waiters):
+                    with self.database.pool.connection() as connection:
+                        connection.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            except Exception as e:
+                error = e
+                print(f"Error writing messages: {e}")
+            # A flush fails as soon as a write does, so nothing queued before
+            # it is acked until it is really stored.
+            for future, _ in waiters:
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(len(batch))
+            done = len(waiters) + stopped
+            pending = []
+            if error and batch:
+                failures += 1
+                if stop and failures > len(WRITE_RETRY_DELAYS):
+                    print(f"Error writing messages: {len(batch)} not stored on close")
+                    done += len(batch)
+                else:
+                    # Rows stay unfinished in the queue's count until stored.
+                    pending = batch
+                    time.sleep(WRITE_RETRY_DELAYS[min(failures, len(WRITE_RETRY_DELAYS)) - 1])
+            else:
+                failures = 0
+                done += len(batch)
+            for _ in range(done):
+                self._queue.task_done()
+            if stop and not pending:
+                return
+
+
 class Database:
-    def __init__(self, db_path='data/nexus.db'):
+    def __init__(self, db_path=DEFAULT_DB_PATH, pool_size=POOL_SIZE):
         Path(db_path).parent.mkdir(parents=True, exist_ok=True)
         self.db_path = Path(db_path)
-        self.connection = sqlite3.connect(self.db_path)
-        self.cursor = self.connection.cursor()
+        self.pool = ConnectionPool(self.db_path, pool_size)
+        self._contact_ids = {}
+        self._user_contacts = set()
+        self._writer = None
+        self._writer_lock = threading.Lock()
         self.initialize_database()
 
     def initialize_database(self):
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS contacts (
-                id INTEGER PRIMARY KEY,
-                name TEXT UNIQUE NOT NULL
-            )
-        ''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY,
-                contact_id INTEGER,
-                message TEXT,
-                direction boolean DEFAULT 1,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(contact_id) REFERENCES contacts(id)
-            )
-        ''')
-        self.connection.commit()
-
-    def add_contact(self, name):
-        try:
-            self.cursor.execute('INSERT INTO contacts (name) VALUES (?)', (name,))
-            self.connection.commit()
-        except sqlite3.IntegrityError:
-            pass
+        with self.pool.connection() as connection, connection:
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS contacts (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL
+                )
+            ''')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    contact_id INTEGER,
+                    message TEXT,
+                    direction boolean DEFAULT 1,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(contact_id) REFERENCES contacts(id)
+                )
+            ''')
+            self.migrate(connection)
+
+    def migrate(self, connection):
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            connection.executescript(f'BEGIN; {script} PRAGMA user_version = {number}; COMMIT;')
+
+    @property
+    def writer(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = MessageWriter(self)
+            return self._writer
+
+    def add_contact(self, name, added_by_user=True):
+        # Adding by hand also promotes a peer that was only stored as a sender.
+        with self.pool.connection() as connection, connection:
+            connection.execute('INSERT INTO contacts (name, added_by_user) VALUES (?, ?) '
+                               'ON CONFLICT(name) DO UPDATE SET added_by_user = MAX(added_by_user, excluded.added_by_user)',
+                               (name, int(added_by_user)))
+            self._contact_id(connection, name)
+        if added_by_user:
+            self._user_contacts.add(name)
 
     def add_message(self, contact_name, message, direction=True):
         try:
-            self.cursor.execute('SELECT id FROM contacts WHERE name = ?', (contact_name,))
-            contact = self.cursor.fetchone()
-            if contact:
-                contact_id = contact[0]
-                self.cursor.execute('INSERT INTO messages (contact_id, message, direction) VALUES (?, ?, ?)', (contact_id, message, direction))
-                self.connection.commit()
+            with self.pool.connection() as connection, connection:
+                contact_id = self._contact_id(connection, contact_name)
+                if contact_id is not None:
+                    connection.execute('INSERT INTO messages (contact_id, message, direction) VALUES (?, ?, ?)', (contact_id, message, direction))
         except Exception as e:
             print(f"Error adding message: {e}")
 
+    def queue_message(self, contact_name, message, direction=True, uid=None):
+        self.writer.put(contact_name, message, direction, uid)
+
+    def flush(self, durable=False):
+        if self._writer is None:
+            future = Future()
+            future.set_result(0)
+            return future
+        return self._writer.flush(durable)
+
+    async def flush_async(self, durable=False):
+        return await asyncio.wrap_future(self.flush(durable))
+
+    def _sync_writes(self):
+        # Reads see everything queued before them.
+        if self._writer is not None and self._writer.pending:
+            self._writer.flush().result()
+
+    def _write_messages(self, batch):
+        with self.pool.connection() as connection:
+            # Received messages are acked to their sender once this commits,
+            # so the commit has to survive an OS crash: FULL syncs the WAL on
+            # commit, NORMAL only at the next checkpoint. The batch pays for
+            # one fsync however many messages it holds.
+            connection.execute('PRAGMA synchronous = FULL')
+            try:
+                with connection:
+                    rows = []
+                    for contact_name, message, direction, timestamp, uid in batch:
+                        contact_id = self._contact_id(connection, contact_name)
+                        if contact_id is not None:
+                            rows.append((contact_id, message, direction, timestamp, uid))
+                    # A uid that is already stored is a retransmission; skip it.
+                    connection.executemany('INSERT OR IGNORE INTO messages (contact_id, message, direction, timestamp, uid) VALUES (?, ?, ?, ?, ?)', rows)
+            finally:
+                connection.execute('PRAGMA synchronous = NORMAL')
+
+    def known_uids(self, uids):
+        self._sync_writes()
+        known = set()
+        uids = list(uids)
+        with self.pool.connection() as connection:
+            for start in range(0, len(uids), OUTBOX_PAGE):
+                chunk = uids[start:start + OUTBOX_PAGE]
+                known.update(row[0] for row in connection.execute(
+                    f'SELECT uid FROM messages WHERE uid IN ({",".join("?" * len(chunk))})', chunk))
+        return known
+
+    def outbox_add(self, message, peers):
+        # One row per message however many recipients it has; returns its id.
+        with self.pool.connection() as connection, connection:
+            message_id = connection.execute('INSERT INTO outbox (message) VALUES (?)', (message,)).lastrowid
+            connection.executemany('INSERT INTO outbox_recipients (peer, message_id) VALUES (?, ?)',
+                                   [(peer, message_id) for peer in peers])
+        return message_id
+
+    def outbox_pending(self, peer, after_id=0, limit=OUTBOX_PAGE):
+        # Keyset page of (id, message) not yet acked by `peer`, oldest first.
+        with self.pool.connection() as connection:
+            return connection.execute('''
+                SELECT o.id, o.message FROM outbox_recipients r
+                JOIN outbox o ON o.id = r.message_id
+                WHERE r.peer = ? AND r.message_id > ?
+                ORDER BY r.message_id LIMIT ?
+            ''', (peer, after_id, limit)).fetchall()
+
+    def outbox_ack(self, peer, message_ids):
+        rows = [(message_id,) for message_id in message_ids]
+        with self.pool.connection() as connection, connection:
+            connection.executemany('DELETE FROM outbox_recipients WHERE peer = ? AND message_id = ?',
+                                   [(peer, message_id) for message_id in message_ids])
+            connection.executemany('''
+                DELETE FROM outbox WHERE id = ?1
+                AND NOT EXISTS (SELECT 1 FROM outbox_recipients WHERE message_id = ?1)
+            ''', rows)
+
+    def outbox_ack_peers(self, message_id, peers):
+        # One message acked by many peers at once, as relay acks arrive.
+        with self.pool.connection() as connection, connection:
+            connection.executemany('DELETE FROM outbox_recipients WHERE peer = ? AND message_id = ?',
+                                   [(peer, message_id) for peer in peers])
+            connection.execute('''
+                DELETE FROM outbox WHERE id = ?1
+                AND NOT EXISTS (SELECT 1 FROM outbox_recipients WHERE message_id = ?1)
+            ''', (message_id,))
+
+    def outbox_counts(self):
+        with self.pool.connection() as connection:
+            return dict(connection.execute('SELECT peer, COUNT(*) FROM outbox_recipients GROUP BY peer'))
+
+    def is_contact(self, name):
+        # Added by the user, not merely someone whose messages are stored.
+        if name in self._user_contacts:
+            return True
+        with self.pool.connection() as connection:
+            row = connection.execute('SELECT added_by_user FROM contacts WHERE name = ?', (name,)).fetchone()
+        if row is None or not row[0]:
+            return False
+        self._user_contacts.add(name)
+        return True
+
     def get_contacts(self):
-        self.cursor.execute('SELECT name FROM contacts')
-        return [row[0] for row in self.cursor.fetchall()]
+        with self.pool.connection() as connection:
+            return [row[0] for row in connection.execute('SELECT name FROM contacts')]
 
     def get_messages(self, contact_name):
-        self.cursor.execute('''
-            SELECT m.message, m.direction FROM messages m
-            JOIN contacts c ON m.contact_id = c.id
-            WHERE c.name = ?
-            ORDER BY m.timestamp ASC
-        ''', (contact_name,))
-        return self.cursor.fetchall()
-    
+        self._sync_writes()
+        with self.pool.connection() as connection:
+            return connection.execute('''
+                SELECT m.message, m.direction FROM messages m
+                JOIN contacts c ON m.contact_id = c.id
+                WHERE c.name = ?
+                ORDER BY m.id ASC
+            ''', (contact_name,)).fetchall()
+
+    def _contact_id(self, connection, contact_name):
+        contact_id = self._contact_ids.get(contact_name)
+        if contact_id is None:
+            contact = connection.execute('SELECT id FROM contacts WHERE name = ?', (contact_name,)).fetchone()
+            if contact:
+                contact_id = self._contact_ids[contact_name] = contact[0]
+        return contact_id
+
+    def get_messages_before(self, contact_name, before_id=None, limit=PAGE_SIZE):
+        # Keyset page: the newest `limit` messages older than `before_id`
+        # (or the newest overall), returned oldest first as (id, message, direction).
+        self._sync_writes()
+        with self.pool.connection() as connection:
+            contact_id = self._contact_id(connection, contact_name)
+            if contact_id is None:
+                return []
+            if before_id is None:
+                rows = connection.execute('''
+                    SELECT id, message, direction FROM messages
+                    WHERE contact_id = ?
+                    ORDER BY id DESC LIMIT ?
+                ''', (contact_id, limit)).fetchall()
+            else:
+                rows = connection.execute('''
+                    SELECT id, message, direction FROM messages
+                    WHERE contact_id = ? AND id < ?
+                    ORDER BY id DESC LIMIT ?
+                ''', (contact_id, before_id, limit)).fetchall()
+        rows.reverse()
+        return rows
+
+    def get_messages_after(self, contact_name, after_id=0, limit=PAGE_SIZE):
+        self._sync_writes()
+        with self.pool.connection() as connection:
+            contact_id = self._contact_id(connection, contact_name)
+            if contact_id is None:
+                return []
+            return connection.execute('''
+                SELECT id, message, direction FROM messages
+                WHERE contact_id = ? AND id > ?
+                ORDER BY id ASC LIMIT ?
+            ''', (contact_id, after_id, limit)).fetchall()
+
+    def iter_messages(self, contact_name, after_id=0, batch_size=PAGE_SIZE):
+        # Streams the history in keyset batches; the pooled connection is only
+        # held while a batch is read, never across yields.
+        while True:
+            rows = self.get_messages_after(contact_name, after_id, batch_size)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+
+    def search_messages(self, query, contact_name=None, limit=PAGE_SIZE, offset=0, markers=('[', ']')):
+        # Ranked by bm25; returns (id, contact, snippet, direction) rows.
+        match = fts_query(query)
+        if not match:
+            return []
+        self._sync_writes()
+        sql = '''
+            SELECT m.id, c.name, snippet(messages_fts, 0, ?, ?, '…', 12), m.direction
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            JOIN contacts c ON c.id = m.contact_id
+            WHERE messages_fts MATCH ?
+        '''
+        params = [markers[0], markers[1], match]
+        with self.pool.connection() as connection:
+            if contact_name is not None:
+                contact_id = self._contact_id(connection, contact_name)
+                if contact_id is None:
+                    return []
+                sql += ' AND m.contact_id = ?'
+                params.append(contact_id)
+            sql += ' ORDER BY messages_fts.rank LIMIT ? OFFSET ?'
+            params += [limit, offset]
+            return connection.execute(sql, params).fetchall()
+
+    def backfill_search_index(self, batch_size=SEARCH_BACKFILL_BATCH):
+        # Indexes pre-existing messages a batch per transaction and records
+        # progress, so it can be interrupted and resumed. Yields (done, total).
+        while True:
+            with self.pool.connection() as connection, connection:
+                position, upto = [connection.execute('SELECT value FROM search_state WHERE key = ?', (key,)).fetchone()[0]
+                                  for key in ('backfill_position', 'backfill_upto')]
+                if position >= upto:
+                    return
+                end = connection.execute('''
+                    SELECT MAX(id) FROM (
+                        SELECT id FROM messages WHERE id > ? AND id <= ? ORDER BY id LIMIT ?
+                    )
+                ''', (position, upto, batch_size)).fetchone()[0] or upto
+                connection.execute('''
+                    INSERT INTO messages_fts(rowid, message)
+                    SELECT id, message FROM messages WHERE id > ? AND id <= ?
+                ''', (position, end))
+                connection.execute("UPDATE search_state SET value = ? WHERE key = 'backfill_position'", (end,))
+            yield end, upto
+
+    def rebuild_search_index(self):
+        with self.pool.connection() as connection, connection:
+            connection.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+            connection.execute('''
+                UPDATE search_state SET value = (SELECT value FROM search_state WHERE key = 'backfill_upto')
+                WHERE key = 'backfill_position'
+            ''')
+            connection.execute("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')")
+
     def delete_contact(self, name):
-        self.cursor.execute('DELETE FROM contacts WHERE name = ?', (name,))
-        self.connection.commit()
+        self._sync_writes()
+        with self.pool.connection() as connection, connection:
+            connection.execute('DELETE FROM contacts WHERE name = ?', (name,))
+        self._contact_ids.pop(name, None)
+        self._user_contacts.discard(name)
 
     def close(self):
-        self.connection.close()
+        if self._writer is not None:
+            self._writer.close()
+        self.pool.close()
+
+
+_shared_database = None
+_shared_lock = threading.Lock()
+
+
+def get_database(db_path=DEFAULT_DB_PATH):
+    # One store per process: the UI and the messaging layer share the pool
+    # instead of opening a fresh connection (and rerunning the DDL) per call.
+    global _shared_database
+    with _shared_lock:
+        if _shared_database is None:
+            _shared_database = Database(db_path)
+        return _shared_database
+
+
+def close_database():
+    global _shared_database
+    with _shared_lock:
+        if _shared_database is not None:
+            _shared_database.close()
+            _shared_database = None
+
+
+atexit.register(close_database)
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ['reindex']:
+        db = Database()
+        if '--rebuild' in sys.argv:
+            db.rebuild_search_index()
+            print("Search index rebuilt")
+        else:
+            for done, total in db.backfill_search_index():
+                print(f"Indexed messages up to id {done} of {total}")
+        db.close()
+        sys.exit(0)
     db = Database()
     for i, contact in enumerate(db.get_contacts()):
         print(f"Contact {i}: {contact}")
         if i >= 3:
             db.delete_contact(contact)
     db.close()
-        
\ No newline at end of file
@@ -0,0 +1,79 @@
+import logging
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+import database as db
+
+logger = logging.getLogger(__name__)
+
+
+class _Task(QRunnable):
+    def __init__(self, worker, request_id, key, generation, function, args):
+        super().__init__()
+        self.worker = worker
+        self.request_id = request_id
+        self.key = key
+        self.generation = generation
+        self.function = function
+        self.args = args
+
+    def run(self):
+        result, error = None, None
+        # A request superseded before it got a thread never touches sqlite.
+        if self.worker.is_current(self.key, self.generation):
+            try:
+                result = self.function(*self.args)
+            except Exception as e:
+                error = e
+        self.worker._done.emit(self.request_id, result, error)
+
+
+class DatabaseWorker(QObject):
+    # Runs database calls on a QThreadPool and delivers results back on the
+    # GUI thread. Requests sharing a key supersede each other: only the result
+    # of the latest one reaches its callback. A failed call is logged and
+    # its exception goes to error_callback, so callers can undo UI state
+    # they set up while waiting.
+    _done = Signal(int, object, object)
+
+    def __init__(self, database, parent=None):
+        super().__init__(parent)
+        self.database = database
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(db.POOL_SIZE)
+        self._requests = {}
+        self._generations = {}
+        self._next_id = 0
+        self._done.connect(self._on_done)
+
+    def submit(self, function, *args, callback=None, error_callback=None, key=None):
+        generation = None
+        if key is not None:
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+        self._next_id += 1
+        self._requests[self._next_id] = (key, generation, callback, error_callback)
+        self.pool.start(_Task(self, self._next_id, key, generation, function, args))
+        return self._next_id
+
+    def cancel(self, key):
+        self._generations[key] = self._generations.get(key, 0) + 1
+
+    def is_current(self, key, generation):
+        return key is None or self._generations.get(key) == generation
+
+    def shutdown(self):
+        for key in list(self._generations):
+            self.cancel(key)
+        self.pool.waitForDone()
+
+    def _on_done(self, request_id, result, error):
+        key, generation, callback, error_callback = self._requests.pop(request_id)
+        if not self.is_current(key, generation):
+            return
+        if error is not None:
+            logger.error("Database error: %s", error, exc_info=error)
+            if error_callback:
+                error_callback(error)
+            return
+        if callback:
+            callback(result)
@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import time
+import uuid
+from pathlib import Path
+
+
+CHANNEL_PREFIX = 'file:'
+CHUNK_SIZE = 16 * 1024
+# aiortc's default maximum SCTP message size, less the chunk header.
+MAX_CHUNK_SIZE = 64 * 1024 - 4
+# The sender pauses once this much is queued in the channel and resumes on
+# 'bufferedamountlow', so memory stays bounded whatever the file size.
+HIGH_WATER_MARK = 1024 * 1024
+LOW_WATER_MARK = 256 * 1024
+HEADER = struct.Struct('!I')
+HASH_BLOCK = 1024 * 1024
+DEFAULT_DOWNLOAD_DIR = 'downloads'
+SHA256_HEX = re.compile(r'[0-9a-f]{64}')
+
+
+class TransferError(ValueError):
+    pass
+
+
+def is_file_channel(channel):
+    return channel.label.startswith(CHANNEL_PREFIX)
+
+
+def is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def check_meta(meta):
+    # The metadata comes from the peer and names a file on our disk, so it
+    # is checked before anything is opened. Returns a cleaned copy.
+    if not isinstance(meta, dict):
+        raise TransferError("метаданные файла не объект")
+    sha256, name = meta.get('sha256'), meta.get('name')
+    size, chunk_size, chunks = meta.get('size'), meta.get('chunk_size'), meta.get('chunks')
+    if not isinstance(sha256, str) or not SHA256_HEX.fullmatch(sha256.lower()):
+        raise TransferError("некорректный sha256")
+    if not isinstance(name, str) or not Path(name).name or Path(name).name in ('.', '..'):
+        raise TransferError("некорректное имя файла")
+    if not (is_count(size) and is_count(chunks) and is_count(chunk_size)) or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise TransferError("некорректный размер файла или блока")
+    if chunks != (size + chunk_size - 1) // chunk_size:
+        raise TransferError("число блоков не совпадает с размером файла")
+    return {'name': Path(name).name, 'size': size, 'chunk_size': chunk_size,
+            'chunks': chunks, 'sha256': sha256.lower()}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(HASH_BLOCK):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileSender:
+    # One transfer over its own channel 'file:<id>'. The protocol is:
+    #   sender   -> {"name", "size", "chunk_size", "chunks", "sha256"}   (text)
+    #   receiver -> {"resume": <first missing chunk index>}              (text)
+    #   sender   -> <4-byte chunk index><payload> ...                    (binary)
+    #   sender   -> {"done": true}                                       (text)
+    #   receiver -> {"ok": <sha256 matched>}                             (text)
+    def __init__(self, pc, path, chunk_size=CHUNK_SIZE):
+        self.path = Path(path)
+        self.size = self.path.stat().st_size
+        self.chunk_size = chunk_size
+        self.chunks = (self.size + chunk_size - 1) // chunk_size
+        self.transfer_id = uuid.uuid4().hex
+        self.channel = pc.createDataChannel(CHANNEL_PREFIX + self.transfer_id)
+        self.channel.bufferedAmountLowThreshold = LOW_WATER_MARK
+        self.sent_bytes = 0
+        self.resumed_from = 0
+        self._opened = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._replies = asyncio.Queue()
+
+        self.channel.on('open', self._opened.set)
+        self.channel.on('bufferedamountlow', self._drained.set)
+        self.channel.on('message', self._on_message)
+        self.channel.on('close', self._on_close)
+
+    def _on_message(self, message):
+        if isinstance(message, str):
+            self._replies.put_nowait(json.loads(message))
+
+    def _on_close(self):
+        # Wakes whatever the sender is waiting on; it then sees the channel closed.
+        self._drained.set()
+        self._replies.put_nowait(None)
+
+    async def _reply(self, timeout):
+        reply = await asyncio.wait_for(self._replies.get(), timeout)
+        if reply is None:
+            raise ConnectionError('канал передачи файла закрыт')
+        return reply
+
+    async def send(self, timeout=30):
+        start = time.perf_counter()
+        sha256 = await asyncio.to_thread(file_sha256, self.path)
+        if self.channel.readyState != 'open':
+            await asyncio.wait_for(self._opened.wait(), timeout)
+        self.channel.send(json.dumps({
+            'name': self.path.name,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'chunks': self.chunks,
+            'sha256': sha256
+        }))
+        self.resumed_from = int((await self._reply(timeout)).get('resume', 0))
+
+        if self.size:
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    await self._send_chunks(view, timeout)
+                finally:
+                    view.release()
+
+        self.channel.send(json.dumps({'done': True}))
+        ok = bool((await self._reply(timeout)).get('ok'))
+        self.channel.close()
+        elapsed = time.perf_counter() - start
+        return {
+            'ok': ok,
+            'name': self.path.name,
+            'size': self.size,
+            'sent_bytes': self.sent_bytes,
+            'resumed_from': self.resumed_from,
+            'seconds': elapsed,
+            'mb_per_s': self.sent_bytes / elapsed / 1e6 if elapsed else 0.0
+        }
+
+    async def _send_chunks(self, view, timeout):
+        channel = self.channel
+        for index in range(self.resumed_from, self.chunks):
+            if channel.bufferedAmount > HIGH_WATER_MARK:
+                self._drained.clear()
+                try:
+                    await asyncio.wait_for(self._drained.wait(), timeout)
+                except asyncio.TimeoutError:
+                    raise TransferError('канал передачи файла не освобождается') from None
+            if channel.readyState != 'open':
+                raise ConnectionError('канал передачи файла закрыт')
+            offset = index * self.chunk_size
+            chunk = view[offset:offset + self.chunk_size]
+            # aiortc only accepts bytes, so the header and the mapped slice
+            # are joined into the one copy that goes on the wire.
+            channel.send(b''.join((HEADER.pack(index), chunk)))
+            self.sent_bytes += len(chunk)
+
+
+class FileReceiver:
+    # Chunks are written straight into '<sha256 prefix>.part' in the download
+    # directory, so an interrupted transfer of the same file resumes from the
+    # last complete chunk. The file is renamed only after its hash checks out.
+    # Anything malformed from the sender aborts the transfer.
+    def __init__(self, channel, download_dir=DEFAULT_DOWNLOAD_DIR, on_complete=None):
+        self.channel = channel
+        self.download_dir = Path(download_dir)
+        self.on_complete = on_complete
+        self.meta = None
+        self.file = None
+        self.part_path = None
+        self.received_bytes = 0
+        self.started = None
+
+        channel.on('message', self._on_message)
+        channel.on('close', self._close_file)
+
+    def _on_message(self, message):
+        try:
+            if isinstance(message, bytes):
+                self._write_chunk(message)
+                return
+            message = json.loads(message)
+            if self.meta is None:
+                self._start(check_meta(message))
+            elif isinstance(message, dict) and message.get('done') and self.file is not None:
+                self._close_file()
+                asyncio.ensure_future(self._finish())
+        except (OSError, ValueError) as e:
+            print(f"\n❌ Ошибка приёма файла: {e}")
+            self._close_file()
+            self.channel.close()
+
+    def _start(self, meta):
+        self.meta = meta
+        self.started = time.perf_counter()
+        self.download_dir.mkdir(parents=True, exist_ok=True)
+        self.part_path = self.download_dir / f"{meta['sha256'][:16]}.part"
+        chunk_size = meta['chunk_size']
+        resume = 0
+        if self.part_path.exists():
+            resume = min(self.part_path.stat().st_size // chunk_size, meta['chunks'])
+        self.file = open(self.part_path, 'r+b' if resume else 'wb')
+        self.file.truncate(resume * chunk_size)
+        self.channel.send(json.dumps({'resume': resume}))
+
+    def _write_chunk(self, message):
+        if self.file is None:
+            # Before the metadata or after 'done': nothing to write into.
+            return
+        if len(message) <= HEADER.size:
+            raise TransferError("пустой блок файла")
+        index, = HEADER.unpack_from(message)
+        payload = memoryview(message)[HEADER.size:]
+        chunk_size, chunks = self.meta['chunk_size'], self.meta['chunks']
+        last = self.meta['size'] - (chunks - 1) * chunk_size
+        if not 0 <= index < chunks or len(payload) != (last if index == chunks - 1 else chunk_size):
+            raise TransferError(f"блок {index} вне файла")
+        self.file.seek(index * chunk_size)
+        self.file.write(payload)
+        self.received_bytes += len(payload)
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _target_path(self):
+        name = Path(self.meta['name']).name or self.part_path.stem
+        target = self.download_dir / name
+        stem, suffix, n = target.stem, target.suffix, 1
+        while target.exists():
+            target = self.download_dir / f"{stem} ({n}){suffix}"
+            n += 1
+        return target
+
+    async def _finish(self):
+        ok = (self.part_path.stat().st_size == self.meta['size']
+              and await asyncio.to_thread(file_sha256, self.part_path) == self.meta['sha256'])
+        target = None
+        if ok:
+            target = self._target_path()
+            os.replace(self.part_path, target)
+        else:
+            # A corrupt part file must not be resumed from.
+            self.part_path.unlink(missing_ok=True)
+        if self.channel.readyState == 'open':
+            self.channel.send(json.dumps({'ok': ok}))
+        if self.on_complete is not None:
+            elapsed = time.perf_counter() - self.started
+            self.on_complete({
+                'ok': ok,
+                'name': self.meta['name'],
+                'path': target,
+                'size': self.meta['size'],
+                'received_bytes': self.received_bytes,
+                'seconds': elapsed
+            })
+
+
+async def send_file(pc, path, chunk_size=CHUNK_SIZE, timeout=30):
+    return await FileSender(pc, path, chunk_size).send(timeout)
@@ -1,10 +1,92 @@
 from unicodedata import name
-from PySide6.QtWidgets import (QApplication, QMainWindow, QGridLayout, QWidget, QScrollArea,
-                               QPushButton, QLineEdit, QHBoxLayout, QVBoxLayout, QLabel)
-from PySide6.QtCore import Qt, QSize, QPoint
-from PySide6.QtGui import QIcon, QPixmap, QScreen
+from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QPushButton, QLineEdit,
+                               QHBoxLayout, QVBoxLayout, QLabel, QMenu, QStackedWidget,
+                               QListWidget, QListWidgetItem, QMessageBox)
+from PySide6.QtCore import Qt, QSize, QPoint, QTimer
+from PySide6.QtGui import QIcon
 import sys
 import database as db
+from chat_view import MessageModel, ChatView
+from db_worker import DatabaseWorker
+from contact_list import ContactModel, ContactListView
+from network import NetworkThread, DEFAULT_SERVER
+
+
+SEARCH_DEBOUNCE_MS = 250
+
+APP_STYLESHEET = """
+    QListView#contacts {
+        background-color: #252525;
+        border: none;
+        outline: 0;
+        padding: 5px 8px;
+        font-size: 16px;
+        color: #ffffff;
+    }
+    QListView#contacts::item {
+        background-color: #2d2d2d;
+        border: none;
+        border-radius: 8px;
+        color: #ffffff;
+        height: 65px;
+        padding: 0px 20px;
+    }
+    QListView#contacts::item:hover {
+        background-color: #3a3a3a;
+    }
+    QListView#contacts::item:selected {
+        background-color: #2d4532;
+    }
+    QListView#contacts::item:selected:hover {
+        background-color: #3a5a3f;
+    }
+    QLineEdit#search {
+        background-color: #3a3a3a;
+        border: 2px solid #2d2d2d;
+        border-radius: 18px;
+        font-size: 14px;
+        color: #ffffff;
+        padding: 5px 15px;
+    }
+    QLineEdit#search:focus {
+        border: 2px solid #3a5a3f;
+    }
+    QListWidget#search_results {
+        background-color: #252525;
+        border: none;
+        outline: 0;
+        padding: 5px 8px;
+        font-size: 14px;
+        color: #cccccc;
+    }
+    QListWidget#search_results::item {
+        background-color: #2d2d2d;
+        border-radius: 8px;
+        padding: 10px 12px;
+        margin: 2px 0px;
+    }
+    QListWidget#search_results::item:hover {
+        background-color: #3a3a3a;
+    }
+    QListView#contacts QScrollBar:vertical, QListWidget#search_results QScrollBar:vertical {
+        background-color: #252525;
+        width: 10px;
+        margin: 0px;
+    }
+    QListView#contacts QScrollBar::handle:vertical, QListWidget#search_results QScrollBar::handle:vertical {
+        background-color: #3a3a3a;
+        border-radius: 5px;
+        min-height: 30px;
+    }
+    QListView#contacts QScrollBar::handle:vertical:hover,
+    QListWidget#search_results QScrollBar::handle:vertical:hover {
+        background-color: #4a4a4a;
+    }
+    QListView#contacts QScrollBar::add-line:vertical, QListView#contacts QScrollBar::sub-line:vertical,
+    QListWidget#search_results QScrollBar::add-line:vertical, QListWidget#search_results QScrollBar::sub-line:vertical {
+        height: 0px;
+    }
+"""
 
 
 class CustomTitleBar(QWidget):
@@ -105,8 +187,19 @@ class CustomTitleBar(QWidget):
 
 
 class MainWidget(QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, peer_id=None, server=DEFAULT_SERVER):
         super().__init__(parent)
+        self.db = db.get_database()
+        self.db_worker = DatabaseWorker(self.db, self)
+        QApplication.instance().aboutToQuit.connect(self.db_worker.shutdown)
+        # Without a peer id the window only works with the local history.
+        self.network = None
+        if peer_id:
+            self.network = NetworkThread(peer_id, server, self.db, self)
+            self.network.messages_received.connect(self._on_messages_received)
+            self.network.connection_failed.connect(self._on_connection_failed)
+            QApplication.instance().aboutToQuit.connect(self.network.stop)
+            self.network.start()
         self.setStyleSheet("background-color: #1e1e1e;")
         self.main_frame = QHBoxLayout(self)
         self.main_frame.setContentsMargins(0, 0, 0, 0)
@@ -124,9 +217,86 @@ class MainWidget(QWidget):
         contacts_frame.setContentsMargins(0, 0, 0, 0)
         contacts_frame.setSpacing(0)
         contacts_frame.addWidget(self.button_add_widget())
-        contacts_frame.addWidget(self.scroll_area_contacts_widget(), 1)
+        contacts_frame.addWidget(self.search_widget())
+        self.contacts_stack = QStackedWidget()
+        self.contacts_stack.setFixedWidth(300)
+        self.contacts_stack.addWidget(self.scroll_area_contacts_widget())
+        self.contacts_stack.addWidget(self.search_results_widget())
+        contacts_frame.addWidget(self.contacts_stack, 1)
         return contacts_frame
 
+    def search_widget(self):
+        search_frame = QWidget()
+        search_frame.setFixedSize(300, 60)
+        search_frame.setStyleSheet("background-color: #252525;")
+        self.search_input = QLineEdit()
+        self.search_input.setObjectName("search")
+        self.search_input.setFixedSize(240, 40)
+        self.search_input.setPlaceholderText("Search messages")
+        self.search_input.textChanged.connect(self._on_search_text_changed)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.run_search)
+        search_layout = QVBoxLayout(search_frame)
+        search_layout.setContentsMargins(30, 5, 30, 15)
+        search_layout.addWidget(self.search_input, alignment=Qt.AlignHCenter)
+        return search_frame
+
+    def search_results_widget(self):
+        self.search_results = QListWidget()
+        self.search_results.setObjectName("search_results")
+        self.search_results.setWordWrap(True)
+        self.search_results.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.search_results.itemClicked.connect(lambda item: self.chat_with_contact(item.data(Qt.UserRole)))
+        self.search_results.verticalScrollBar().valueChanged.connect(self._on_search_scrolled)
+        self._search_has_more = False
+        self._search_loading = False
+        return self.search_results
+
+    def _on_search_text_changed(self, text):
+        # Typing only restarts the debounce timer; the query runs once the
+        # user pauses, on the database worker.
+        if not text.strip():
+            self.search_timer.stop()
+            self.db_worker.cancel('search')
+            self._search_loading = False
+            self.contacts_stack.setCurrentIndex(0)
+            return
+        self.search_timer.start()
+
+    def _on_search_scrolled(self, value):
+        if value == self.search_results.verticalScrollBar().maximum() and self._search_has_more and not self._search_loading:
+            self.run_search(more=True)
+
+    def run_search(self, more=False):
+        query = self.search_input.text().strip()
+        if not query:
+            return
+        offset = self.search_results.count() if more else 0
+        self._search_loading = True
+        self.db_worker.submit(self.db.search_messages, query, None, db.PAGE_SIZE, offset,
+                              callback=lambda rows: self._on_search_results(rows, more),
+                              error_callback=self._on_search_failed, key='search')
+
+    def _on_search_failed(self, error):
+        self._search_loading = False
+
+    def _on_search_results(self, rows, more):
+        self._search_loading = False
+        self._search_has_more = len(rows) == db.PAGE_SIZE
+        if not more:
+            self.search_results.clear()
+        for message_id, contact, snippet, direction in rows:
+            item = QListWidgetItem(f"{contact}\n{snippet}")
+            item.setData(Qt.UserRole, contact)
+            self.search_results.addItem(item)
+        if not more and not rows:
+            item = QListWidgetItem("No messages found")
+            item.setFlags(Qt.NoItemFlags)
+            self.search_results.addItem(item)
+        self.contacts_stack.setCurrentIndex(1)
+
     def button_add_widget(self):
         button_add_frame = QWidget()
         button_add_frame.setFixedSize(300, 150)
@@ -179,45 +349,14 @@ class MainWidget(QWidget):
         return button_add_frame
 
     def scroll_area_contacts_widget(self):
-        scroll_area_contacts = QScrollArea()
-        scroll_area_contacts.setWidgetResizable(True)
-        scroll_area_contacts.setFixedWidth(300)
-        scroll_area_contacts.setStyleSheet("""
-            QScrollArea {
-                background-color: #252525;
-                border: none;
-            }
-            QScrollBar:vertical {
-                background-color: #252525;
-                width: 10px;
-                margin: 0px;
-            }
-            QScrollBar::handle:vertical {
-                background-color: #3a3a3a;
-                border-radius: 5px;
-                min-height: 30px;
-            }
-            QScrollBar::handle:vertical:hover {
-                background-color: #4a4a4a;
-            }
-            QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical {
-                height: 0px;
-            }
-        """)
-        scroll_area_contacts.setWidget(self.contacts_container_widget())
-        return scroll_area_contacts
-
-    def contacts_container_widget(self):
-        contacts_container = QWidget()
-        contacts_container.setStyleSheet("background-color: #252525;")
-        self.contacts_frame = QVBoxLayout(contacts_container)
-        self.contacts_frame.setContentsMargins(8, 5, 8, 5)
-        self.contacts_frame.setSpacing(5)
-        self.contacts_buttons = {}
         self.active_contact = None
-        self.add_buttons()
-        self.contacts_frame.addStretch()
-        return contacts_container
+        self.contacts_model = ContactModel(self)
+        self.contacts_view = ContactListView(self.contacts_model)
+        self.contacts_view.setFixedWidth(300)
+        self.contacts_view.clicked.connect(lambda index: self.chat_with_contact(index.data()))
+        self.contacts_view.customContextMenuRequested.connect(self.contact_context_menu)
+        self.load_contacts()
+        return self.contacts_view
 
     def mainframe_notification(self):
         self.frame_notification = QVBoxLayout()
@@ -262,12 +401,13 @@ class MainWidget(QWidget):
         return message_frame
 
     def scroll_area_message_widget(self):
-        scroll_area_message = QScrollArea()
-        scroll_area_message.setWidgetResizable(True)
-        scroll_area_message.setStyleSheet("""
-            QScrollArea {
+        self.chat_model = MessageModel(self.db_worker, self)
+        chat_view = ChatView(self.chat_model)
+        chat_view.setStyleSheet("""
+            QListView {
                 background-color: #1e1e1e;
                 border: none;
+                padding: 10px 0px;
             }
             QScrollBar:vertical {
                 background-color: #1e1e1e;
@@ -286,16 +426,7 @@ class MainWidget(QWidget):
                 height: 0px;
             }
         """)
-        scroll_area_message.setWidget(self.messages_container_widget())
-        return scroll_area_message
-
-    def messages_container_widget(self):
-        messages_container = QWidget()
-        messages_container.setStyleSheet("background-color: #1e1e1e;")
-        self.messages = QVBoxLayout(messages_container)
-        self.messages.setContentsMargins(20, 20, 20, 20)
-        self.messages.setSpacing(10)
-        return messages_container
+        return chat_view
 
     def input_message_widget(self):
         input_container = QWidget()
@@ -354,158 +485,92 @@ class MainWidget(QWidget):
         if message_text:
             if hasattr(self, 'contact_name') and self.contact_name:
                 print("Found contact button")
-                db.Database().add_message(self.contact_name, message_text, direction=False)
+                self.db.queue_message(self.contact_name, message_text, direction=False)
                 self.add_message([(message_text, 0)])
                 self.input_message.clear()
+                if self.network is not None:
+                    self.network.send(self.contact_name, message_text)
+
+    def _on_connection_failed(self, error):
+        # Carry on offline: history and new messages stay in the local store.
+        self.network = None
+        QMessageBox.warning(self, "Offline", f"{error}\nMessages are saved locally but not sent.")
 
-    def remove_messages(self):        
-        while self.messages.count():
-            item = self.messages.takeAt(0)
-            widget = item.widget()
-            if widget is not None:
-                widget.deleteLater()
+    def _on_messages_received(self, messages):
+        # Already stored by the messenger; only the open chat is updated,
+        # with everything from this batch in one insertion.
+        shown = []
+        for peer_id, text, via in messages:
+            self.contacts_model.add_contact(peer_id)
+            if peer_id == self.active_contact:
+                shown.append(f"{text}\n↪ через {via}" if via else text)
+        if shown:
+            self.chat_model.append_messages(shown, 1)
 
     def add_contact(self, name):
         if name.strip():
             self.button_add.setEnabled(False)
-            db.Database().add_contact(name)
-            self.add_buttons()
-            self.button_add.setEnabled(True)
+            self.db_worker.submit(self.db.add_contact, name,
+                                  callback=lambda result: self._on_contact_added(result, name),
+                                  error_callback=lambda error: self.button_add.setEnabled(True))
+
+    def _on_contact_added(self, result, name):
+        self.contacts_model.add_contact(name)
+        self.button_add.setEnabled(True)
 
     def add_message(self, data_messages):
         try:
             for message, sender in data_messages:
-                message_container = QWidget()
-                message_layout = QHBoxLayout(message_container)
-                message_layout.setContentsMargins(0, 0, 0, 0)
-                
-                message_label = QLabel(message)
-                message_label.setWordWrap(True)
-                message_label.setMaximumWidth(600)
-                
-                if sender == 1:
-                    message_label.setStyleSheet("""
-                        QLabel {
-                            background-color: #2d3a3d;
-                            border-radius: 15px;
-                            padding: 12px 16px;
-                            font-size: 15px;
-                            color: #ffffff;
-                        }
-                    """)
-                    message_layout.addWidget(message_label, alignment=Qt.AlignLeft)
-                    message_layout.addStretch()
-                else:
-                    message_label.setStyleSheet("""
-                        QLabel {
-                            background-color: #2d4532;
-                            border-radius: 15px;
-                            padding: 12px 16px;
-                            font-size: 15px;
-                            color: #ffffff;
-                        }
-                    """)
-                    message_layout.addStretch()
-                    message_layout.addWidget(message_label, alignment=Qt.AlignRight)
-                
-                self.messages.addWidget(message_container)
+                self.chat_model.append_message(message, sender)
         except Exception as e:
             print(f"Error adding message: {e}")
 
-    def add_buttons(self):
-        try:
-            for name, button in list(self.contacts_buttons.items()):
-                button.deleteLater()
-            self.contacts_buttons.clear()
-            
-            contacts = db.Database().get_contacts()
-            
-            for name in contacts:
-                contact_button = QPushButton()
-                contact_button.setFixedHeight(65)
-                contact_button.setText(name)
-                
-                contact_button.setStyleSheet("""
-                    QPushButton { 
-                        background-color: #2d2d2d;
-                        border: none;
-                        border-radius: 8px;
-                        font-size: 16px;
-                        color: #ffffff;
-                        text-align: left;
-                        padding: 15px 20px;
-                    }
-                    QPushButton:hover {
-                        background-color: #3a3a3a;
-                    }
-                    QPushButton:pressed {
-                        background-color: #2d4532;
-                    }
-                """)
-                
-                contact_button.clicked.connect(lambda checked, n=name: self.chat_with_contact(n))
-                self.contacts_frame.insertWidget(self.contacts_frame.count() - 1, contact_button)
-                self.contacts_buttons[name] = contact_button
-                
-        except Exception as e:
-            print(f"Error adding contact button: {e}")
+    def load_contacts(self):
+        self.db_worker.submit(self.db.get_contacts, callback=self._on_contacts_loaded, key='contacts')
+
+    def _on_contacts_loaded(self, contacts):
+        self.contacts_model.set_contacts(contacts)
+        if self.active_contact:
+            self.highlight_active_contact(self.active_contact)
+
+    def contact_context_menu(self, position):
+        index = self.contacts_view.indexAt(position)
+        if not index.isValid():
+            return
+        menu = QMenu(self.contacts_view)
+        delete_action = menu.addAction("Delete contact")
+        if menu.exec(self.contacts_view.viewport().mapToGlobal(position)) == delete_action:
+            self.remove_contact(index.data())
+
+    def remove_contact(self, name):
+        self.contacts_model.remove_contact(name)
+        self.db_worker.submit(self.db.delete_contact, name)
+        if name == self.active_contact:
+            self.active_contact = self.contact_name = None
+            self.chat_model.set_contact(None)
+            self.contact_name_label.setText("")
 
     def highlight_active_contact(self, contact_name):
-        for name, button in self.contacts_buttons.items():
-            if name == contact_name:
-                button.setStyleSheet("""
-                    QPushButton { 
-                        background-color: #2d4532;
-                        border: none;
-                        border-radius: 8px;
-                        font-size: 16px;
-                        color: #ffffff;
-                        text-align: left;
-                        padding: 15px 20px;
-                        font-weight: bold;
-                    }
-                    QPushButton:hover {
-                        background-color: #3a5a3f;
-                    }
-                """)
-            else:
-                button.setStyleSheet("""
-                    QPushButton { 
-                        background-color: #2d2d2d;
-                        border: none;
-                        border-radius: 8px;
-                        font-size: 16px;
-                        color: #ffffff;
-                        text-align: left;
-                        padding: 15px 20px;
-                    }
-                    QPushButton:hover {
-                        background-color: #3a3a3a;
-                    }
-                    QPushButton:pressed {
-                        background-color: #2d4532;
-                    }
-                """)
+        self.contacts_model.set_active(contact_name)
+        self.contacts_view.select_contact(contact_name)
 
     def chat_with_contact(self, contact):
         try:
             self.contact_name = contact
+            self.active_contact = contact
             self.highlight_active_contact(contact)
             if self.main_frame.itemAt(2).layout() == self.frame_notification:
                 self.main_frame.removeItem(self.frame_notification)
                 self.main_frame.addLayout(self.message_frame_widget(), 8)
             self.contact_name_label.setText(contact)
             print(f"Chatting with {contact}")
-            self.remove_messages()
-            self.messages.addStretch(1)
-            messages = db.Database().get_messages(contact)
-            self.add_message(messages)
+            self.chat_model.set_contact(contact)
         except Exception as e:
             print(f"Error: {e}")
 
 
 class Interface(QMainWindow):
-    def __init__(self):
+    def __init__(self, peer_id=None, server=DEFAULT_SERVER):
         super().__init__()
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -513,13 +578,16 @@ class Interface(QMainWindow):
         main_layout.setContentsMargins(0, 0, 0, 0)
         main_layout.setSpacing(0)
         main_layout.addWidget(CustomTitleBar(self))
-        main_layout.addWidget(MainWidget(self))
+        main_layout.addWidget(MainWidget(self, peer_id, server))
         self.setGeometry(100, 100, 1200, 700)
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint)
 
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    window = Interface()
+    app.setStyleSheet(APP_STYLESHEET)
+    # python interface.py [peer_id] [signaling_server]
+    window = Interface(*sys.argv[1:3])
+    app.aboutToQuit.connect(db.close_database)
     window.show()
     sys.exit(app.exec())
\ No newline at end of file
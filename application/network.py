@@ -0,0 +1,103 @@
+import asyncio
+import importlib
+import threading
+from PySide6.QtCore import QObject, QTimer, Signal
+
+messenger_module = importlib.import_module('Nexus-socket')
+
+
+DEFAULT_SERVER = 'http://localhost:8080'
+# Incoming messages reach the GUI at most once per frame, however many
+# arrived in between.
+UI_FLUSH_MS = 16
+STOP_TIMEOUT = 5
+
+
+class NetworkThread(QObject):
+    # Runs P2PMessenger on its own asyncio loop in a background thread, so
+    # socket.io, aiortc and the Qt event loop never block each other. The
+    # GUI calls in with send(); messages come back as one `messages_received`
+    # list of (peer_id, text, via) per UI_FLUSH_MS, via naming the peer that
+    # relayed the message, or None. Storing them is left to the
+    # messenger, which shares the database and its batching writer. If the
+    # signaling server can't be reached, `connection_failed` carries the
+    # error and the thread ends.
+    messages_received = Signal(list)
+    connection_failed = Signal(str)
+    _wake = Signal()
+
+    def __init__(self, peer_id, server, database, parent=None):
+        super().__init__(parent)
+        self.peer_id = peer_id
+        self.server = server
+        self.database = database
+        # Built here so send() works before the loop is up; nothing in the
+        # messenger touches an event loop until it runs on this one.
+        self.messenger = messenger_module.P2PMessenger(peer_id, server, database=database,
+                                                       on_message=self._on_message)
+        self.loop = asyncio.new_event_loop()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stopped = asyncio.Event()
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(UI_FLUSH_MS)
+        self._flush_timer.timeout.connect(self._flush)
+        # Emitted from the network thread, delivered on the GUI thread.
+        self._wake.connect(self._schedule_flush)
+        self._thread = threading.Thread(target=self._run, name='nexus-network', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            # Let aiortc's background tasks wind down, as asyncio.run() would.
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    async def _main(self):
+        try:
+            await self.messenger.connect_to_signaling()
+        except ConnectionError as e:
+            self.connection_failed.emit(str(e))
+            return
+        await self._stopped.wait()
+        await self.messenger.close()
+
+    def _on_message(self, peer_id, text, via=None):
+        # Network thread: only the first message of a burst wakes the GUI.
+        with self._lock:
+            self._pending.append((peer_id, text, via))
+            first = len(self._pending) == 1
+        if first:
+            self._wake.emit()
+
+    def _schedule_flush(self):
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def _flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if batch:
+            self.messages_received.emit(batch)
+
+    def call(self, coroutine):
+        # Thread-safe: schedules a messenger coroutine on the network loop.
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def send(self, peer_id, message):
+        return self.call(self.messenger.send_to(peer_id, message))
+
+    def stop(self):
+        if not self._thread.is_alive():
+            return
+        self.loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join(STOP_TIMEOUT)
@@ -0,0 +1,200 @@
+import asyncio
+import time
+from collections import deque
+
+import protocol
+
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+MAX_QUEUE = 1000
+# Nothing more is handed to the channel while its SCTP buffer is above the
+# high watermark; sending resumes once aiortc reports it fell to the low one.
+HIGH_WATER_MARK = 1024 * 1024
+LOW_WATER_MARK = 256 * 1024
+COALESCE_BYTES = 16 * 1024
+LATENCY_SAMPLES = 1024
+
+
+def is_legacy_control(message):
+    # A legacy batch is a list of text frames behind the control prefix, so
+    # a legacy control frame inside one would come out as chat text.
+    return isinstance(message, str) and message.startswith(protocol.CONTROL_PREFIX)
+
+
+class OutboundQueue:
+    # Per-peer send queue in front of an RTCDataChannel. A full queue either
+    # blocks the sender or drops the oldest/newest message, so one slow peer
+    # can only ever hold `maxsize` messages. Small text messages waiting
+    # together are coalesced into one batch frame when the peer supports it.
+    # The queue outlives its channel: while a peer reconnects messages keep
+    # queueing, and attach() to the new channel replays them in order.
+    def __init__(self, channel=None, maxsize=MAX_QUEUE, policy=BLOCK, coalesce=False,
+                 high_water_mark=HIGH_WATER_MARK, low_water_mark=LOW_WATER_MARK):
+        if policy not in POLICIES:
+            raise ValueError(f"неизвестная политика очереди: {policy}")
+        self.channel = None
+        self.closed = False
+        self.low_water_mark = low_water_mark
+        self.maxsize = maxsize
+        self.policy = policy
+        self.coalesce = coalesce
+        self.codec = protocol.CODEC_NONE
+        self.high_water_mark = high_water_mark
+        self.items = deque()
+        self.sent = 0
+        self.frames = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._drained = asyncio.Event()
+        self._opened = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        if channel is not None:
+            self.attach(channel)
+
+    def attach(self, channel):
+        self.channel = channel
+        channel.bufferedAmountLowThreshold = self.low_water_mark
+        channel.on('bufferedamountlow', self._drained.set)
+        channel.on('open', self._opened.set)
+        channel.on('close', lambda: self._detach(channel))
+        if channel.readyState == 'open':
+            self._opened.set()
+
+    def _detach(self, channel):
+        if self.channel is channel:
+            self._opened.clear()
+            self._not_empty.set()
+            self._drained.set()
+
+    @property
+    def depth(self):
+        return len(self.items)
+
+    async def put(self, message, waiter=None):
+        # Returns False when the message was dropped. `waiter` is a future
+        # resolved with True once the message reaches the channel, or False
+        # if it never does.
+        if self.closed:
+            return self._resolve(waiter, False)
+        if len(self.items) >= self.maxsize:
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return self._resolve(waiter, False)
+            if self.policy == DROP_OLDEST:
+                self._resolve(self.items.popleft()[2], False)
+                self.dropped += 1
+            else:
+                while len(self.items) >= self.maxsize:
+                    self._not_full.clear()
+                    await self._not_full.wait()
+                    if self.closed:
+                        return self._resolve(waiter, False)
+        self._append(message, waiter)
+        return True
+
+    def put_nowait(self, message):
+        # put() for senders that must not wait: a full BLOCK queue drops this
+        # message instead. Returns False when it was dropped.
+        if self.closed:
+            return False
+        if len(self.items) >= self.maxsize:
+            self.dropped += 1
+            if self.policy != DROP_OLDEST:
+                return False
+            self._resolve(self.items.popleft()[2], False)
+        self._append(message, None)
+        return True
+
+    def _append(self, message, waiter):
+        self.items.append((message, time.perf_counter(), waiter))
+        self.max_depth = max(self.max_depth, len(self.items))
+        self._not_empty.set()
+
+    async def send(self, message):
+        # Like put(), but returns only once the message was handed to the
+        # channel (True) or dropped (False).
+        waiter = asyncio.get_running_loop().create_future()
+        await self.put(message, waiter)
+        return await waiter
+
+    @staticmethod
+    def _resolve(waiter, sent):
+        if waiter is not None and not waiter.done():
+            waiter.set_result(sent)
+        return sent
+
+    async def _run(self):
+        try:
+            while True:
+                await self._opened.wait()
+                channel = self.channel
+                if channel.readyState != 'open':
+                    self._opened.clear()
+                    continue
+                if not self.items:
+                    self._not_empty.clear()
+                    await self._not_empty.wait()
+                    continue
+                if channel.bufferedAmount > self.high_water_mark:
+                    self._drained.clear()
+                    await self._drained.wait()
+                    continue
+                channel.send(self._next_frame())
+                self._not_full.set()
+        finally:
+            self._not_full.set()
+            while self.items:
+                self._resolve(self.items.popleft()[2], False)
+
+    def _next_frame(self):
+        now = time.perf_counter()
+        message, queued_at, waiter = self.items.popleft()
+        self.latencies.append(now - queued_at)
+        self._resolve(waiter, True)
+        self.sent += 1
+        self.frames += 1
+        if not self.coalesce or not self.items or is_legacy_control(message):
+            return message
+        # Legacy text frames and binary envelopes are never mixed in a batch,
+        # and legacy control frames always go on their own.
+        kind = type(message)
+        batch, size = [message], len(message)
+        while (self.items and type(self.items[0][0]) is kind and not is_legacy_control(self.items[0][0])
+               and size + len(self.items[0][0]) <= COALESCE_BYTES):
+            message, queued_at, waiter = self.items.popleft()
+            self.latencies.append(now - queued_at)
+            self._resolve(waiter, True)
+            batch.append(message)
+            size += len(message)
+        self.sent += len(batch) - 1
+        if len(batch) == 1:
+            return batch[0]
+        return protocol.encode_batch(batch, None if kind is str else self.codec)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            'depth': len(self.items),
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'buffered_amount': self.channel.bufferedAmount if self.channel is not None else 0,
+            'latency_p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else None,
+            'latency_p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+        }
+
+    def close(self):
+        self.closed = True
+        self._task.cancel()
+        self._not_full.set()
+        while self.items:
+            self._resolve(self.items.popleft()[2], False)
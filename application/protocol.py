@@ -0,0 +1,266 @@
+import json
+import struct
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Legacy text frames: plain chat strings, and protocol data behind the ASCII
+# record separator (nobody types '\x1e' into a chat box). Still spoken to
+# peers that don't advertise the 'envelope' feature.
+CONTROL_PREFIX = '\x1e'
+
+# Binary envelope, one per data channel frame:
+#   version (1) | type (1) | flags + codec (1) | message id (8) | timestamp ms (8) | payload
+VERSION = 1
+HEADER = struct.Struct('!BBBQQ')
+LENGTH = struct.Struct('!I')
+
+TEXT = 1
+BATCH = 2
+RELAY = 3
+RELAY_MISS = 4
+ACK = 5
+TYPING = 6
+RECEIPT = 7
+SIGNAL = 8
+RELAY_ACK = 9
+CONTROL_TYPES = {RELAY: 'relay', RELAY_MISS: 'relay-miss', ACK: 'ack',
+                 TYPING: 'typing', RECEIPT: 'receipt', SIGNAL: 'signal', RELAY_ACK: 'relay-ack'}
+CONTROL_KINDS = {name: kind for kind, name in CONTROL_TYPES.items()}
+# Fields each handled control type must carry; [kind] is a list of kind.
+# Optional fields are checked only when present.
+CONTROL_FIELDS = {
+    'relay': {'id': str, 'origin': str, 'text': str, 'targets': [str], 'fanout': int},
+    'relay-miss': {'id': str, 'peers': [str]},
+    'relay-ack': {'id': str, 'peers': [str]},
+    'ack': {'ids': [int]},
+    'signal': {'signals': [dict]},
+}
+OPTIONAL_FIELDS = {'relay': {'ack': int}}
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_NAMES = {CODEC_ZLIB: 'zlib', CODEC_ZSTD: 'zstd'}
+CODEC_MASK = 0x0f
+# The sender keeps the message in its outbox until the receiver acks its id.
+FLAG_ACK = 0x80
+# Payloads shorter than this are sent as is; compression only pays off on
+# long messages and batches.
+COMPRESS_THRESHOLD = 512
+
+CODECS = (CODEC_ZSTD, CODEC_ZLIB) if zstandard is not None else (CODEC_ZLIB,)
+# Capabilities exchanged in the offer/answer signal data. Peers that don't
+# list a feature are only ever sent what they understand.
+FEATURES = ('batch', 'relay', 'envelope', 'ack', 'signal', 'relay-ack') + tuple(CODEC_NAMES[codec] for codec in CODECS)
+
+if zstandard is not None:
+    _zstd_compressor = zstandard.ZstdCompressor(level=3)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class Text(str):
+    # A chat message as decoded from an envelope: still a plain str for
+    # whoever just shows it, with the id and ack flag for whoever needs them.
+    message_id = 0
+    reliable = False
+
+
+def pick_codec(features):
+    # Best codec both sides support; None means the peer only speaks the
+    # legacy text frames.
+    if 'envelope' not in features:
+        return None
+    for codec in CODECS:
+        if CODEC_NAMES[codec] in features:
+            return codec
+    return CODEC_NONE
+
+
+def _compress(codec, payload):
+    if codec == CODEC_ZSTD:
+        return _zstd_compressor.compress(payload)
+    return zlib.compress(payload, 1)
+
+
+def _decompress(codec, payload):
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(payload)
+    if codec == CODEC_ZSTD and zstandard is not None:
+        return _zstd_decompressor.decompress(payload)
+    raise ProtocolError(f"неподдерживаемый кодек {codec}")
+
+
+def pack(kind, payload, message_id=0, codec=CODEC_NONE, timestamp=None, flags=0):
+    if codec and len(payload) >= COMPRESS_THRESHOLD:
+        compressed = _compress(codec, payload)
+        if len(compressed) < len(payload):
+            payload = compressed
+        else:
+            codec = CODEC_NONE
+    else:
+        codec = CODEC_NONE
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    return HEADER.pack(VERSION, kind, flags | codec, message_id, timestamp) + payload
+
+
+def unpack(frame):
+    # Returns (type, flags, message id, timestamp ms, payload).
+    if len(frame) < HEADER.size:
+        raise ProtocolError("кадр короче заголовка")
+    version, kind, flags, message_id, timestamp = HEADER.unpack_from(frame)
+    if version != VERSION:
+        raise ProtocolError(f"неизвестная версия протокола {version}")
+    payload = memoryview(frame)[HEADER.size:]
+    if flags & CODEC_MASK:
+        payload = _decompress(flags & CODEC_MASK, payload)
+    return kind, flags & ~CODEC_MASK, message_id, timestamp, bytes(payload)
+
+
+def _dumps(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+
+def encode_text(text, message_id=0, codec=None, reliable=False):
+    if codec is None:
+        return text
+    return pack(TEXT, text.encode(), message_id, codec, flags=FLAG_ACK if reliable else 0)
+
+
+def encode_batch(frames, codec=None):
+    # Several queued frames of one wire format in a single frame.
+    if codec is None:
+        return CONTROL_PREFIX + _dumps(frames)
+    return pack(BATCH, b''.join(LENGTH.pack(len(frame)) + frame for frame in frames), codec=codec)
+
+
+def encode_control(payload, codec=None, message_id=0):
+    if codec is None:
+        return CONTROL_PREFIX + _dumps(payload)
+    return pack(CONTROL_KINDS[payload['type']], _dumps(payload).encode(), message_id, codec)
+
+
+def encode_ack(message_ids, codec=CODEC_NONE):
+    # Acknowledges a run of TEXT message ids in one frame.
+    return pack(ACK, struct.pack(f'!{len(message_ids)}Q', *message_ids), codec=codec)
+
+
+def encode_relay(message_id, origin, text, targets, fanout, codec=None, ack=None):
+    # A message the receiver shows as coming from `origin` and then passes
+    # on to `targets`, splitting them into at most `fanout` subtrees. With
+    # `ack` (the origin's outbox id) receivers that store it send a
+    # relay-ack back up the tree.
+    payload = {'type': 'relay', 'id': message_id, 'origin': origin,
+               'text': text, 'targets': targets, 'fanout': fanout}
+    if ack is not None:
+        payload['ack'] = ack
+    return encode_control(payload, codec)
+
+
+def encode_relay_ack(message_id, peers, codec=None):
+    # `peers` have stored relay `message_id`; passed upstream to its origin.
+    return encode_control({'type': 'relay-ack', 'id': message_id, 'peers': peers}, codec)
+
+
+def encode_relay_miss(message_id, peers, codec=None):
+    return encode_control({'type': 'relay-miss', 'id': message_id, 'peers': peers}, codec)
+
+
+def encode_signals(signals, codec=None):
+    # WebRTC signals ({'type', 'data'}) for a peer we already have a channel
+    # to, in place of the server's `signals` event.
+    return encode_control({'type': 'signal', 'signals': signals}, codec)
+
+
+def _is_a(value, kind):
+    return isinstance(value, kind) and not isinstance(value, bool)
+
+
+def check_control(item):
+    # Control dicts come straight from a peer: True only if every field its
+    # type needs is there with the right type.
+    fields = CONTROL_FIELDS.get(item.get('type'))
+    if fields is None:
+        return False
+    optional = OPTIONAL_FIELDS.get(item['type'], {})
+    checks = list(fields.items()) + [(name, kind) for name, kind in optional.items() if name in item]
+    for name, kind in checks:
+        value = item.get(name)
+        if isinstance(kind, list):
+            if not isinstance(value, list) or not all(_is_a(element, kind[0]) for element in value):
+                return False
+        elif not _is_a(value, kind):
+            return False
+    return True
+
+
+def decode(message):
+    # Returns what one data channel frame carries: chat messages as str,
+    # control messages as dicts with a 'type'. Anything malformed raises
+    # ProtocolError, whatever layer (header, codec, JSON) it fails in.
+    try:
+        items = _decode(message)
+    except ProtocolError:
+        raise
+    except (ValueError, TypeError, struct.error, zlib.error) as e:
+        raise ProtocolError(f"повреждённый кадр: {e}") from e
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise ProtocolError(f"повреждённый кадр: {e}") from e
+        raise
+    for item in items:
+        if not isinstance(item, str) and not (isinstance(item, dict) and isinstance(item.get('type'), str)):
+            raise ProtocolError("элемент кадра не сообщение и не команда")
+    return items
+
+
+def _decode(message, nested=False):
+    if isinstance(message, str):
+        if message.startswith(CONTROL_PREFIX):
+            payload = json.loads(message[1:])
+            if not isinstance(payload, list):
+                return [payload]
+            if nested:
+                raise ProtocolError("вложенный пакет")
+            # A legacy batch. Earlier senders coalesced control frames into
+            # it as well, so those are decoded rather than shown as text.
+            return [element for item in payload
+                    for element in (_decode(item, True) if isinstance(item, str) else [item])]
+        return [message]
+    kind, flags, message_id, timestamp, payload = unpack(message)
+    if kind == TEXT:
+        text = Text(payload.decode())
+        text.message_id = message_id
+        text.reliable = bool(flags & FLAG_ACK)
+        return [text]
+    if kind == BATCH:
+        if nested:
+            raise ProtocolError("вложенный пакет")
+        items, offset = [], 0
+        while offset < len(payload):
+            if offset + LENGTH.size > len(payload):
+                raise ProtocolError("обрезанный пакет")
+            size, = LENGTH.unpack_from(payload, offset)
+            offset += LENGTH.size
+            if offset + size > len(payload):
+                raise ProtocolError("обрезанный пакет")
+            items.extend(_decode(payload[offset:offset + size], True))
+            offset += size
+        return items
+    if kind == ACK:
+        if len(payload) % 8:
+            raise ProtocolError("длина подтверждения не кратна 8")
+        return [{'type': 'ack', 'ids': list(struct.unpack(f'!{len(payload) // 8}Q', payload))}]
+    if kind in CONTROL_TYPES:
+        return [json.loads(payload)]
+    raise ProtocolError(f"неизвестный тип кадра {kind}")
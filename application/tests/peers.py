@@ -0,0 +1,73 @@
+# Messengers wired together over in-memory data channels, for tests that
+# drive several peers on one event loop.
+import asyncio
+import importlib
+
+import protocol
+from database import Database
+
+messenger_module = importlib.import_module('Nexus-socket')
+
+
+class FakeChannel:
+    # Stands in for an open RTCDataChannel: a frame reaches the other end's
+    # 'message' handlers on the next loop iteration, as over SCTP.
+    def __init__(self):
+        self.label = 'chat'
+        self.readyState = 'open'
+        self.bufferedAmount = 0
+        self.bufferedAmountLowThreshold = 0
+        self.handlers = {}
+        self.remote = None
+        self.sent = []
+
+    def on(self, event, handler=None):
+        if handler is None:
+            return lambda handler: self.on(event, handler)
+        self.handlers.setdefault(event, []).append(handler)
+        return handler
+
+    def send(self, message):
+        self.sent.append(message)
+        asyncio.get_running_loop().call_soon(self.remote.deliver, message)
+
+    def close(self):
+        self.readyState = 'closed'
+
+    def deliver(self, message):
+        for handler in self.handlers.get('message', ()):
+            handler(message)
+
+
+async def link(a, b):
+    ab, ba = FakeChannel(), FakeChannel()
+    ab.remote, ba.remote = ba, ab
+    await a.setup_data_channel(b.peer_id, ab)
+    await b.setup_data_channel(a.peer_id, ba)
+    a.apply_features(b.peer_id, protocol.FEATURES)
+    b.apply_features(a.peer_id, protocol.FEATURES)
+    return ab
+
+
+def messenger(tmp_path, peer_id, received, contacts=()):
+    database = Database(tmp_path / f'{peer_id}.db')
+    for contact in contacts:
+        database.add_contact(contact)
+    return messenger_module.P2PMessenger(
+        peer_id, 'http://unused', database=database,
+        on_message=lambda origin, text, via: received.append((peer_id, origin, text, via)))
+
+
+async def wait_for(condition, timeout=10):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.02)
+
+
+async def shut_down(messengers):
+    for m in messengers:
+        for queue in m.send_queues.values():
+            queue.close()
+        await m.database.flush_async()
+        await asyncio.to_thread(m.database.close)
@@ -0,0 +1,168 @@
+import asyncio
+import json
+
+import pytest
+
+import file_transfer
+from peers import FakeChannel, link, messenger, shut_down, wait_for
+
+
+class StalledChannel:
+    # A file channel whose SCTP buffer never drains below the high watermark.
+    def __init__(self, label):
+        self.label = label
+        self.readyState = 'open'
+        self.bufferedAmount = file_transfer.HIGH_WATER_MARK + 1
+        self.bufferedAmountLowThreshold = 0
+        self.handlers = {}
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def emit(self, event, *args):
+        for handler in self.handlers.get(event, ()):
+            handler(*args)
+
+    def send(self, message):
+        if isinstance(message, str) and 'sha256' in json.loads(message):
+            asyncio.get_running_loop().call_soon(self.emit, 'message', json.dumps({'resume': 0}))
+
+    def close(self):
+        self.readyState = 'closed'
+        self.emit('close')
+
+
+class FakePeerConnection:
+    def createDataChannel(self, label):
+        self.channel = StalledChannel(label)
+        return self.channel
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'x' * 4 * file_transfer.CHUNK_SIZE)
+    return path
+
+
+def test_sender_stops_when_channel_closes_while_buffer_is_full(data_file):
+    async def run():
+        pc = FakePeerConnection()
+        send = asyncio.ensure_future(file_transfer.send_file(pc, data_file))
+        await asyncio.sleep(0.2)
+        pc.channel.close()
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(send, 1)
+
+    asyncio.run(run())
+
+
+def test_sender_gives_up_when_buffer_never_drains(data_file):
+    async def run():
+        with pytest.raises(file_transfer.TransferError):
+            await asyncio.wait_for(file_transfer.send_file(FakePeerConnection(), data_file, timeout=0.2), 2)
+
+    asyncio.run(run())
+
+
+
+class PipeChannel:
+    # One end of an in-memory file channel; frames reach the other end on the
+    # next loop iteration.
+    def __init__(self, label):
+        self.label = label
+        self.readyState = 'open'
+        self.bufferedAmount = 0
+        self.bufferedAmountLowThreshold = 0
+        self.handlers = {}
+        self.remote = None
+
+    on = StalledChannel.on
+    emit = StalledChannel.emit
+
+    def send(self, message):
+        asyncio.get_running_loop().call_soon(self.remote.emit, 'message', message)
+
+    def close(self):
+        for end in (self, self.remote):
+            if end.readyState != 'closed':
+                end.readyState = 'closed'
+                end.emit('close')
+
+
+class PipePeerConnection:
+    def __init__(self, download_dir, results):
+        self.download_dir = download_dir
+        self.results = results
+
+    def createDataChannel(self, label):
+        sender, receiver = PipeChannel(label), PipeChannel(label)
+        sender.remote, receiver.remote = receiver, sender
+        file_transfer.FileReceiver(receiver, self.download_dir, on_complete=self.results.append)
+        return sender
+
+
+def test_file_arrives_intact_and_resumes_from_the_part_file(tmp_path, data_file):
+    async def run():
+        downloads, results = tmp_path / 'downloads', []
+        pc = PipePeerConnection(downloads, results)
+        sent = await file_transfer.send_file(pc, data_file)
+        assert sent['ok'] and sent['resumed_from'] == 0
+        assert results[0]['ok'] and results[0]['path'].read_bytes() == data_file.read_bytes()
+
+        # Half of a second copy is already on disk from an interrupted run.
+        sha256 = file_transfer.file_sha256(data_file)
+        (downloads / f'{sha256[:16]}.part').write_bytes(data_file.read_bytes()[:2 * file_transfer.CHUNK_SIZE])
+        sent = await file_transfer.send_file(pc, data_file)
+        assert sent['ok'] and sent['resumed_from'] == 2
+        assert sent['sent_bytes'] == 2 * file_transfer.CHUNK_SIZE
+        assert results[1]['path'].name == 'data (1).bin'
+
+    asyncio.run(run())
+
+
+GOOD_META = {'name': 'a.txt', 'size': 10, 'chunk_size': 4, 'chunks': 3, 'sha256': 'a' * 64}
+
+
+@pytest.mark.parametrize('meta', [
+    {'sha256': '../' + 'a' * 61},
+    {'name': '..'},
+    {'name': ''},
+    {'chunk_size': 0, 'chunks': 0},
+    {'chunk_size': file_transfer.MAX_CHUNK_SIZE + 1},
+    {'chunks': 1},
+    {'size': -1},
+    {'size': True},
+], ids=['sha-traversal', 'dot-dot', 'no-name', 'zero-chunk', 'huge-chunk', 'chunk-count',
+        'negative-size', 'bool-size'])
+def test_bad_metadata_is_rejected(meta):
+    with pytest.raises(file_transfer.TransferError):
+        file_transfer.check_meta({**GOOD_META, **meta})
+
+
+def test_file_name_loses_its_directories():
+    assert file_transfer.check_meta({**GOOD_META, 'name': '../../.bashrc'})['name'] == '.bashrc'
+
+
+def test_messaging_does_not_make_a_stranger_a_trusted_contact(tmp_path):
+    async def run():
+        received = []
+        bob = messenger(tmp_path, 'bob', received, ['alice'])
+        mallory = messenger(tmp_path, 'mallory', [])
+        await link(mallory, bob)
+        await mallory.broadcast('привет')
+        await wait_for(lambda: received)
+        await bob.database.flush_async()
+        # Bob stores Mallory's message, but she gets no say over his disk.
+        assert bob.database.get_messages('mallory') == [('привет', 1)]
+        stranger_file, contact_file = FakeChannel(), FakeChannel()
+        stranger_file.label = contact_file.label = 'file:transfer'
+        assert bob.receive_file('mallory', stranger_file) is None
+        assert stranger_file.readyState == 'closed'
+        assert bob.receive_file('alice', contact_file) is not None
+        # Adding her by hand is what makes her a contact.
+        bob.database.add_contact('mallory')
+        assert bob.is_contact('mallory')
+        await shut_down([bob, mallory])
+
+    asyncio.run(run())
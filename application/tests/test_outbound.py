@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+import broadcast
+import outbound
+import protocol
+from peers import link, messenger, shut_down
+
+
+def test_put_nowait_never_waits_for_room():
+    async def run():
+        queue = outbound.OutboundQueue(maxsize=1)
+        assert queue.put_nowait('a')
+        assert not queue.put_nowait('b')
+        oldest = outbound.OutboundQueue(maxsize=1, policy=outbound.DROP_OLDEST)
+        assert oldest.put_nowait('a') and oldest.put_nowait('b')
+        assert [item[0] for item in oldest.items] == ['b']
+        assert (queue.dropped, oldest.dropped) == (1, 1)
+        queue.close()
+        oldest.close()
+
+    asyncio.run(run())
+
+
+def test_full_queue_of_reconnecting_peer_does_not_stall_broadcast(tmp_path):
+    async def run():
+        received = []
+        alice = messenger(tmp_path, 'alice', received)
+        carol = messenger(tmp_path, 'carol', received, ['alice'])
+        await link(alice, carol)
+        # Bob's channel is gone and his queue is full; his reconnect may
+        # take as long as it likes.
+        detached = alice.send_queues['bob'] = outbound.OutboundQueue(maxsize=1)
+        detached.put_nowait('ещё не отправлено')
+        alice.reconnect_tasks['bob'] = asyncio.get_running_loop().create_future()
+
+        results = await asyncio.wait_for(alice.broadcast('привет'), 1)
+        assert results == {'bob': broadcast.DROPPED, 'carol': broadcast.SENT}
+        alice.reconnect_tasks.pop('bob').cancel()
+        await shut_down([alice, carol])
+
+    asyncio.run(run())
+
+
+class RecordingChannel:
+    def __init__(self):
+        self.readyState = 'open'
+        self.bufferedAmount = 0
+        self.bufferedAmountLowThreshold = 0
+        self.sent = []
+
+    def on(self, event, handler):
+        pass
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+def test_legacy_batches_keep_control_frames_apart():
+    async def run():
+        queue = outbound.OutboundQueue(coalesce=True)
+        miss = protocol.encode_relay_miss('m1', ['bob'], None)
+        for message in ('раз', 'два', miss, 'три', 'четыре'):
+            queue.put_nowait(message)
+        channel = RecordingChannel()
+        queue.attach(channel)
+        await asyncio.sleep(0.05)
+        assert len(channel.sent) == 3 and channel.sent[1] == miss
+        decoded = [item for frame in channel.sent for item in protocol.decode(frame)]
+        assert decoded == ['раз', 'два', {'type': 'relay-miss', 'id': 'm1', 'peers': ['bob']}, 'три', 'четыре']
+        queue.close()
+
+    asyncio.run(run())
+
+
+def test_control_frames_in_an_old_legacy_batch_are_decoded():
+    old_batch = protocol.encode_batch(['раз', protocol.encode_relay_miss('m1', ['bob'], None), 'два'])
+    assert protocol.decode(old_batch) == ['раз', {'type': 'relay-miss', 'id': 'm1', 'peers': ['bob']}, 'два']
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode(protocol.encode_batch(['раз', old_batch]))
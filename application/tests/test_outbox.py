@@ -0,0 +1,32 @@
+import asyncio
+
+import protocol
+from peers import link, messenger, shut_down, wait_for
+
+
+def test_outbox_is_delivered_on_connect_and_cleared_by_acks(tmp_path):
+    async def run():
+        received = []
+        alice = messenger(tmp_path, 'alice', received, ['bob'])
+        bob = messenger(tmp_path, 'bob', received, ['alice'])
+        # Bob is offline: both messages wait in Alice's outbox.
+        await alice.send_to('bob', 'первое')
+        await alice.send_to('bob', 'второе')
+        assert alice.database.outbox_counts() == {'bob': 2}
+
+        channel = await link(alice, bob)
+        await wait_for(lambda: not alice.database.outbox_counts())
+        assert [text for _, _, text, _ in received] == ['первое', 'второе']
+        assert bob.database.get_messages('alice') == [('первое', 1), ('второе', 1)]
+
+        # A resend whose ack got lost is acked again but stored only once.
+        message_id = next(item.message_id for frame in channel.sent if not isinstance(frame, str)
+                          for item in protocol.decode(frame) if isinstance(item, str))
+        await alice.send_queues['bob'].put(protocol.encode_text('первое', message_id, protocol.CODEC_NONE, reliable=True))
+        await asyncio.sleep(0.2)
+        await bob.database.flush_async()
+        assert len(received) == 2
+        assert bob.database.get_messages('alice') == [('первое', 1), ('второе', 1)]
+        await shut_down([alice, bob])
+
+    asyncio.run(run())
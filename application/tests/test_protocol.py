@@ -0,0 +1,50 @@
+import struct
+
+import pytest
+
+import protocol
+
+
+def header(kind, codec=protocol.CODEC_NONE):
+    return protocol.HEADER.pack(protocol.VERSION, kind, codec, 0, 0)
+
+
+def test_round_trip():
+    frames = [protocol.encode_text('привет', 7, protocol.CODEC_NONE, reliable=True),
+              protocol.encode_ack([1, 2, 3]),
+              protocol.encode_relay_miss('m1', ['bob'], protocol.CODEC_NONE)]
+    text, ack, miss = protocol.decode(protocol.encode_batch(frames, protocol.CODEC_NONE))
+    assert (text, text.message_id, text.reliable) == ('привет', 7, True)
+    assert ack == {'type': 'ack', 'ids': [1, 2, 3]}
+    assert miss == {'type': 'relay-miss', 'id': 'm1', 'peers': ['bob']}
+
+
+def test_compressed_round_trip():
+    text = 'x' * 4096
+    frame = protocol.encode_text(text, 1, protocol.CODEC_ZLIB)
+    assert len(frame) < len(text)
+    assert protocol.decode(frame) == [text]
+
+
+@pytest.mark.parametrize('frame', [
+    header(protocol.ACK) + b'\x00' * 12,
+    header(protocol.BATCH) + struct.pack('!I', 100) + b'abc',
+    header(protocol.BATCH) + b'\x00\x00',
+    header(protocol.BATCH) + protocol.LENGTH.pack(protocol.HEADER.size) + header(protocol.BATCH),
+    header(protocol.TEXT, protocol.CODEC_ZLIB) + b'not zlib',
+    header(protocol.TEXT, protocol.CODEC_ZSTD) + b'not zstd',
+    header(protocol.TEXT, 0x0f) + b'abc',
+    header(protocol.TEXT) + b'\xff\xfe',
+    header(protocol.RELAY) + b'{broken',
+    header(protocol.RELAY) + b'[1, 2]',
+    header(99) + b'',
+    b'\x01\x01',
+    b'\x7f' + header(protocol.TEXT)[1:],
+    protocol.CONTROL_PREFIX + '{broken',
+    protocol.CONTROL_PREFIX + '[1, {"no": "type"}]',
+], ids=['odd-ack', 'truncated-batch', 'batch-length-cut', 'nested-batch', 'bad-zlib', 'bad-zstd',
+        'unknown-codec', 'bad-utf8', 'bad-json', 'control-not-object', 'unknown-kind', 'short',
+        'bad-version', 'legacy-bad-json', 'legacy-bad-items'])
+def test_malformed_frames_raise_protocol_error(frame):
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode(frame)
@@ -0,0 +1,80 @@
+import asyncio
+
+import broadcast
+import protocol
+from peers import link, messenger, shut_down, wait_for
+
+
+def test_relay_tree_is_acked_end_to_end(tmp_path):
+    # Every peer has an outbox and acks, as in a real deployment; the
+    # broadcast must still go out as a relay tree and clear the outbox.
+    async def run():
+        received = []
+        alice = messenger(tmp_path, 'alice', received)
+        peers = [messenger(tmp_path, f'peer-{i:02d}', received, ['alice'])
+                 for i in range(broadcast.RELAY_THRESHOLD + 4)]
+        nodes = [alice, *peers]
+        uplinks = []
+        for index, a in enumerate(nodes):
+            for b in nodes[index + 1:]:
+                channel = await link(a, b)
+                if a is alice:
+                    uplinks.append(channel)
+        # Opening a channel drains the (empty) outbox; let that finish.
+        await wait_for(lambda: not any(m.drain_tasks for m in nodes))
+
+        results = await alice.broadcast('привет всем')
+        assert sum(result == broadcast.SENT for result in results.values()) == broadcast.RELAY_FANOUT
+        assert sum(result == broadcast.RELAYED for result in results.values()) == len(peers) - broadcast.RELAY_FANOUT
+
+        await wait_for(lambda: len(received) == len(peers))
+        await wait_for(lambda: not alice.database.outbox_counts())
+        assert sum(len(channel.sent) for channel in uplinks) == broadcast.RELAY_FANOUT
+        assert sorted(peer_id for peer_id, _, _, _ in received) == [peer.peer_id for peer in peers]
+        for peer in peers:
+            assert peer.database.get_messages('alice') == [('привет всем', 1)]
+
+        # The origin's direct resend of the same outbox entry is a duplicate.
+        item = next(i for i, _ in alice.seen_relays.items.values())
+        frame = protocol.encode_text('привет всем', item['ack'], protocol.CODEC_NONE, reliable=True)
+        await alice.send_queues[peers[0].peer_id].put(frame)
+        await asyncio.sleep(0.2)
+        assert len(received) == len(peers)
+        await shut_down(nodes)
+
+    asyncio.run(run())
+
+
+def test_relayed_origin_must_be_a_contact(tmp_path):
+    async def run():
+        received = []
+        bob = messenger(tmp_path, 'bob', received, ['alice'])
+        mallory = messenger(tmp_path, 'mallory', [])
+        channel = await link(mallory, bob)
+        for origin in ('alice', 'carol'):
+            channel.send(protocol.encode_relay(origin, origin, f'от {origin}', [], broadcast.RELAY_FANOUT,
+                                               protocol.CODEC_NONE))
+        channel.send(protocol.encode_control({'type': 'relay', 'id': 'broken'}, protocol.CODEC_NONE))
+        await asyncio.sleep(0.2)
+        assert received == [('bob', 'alice', 'от alice', 'mallory')]
+        await shut_down([bob, mallory])
+
+    asyncio.run(run())
+
+
+def test_relay_ack_only_clears_the_acking_peers_subtree(tmp_path):
+    async def run():
+        alice = messenger(tmp_path, 'alice', [])
+        message_number = alice.database.outbox_add('привет', ['bob', 'carol', 'dave'])
+        alice.seen_relays.add('m1', {'id': 'm1', 'origin': 'alice', 'text': 'привет', 'ack': message_number}, None)
+        alice.seen_relays.hand_down('m1', 'bob', ['bob', 'carol'])
+        alice.seen_relays.hand_down('m1', 'dave', ['dave'])
+        # Bob speaks for Dave, and Mallory, who got nothing, for everyone.
+        alice.handle_control('bob', {'type': 'relay-ack', 'id': 'm1', 'peers': ['bob', 'dave']})
+        alice.handle_control('mallory', {'type': 'relay-ack', 'id': 'm1', 'peers': ['carol', 'dave']})
+        await wait_for(lambda: 'bob' not in alice.database.outbox_counts())
+        await asyncio.sleep(0.1)
+        assert alice.database.outbox_counts() == {'carol': 1, 'dave': 1}
+        await shut_down([alice])
+
+    asyncio.run(run())
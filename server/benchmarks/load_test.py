@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import socketio
+
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+SIGNAL_TYPES = ('offer', 'answer', 'ice-candidate')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+CANDIDATE = 'candidate:0 1 UDP 2122252543 192.0.2.1 54400 typ host'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, env=None):
+    code = ("import asyncio\n"
+            "import signaling_server_webrtc as server\n"
+            f"asyncio.run(server.serve('127.0.0.1', {port}))\n")
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=SERVER_DIR,
+                               # Every simulated client connects from loopback.
+                               env={**os.environ, 'NEXUS_TRUSTED_ADDRESSES': '127.0.0.1,::1', **(env or {})},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+def rss_bytes(pid):
+    with open(f'/proc/{pid}/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def latency_summary(samples):
+    if not samples:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': max(samples) * 1000,
+        'mean_ms': statistics.fmean(samples) * 1000,
+    }
+
+
+class Peer:
+    def __init__(self, peer_id, url, stats, batched=False):
+        self.peer_id = peer_id
+        self.batched = batched
+        self.url = url
+        self.stats = stats
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.registered = asyncio.Event()
+        self.peers_waiter = None
+        self.sio.on('registered', self.on_registered)
+        self.sio.on('peers_list', self.on_peers_list)
+        self.sio.on('signal', self.on_signal)
+        self.sio.on('signals', self.on_signals)
+        self.sio.on('error', self.on_error)
+
+    async def on_registered(self, data):
+        self.registered.set()
+
+    async def on_peers_list(self, data):
+        if self.peers_waiter is not None and not self.peers_waiter.done():
+            self.peers_waiter.set_result(data['peers'])
+
+    async def on_signal(self, data):
+        self.stats['frames_received'] += 1
+        self.stats['received'] += 1
+        self.stats['relay_latency'].append(time.perf_counter() - data['data']['sent_at'])
+
+    async def on_signals(self, data):
+        now = time.perf_counter()
+        self.stats['frames_received'] += 1
+        self.stats['received'] += len(data['signals'])
+        self.stats['relay_latency'].extend(now - item['data']['sent_at'] for item in data['signals'])
+
+    async def on_error(self, data):
+        self.stats['errors'] += 1
+
+    async def connect(self):
+        await self.sio.connect(self.url, transports=['websocket'])
+        registration = {'peer_id': self.peer_id}
+        if self.batched:
+            registration['features'] = ['signals']
+        await self.sio.emit('register', registration)
+        await asyncio.wait_for(self.registered.wait(), 30)
+
+    async def get_peers(self):
+        self.peers_waiter = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        await self.sio.emit('get_peers', {})
+        await asyncio.wait_for(self.peers_waiter, 30)
+        self.stats['get_peers_latency'].append(time.perf_counter() - start)
+
+    async def send_signal(self, target, signal_type):
+        await self.sio.emit('signal', {
+            'target': target,
+            'type': signal_type,
+            'data': {'sent_at': time.perf_counter(), 'candidate': CANDIDATE}
+        })
+        self.stats['sent'] += 1
+        self.stats['frames_sent'] += 1
+
+    async def send_signals(self, target, signal_types):
+        sent_at = time.perf_counter()
+        await self.sio.emit('signals', {
+            'target': target,
+            'signals': [{'type': signal_type, 'data': {'sent_at': sent_at, 'candidate': CANDIDATE}}
+                        for signal_type in signal_types]
+        })
+        self.stats['sent'] += len(signal_types)
+        self.stats['frames_sent'] += 1
+
+
+async def bounded(tasks, limit):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(task):
+        async with semaphore:
+            return await task
+    return await asyncio.gather(*(run(task) for task in tasks))
+
+
+async def run_load(args, pid):
+    stats = {'sent': 0, 'received': 0, 'errors': 0, 'frames_sent': 0, 'frames_received': 0,
+             'relay_latency': [], 'get_peers_latency': []}
+    peers = [Peer(f"load-{i}", args.url, stats, args.batch > 1) for i in range(args.clients)]
+    result = {'clients': args.clients, 'signals_per_client': args.signals_per_client,
+              'rate': args.rate, 'batch': args.batch}
+
+    rss_before = rss_bytes(pid) if pid else None
+    start = time.perf_counter()
+    await bounded([peer.connect() for peer in peers], args.connect_concurrency)
+    result['connect_register_s'] = time.perf_counter() - start
+    await asyncio.sleep(1)
+    if pid:
+        result['server_rss_bytes'] = rss_bytes(pid)
+        result['memory_per_connection_bytes'] = (result['server_rss_bytes'] - rss_before) / args.clients
+
+    start = time.perf_counter()
+    await bounded([peer.get_peers() for peer in random.sample(peers, min(args.get_peers_calls, len(peers)))],
+                  args.connect_concurrency)
+    result['get_peers'] = latency_summary(stats['get_peers_latency'])
+    result['get_peers']['duration_s'] = time.perf_counter() - start
+
+    cpu_before = cpu_seconds(pid) if pid else None
+    start = time.perf_counter()
+
+    # With --rate the storm is paced to a total frames/sec so relay latency
+    # reflects the server rather than client-side queueing. With --batch N
+    # every frame carries N candidates for one target, like a call setup
+    # flushing its coalesced ICE candidates.
+    batch = max(1, args.batch)
+    interval = args.clients / args.rate if args.rate else 0
+
+    async def storm(index, peer):
+        if interval:
+            await asyncio.sleep(random.uniform(0, interval))
+        for frame, n in enumerate(range(0, args.signals_per_client, batch)):
+            if interval and frame:
+                await asyncio.sleep(interval)
+            target = peers[(index + 1 + frame % (len(peers) - 1)) % len(peers)].peer_id
+            if batch == 1:
+                await peer.send_signal(target, SIGNAL_TYPES[n % len(SIGNAL_TYPES)])
+            else:
+                count = min(batch, args.signals_per_client - n)
+                await peer.send_signals(target, ['ice-candidate'] * count)
+
+    await asyncio.gather(*(storm(i, peer) for i, peer in enumerate(peers)))
+    expected = args.clients * args.signals_per_client
+    deadline = time.monotonic() + args.drain_timeout
+    while stats['received'] < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    result['signals'] = {
+        'sent': stats['sent'],
+        'received': stats['received'],
+        'lost': expected - stats['received'],
+        'frames_sent': stats['frames_sent'],
+        'frames_received': stats['frames_received'],
+        'duration_s': elapsed,
+        'throughput_per_s': stats['received'] / elapsed,
+        'relay_latency': latency_summary(stats['relay_latency']),
+    }
+    if pid:
+        cpu = cpu_seconds(pid) - cpu_before
+        result['signals']['server_cpu_s'] = cpu
+        result['signals']['server_cpu_percent'] = 100 * cpu / elapsed
+        result['signals']['server_cpu_us_per_signal'] = 1e6 * cpu / max(1, stats['received'])
+        result['signals']['server_cpu_us_per_frame'] = 1e6 * cpu / max(1, stats['frames_sent'])
+    result['errors'] = stats['errors']
+
+    await bounded([peer.sio.disconnect() for peer in peers], args.connect_concurrency)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сигнального сервера")
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--signals-per-client', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=0, help="сигналов в секунду суммарно (0 — без ограничения)")
+    parser.add_argument('--batch', type=int, default=1,
+                        help="сигналов в одном кадре `signals` (1 — отдельные события `signal`)")
+    parser.add_argument('--get-peers-calls', type=int, default=200)
+    parser.add_argument('--connect-concurrency', type=int, default=100)
+    parser.add_argument('--drain-timeout', type=float, default=30)
+    parser.add_argument('--url', help="тестировать уже запущенный сервер вместо локального")
+    parser.add_argument('--server-pid', type=int, help="PID внешнего сервера для замеров памяти и CPU")
+    parser.add_argument('--output', help="файл для JSON-результата (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    process = None
+    pid = args.server_pid
+    if not args.url:
+        port = free_port()
+        process = start_server(port)
+        pid = process.pid
+        args.url = f'http://127.0.0.1:{port}'
+    try:
+        result = asyncio.run(run_load(args, pid))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    result['timestamp'] = time.time()
+    output = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
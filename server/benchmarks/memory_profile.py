@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+SIZES = (10000, 50000, 100000)
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def environ_for(index):
+    # Roughly what engine.io keeps per connection from aiohttp's request,
+    # minus the request object itself.
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/socket.io/',
+        'QUERY_STRING': f'EIO=4&transport=websocket&t={index}',
+        'RAW_URI': f'/socket.io/?EIO=4&transport=websocket&t={index}',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': f'10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}',
+        'REMOTE_PORT': str(40000 + index % 20000),
+        'SERVER_NAME': 'aiohttp',
+        'SERVER_PORT': '8080',
+        'HTTP_HOST': 'nexus.example:8080',
+        'HTTP_USER_AGENT': 'Python/3.11 aiohttp/3.9',
+        'HTTP_CONNECTION': 'Upgrade',
+        'HTTP_UPGRADE': 'websocket',
+        'HTTP_SEC_WEBSOCKET_VERSION': '13',
+        'HTTP_SEC_WEBSOCKET_KEY': f'{index:022d}==',
+        'wsgi.url_scheme': 'http',
+    }
+
+
+async def connect_peers(server, count):
+    # Drives the real engine.io -> socket.io -> handler path for each peer,
+    # with an in-memory socket instead of a websocket. Packets the server
+    # queues for the client are dropped as if they had been written out.
+    from engineio.async_socket import AsyncSocket
+    sio = server.sio
+    eio = sio.eio
+    # Nobody answers pings here; a long run must not time the first peers out.
+    eio.ping_interval = eio.ping_timeout = 3600
+    for index in range(count):
+        eio_sid = eio.generate_id()
+        socket = AsyncSocket(eio, eio_sid)
+        socket.connected = True
+        eio.sockets[eio_sid] = socket
+        await sio._handle_eio_connect(eio_sid, environ_for(index))
+        await sio._handle_eio_message(eio_sid, '0')
+        await sio._handle_eio_message(eio_sid, '2' + json.dumps(
+            ['register', {'peer_id': f'peer-{index:06d}', 'features': ['signals']}]))
+        await asyncio.sleep(0)
+        while not socket.queue.empty():
+            socket.queue.get_nowait()
+            socket.queue.task_done()
+
+
+def measure(count):
+    # Environment first: the server reads its limits at import time.
+    os.environ.setdefault('NEXUS_MAX_CONNECTIONS', str(count * 2))
+    sys.path.insert(0, str(SERVER_DIR))
+    import signaling_server_webrtc as server
+    from registry import PeerRegistry
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # The whole stack is measured by RSS: under tracemalloc a large run gets
+    # slow enough for engine.io to time out the first sockets.
+    loop = asyncio.new_event_loop()
+    gc.collect()
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    loop.run_until_complete(connect_peers(server, count))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    rss = rss_bytes() - rss_before
+    assert loop.run_until_complete(server.registry.count()) == count
+
+    # The registry on its own, with the same ids.
+    tracemalloc.start()
+    registry = PeerRegistry()
+    for index in range(count):
+        loop.run_until_complete(registry.register(f'peer-{index:06d}', f'sid{index:017d}', ('signals',)))
+    gc.collect()
+    registry_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'peers': count,
+        'rss_bytes_per_peer': rss / count,
+        'registry_bytes_per_peer': registry_bytes / count,
+        'connect_us_per_peer': elapsed / count * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память сигнального сервера на одного подключённого пира")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        print(json.dumps(measure(args.run)))
+        return
+
+    # One fresh process per size, so earlier runs don't skew the numbers.
+    print(f"{'peers':>8} {'RSS B/peer':>11} {'registry B/peer':>16} {'connect µs':>11}")
+    for count in args.sizes:
+        output = subprocess.run([sys.executable, __file__, '--run', str(count)],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['peers']:>8} {result['rss_bytes_per_peer']:>11.0f} {result['registry_bytes_per_peer']:>16.0f} "
+              f"{result['connect_us_per_peer']:>11.1f}")
+    print("\nRSS: engine.io socket + socket.io session + rate limiter + registry; the websocket")
+    print("transport and kernel socket buffers are not included. registry: PeerRegistry alone, by tracemalloc.")
+
+
+if __name__ == '__main__':
+    main()
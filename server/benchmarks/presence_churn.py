@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+SIZES = (5000, 20000, 50000)
+PRESENCE_PAGE_SIZE = 100
+# A join plus its first snapshot page must stay this cheap however many
+# peers are registered; a full re-sort per page blows far past it.
+MAX_US_PER_JOIN = 200
+
+
+async def churn(registry, count):
+    # Every client registers and at once asks for the first presence page,
+    # as after a reconnect storm; then they all leave, paging in between.
+    peer_ids = [f'peer-{index:06d}' for index in range(count)]
+    random.shuffle(peer_ids)
+    start = time.perf_counter()
+    for index, peer_id in enumerate(peer_ids):
+        await registry.register(peer_id, f'sid{index:017d}', ('signals',))
+        await registry.page_peers(None, PRESENCE_PAGE_SIZE)
+    joined = time.perf_counter() - start
+    start = time.perf_counter()
+    for index in range(count):
+        await registry.unregister(f'sid{index:017d}')
+        await registry.page_peers(None, PRESENCE_PAGE_SIZE)
+    left = time.perf_counter() - start
+    assert await registry.count() == 0
+    return joined / count * 1e6, left / count * 1e6
+
+
+class BrokerOps:
+    # The broker's register/page/unregister ops, called as a worker's
+    # requests would reach them, without the socket in between.
+    def __init__(self):
+        from broker import Broker
+        self.broker = Broker('unused')
+        self.owned = set()
+
+    async def register(self, peer_id, sid, features):
+        await self.broker.handle_registry('register', {'peer_id': peer_id, 'sid': sid, 'features': features},
+                                          self.owned)
+
+    async def page_peers(self, cursor, limit):
+        await self.broker.handle_registry('page', {'cursor': cursor, 'limit': limit}, self.owned)
+
+    async def unregister(self, sid):
+        await self.broker.handle_registry('unregister', {'sid': sid}, self.owned)
+
+    async def count(self):
+        return await self.broker.registry.count()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Регистрация и первая страница присутствия на каждого пира")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--max-us', type=float, default=MAX_US_PER_JOIN,
+                        help="порог в мкс на пира, выше которого бенчмарк завершается с ошибкой")
+    args = parser.parse_args()
+    sys.path.insert(0, str(SERVER_DIR))
+    from registry import PeerRegistry
+
+    failed = False
+    print(f"{'peers':>8} {'registry':>9} {'join µs':>8} {'leave µs':>9}")
+    for count in args.sizes:
+        for name, registry in (('local', PeerRegistry()), ('broker', BrokerOps())):
+            join_us, leave_us = asyncio.run(churn(registry, count))
+            failed |= max(join_us, leave_us) > args.max_us
+            print(f"{count:>8} {name:>9} {join_us:>8.1f} {leave_us:>9.1f}")
+    if failed:
+        print(f"\nБольше {args.max_us:g} мкс на пира: страница присутствия снова зависит от размера реестра")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
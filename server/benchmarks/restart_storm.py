@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import socketio
+
+from load_test import free_port, start_server, cpu_seconds, percentile, bounded
+
+
+# Restarts the signaling server under load and measures the reconnect
+# storm the replacement process sees:
+#   abrupt - the old process is killed; clients find out from the dropped
+#            socket and rely on socketio's reconnection backoff (what a
+#            deploy did before graceful draining).
+#   drain  - the old process gets SIGTERM, hands out spread-out
+#            server_migrate hints and a registry snapshot, and the
+#            replacement starts on the same port.
+
+
+class Run:
+    def __init__(self):
+        self.restart_at = None
+        # Off while the clients first connect: each join would go to everyone
+        # already subscribed, and that ramp is not what is being measured.
+        self.follow_presence = False
+        self.last_presence = 0.0
+        self.reconnects = []
+        self.presence_entries = 0
+        self.sent = 0
+        self.received = 0
+        self.errors = Counter()
+
+
+class Client:
+    # Behaves like P2PMessenger towards the server: registers on every
+    # (re)connection, follows presence, and moves when told to migrate.
+    def __init__(self, peer_id, url, run):
+        self.peer_id = peer_id
+        self.url = url
+        self.run = run
+        self.registered = asyncio.Event()
+        self.migrate_task = None
+        self.closing = False
+        self.sio = socketio.AsyncClient(reconnection_delay=0.5, reconnection_delay_max=30)
+        self.sio.on('connect', self.on_connect)
+        self.sio.on('disconnect', self.on_disconnect)
+        self.sio.on('registered', self.on_registered)
+        self.sio.on('presence', self.on_presence)
+        self.sio.on('signal', self.on_signal)
+        self.sio.on('error', self.on_error)
+        self.sio.on('server_migrate', self.on_server_migrate)
+
+    async def on_connect(self):
+        await self.sio.emit('register', {'peer_id': self.peer_id, 'features': ['signals']})
+
+    async def on_disconnect(self, *args):
+        self.registered.clear()
+
+    async def on_registered(self, data):
+        if self.run.restart_at is not None:
+            self.run.reconnects.append(time.perf_counter() - self.run.restart_at)
+        self.registered.set()
+        if self.run.follow_presence:
+            await self.sio.emit('subscribe_presence', {})
+
+    async def on_presence(self, data):
+        self.run.last_presence = time.perf_counter()
+        if self.run.restart_at is not None:
+            self.run.presence_entries += len(data.get('joined', ())) + len(data.get('left', ()))
+
+    async def on_signal(self, data):
+        self.run.received += 1
+
+    async def on_error(self, data):
+        self.run.errors[data.get('code') or 'other'] += 1
+
+    async def on_server_migrate(self, data):
+        if self.migrate_task is None:
+            self.migrate_task = asyncio.create_task(self.migrate(data.get('reconnect_after', 0)))
+
+    async def migrate(self, delay):
+        try:
+            await asyncio.sleep(delay)
+            if self.closing or not self.sio.connected:
+                return
+            await self.sio.disconnect()
+            if not self.closing:
+                await self.sio.connect(self.url, retry=True, transports=['websocket'])
+        finally:
+            self.migrate_task = None
+
+    async def connect(self):
+        await self.sio.connect(self.url, transports=['websocket'])
+        await asyncio.wait_for(self.registered.wait(), 30)
+
+    async def close(self):
+        self.closing = True
+        if self.migrate_task is not None:
+            self.migrate_task.cancel()
+        await self.sio.disconnect()
+
+
+async def signal_load(clients, run, rate):
+    # Random pairs, paced to `rate` signals a second in total, from clients
+    # that are registered at that moment.
+    while True:
+        await asyncio.sleep(1 / rate)
+        sender, target = random.sample(clients, 2)
+        if not sender.registered.is_set():
+            continue
+        try:
+            await sender.sio.emit('signal', {'target': target.peer_id, 'type': 'ice-candidate',
+                                             'data': {'candidate': 'x'}})
+            run.sent += 1
+        except socketio.exceptions.BadNamespaceError:
+            pass
+
+
+def port_open(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+        return True
+    except OSError:
+        return False
+
+
+def peak(samples, width):
+    # Most reconnects that landed in any `width`-second sliding window.
+    samples = sorted(samples)
+    best = start = 0
+    for end, sample in enumerate(samples):
+        while sample - samples[start] > width:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+async def restart(args, mode):
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    env = {'NEXUS_DRAIN_WINDOW': str(args.window)}
+    if mode == 'drain':
+        env['NEXUS_SNAPSHOT'] = os.path.join(tempfile.mkdtemp(), 'registry.json')
+    old = start_server(port, env)
+    run = Run()
+    clients = [Client(f'storm-{i}', url, run) for i in range(args.clients)]
+    await bounded([client.connect() for client in clients], 100)
+    run.follow_presence = True
+    for client in clients:
+        await client.sio.emit('subscribe_presence', {})
+    load = asyncio.create_task(signal_load(clients, run, args.signal_rate))
+    await asyncio.sleep(1)
+    while time.perf_counter() - run.last_presence < 1:
+        await asyncio.sleep(0.1)
+
+    sent_before, received_before = run.sent, run.received
+    run.restart_at = time.perf_counter()
+    old.send_signal(signal.SIGTERM if mode == 'drain' else signal.SIGKILL)
+    # The replacement can only bind once the old listener is gone.
+    while port_open(port):
+        await asyncio.sleep(0.01)
+    new = await asyncio.to_thread(start_server, port, env)
+    started = time.perf_counter() - run.restart_at
+    cpu_before = cpu_seconds(new.pid)
+
+    deadline = time.monotonic() + args.window + args.timeout
+    while len(run.reconnects) < args.clients and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    recovered = time.perf_counter() - run.restart_at
+    cpu = cpu_seconds(new.pid) - cpu_before
+    load.cancel()
+    await asyncio.sleep(0.5)
+
+    result = {
+        'mode': mode,
+        'clients': args.clients,
+        'replacement_started_s': round(started, 3),
+        'reconnected': len(run.reconnects),
+        'all_reconnected_s': round(recovered, 3),
+        'reconnect_p50_s': round(percentile(run.reconnects, 0.5) or 0, 3),
+        'reconnect_p99_s': round(percentile(run.reconnects, 0.99) or 0, 3),
+        'storm_peak_per_100ms': peak(run.reconnects, 0.1),
+        'storm_peak_per_s': peak(run.reconnects, 1.0),
+        'presence_entries_delivered': run.presence_entries,
+        'replacement_cpu_s': round(cpu, 2),
+        'signals_sent': run.sent - sent_before,
+        'signals_received': run.received - received_before,
+        'errors': dict(run.errors),
+    }
+    await bounded([client.close() for client in clients], 100)
+    for process in (old, new):
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перезапуск сигнального сервера под нагрузкой")
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--window', type=float, default=5, help="окно переподключения при остановке, с")
+    parser.add_argument('--signal-rate', type=float, default=200, help="сигналов в секунду суммарно")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--mode', choices=('abrupt', 'drain', 'both'), default='both')
+    parser.add_argument('--output', help="файл для JSON-результата (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    modes = ('abrupt', 'drain') if args.mode == 'both' else (args.mode,)
+    results = [asyncio.run(restart(args, mode)) for mode in modes]
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from registry import PeerRegistry
+
+
+logger = logging.getLogger(__name__)
+
+# A worker that lost the broker reconnects after 0.1 s, doubling up to this.
+RECONNECT_DELAY_MAX = 5
+PRESENCE_ROOM = 'presence'
+
+
+def presence_emits(delta, peer_ids):
+    # socket.io pubsub 'emit' messages, as AsyncPubSubManager publishes
+    # them, that deliver a presence delta to full-roster subscribers and to
+    # everyone watching one of `peer_ids`.
+    rooms = [PRESENCE_ROOM, *(f'presence:{peer_id}' for peer_id in peer_ids)]
+    return [{'method': 'emit', 'event': 'presence', 'data': [delta], 'binary': False,
+             'namespace': '/', 'room': room, 'skip_sid': None, 'callback': None,
+             'host_id': 'broker'} for room in rooms]
+
+
+class Broker:
+    # Local stand-in for Redis: a UNIX-socket hub that fans published
+    # socket.io manager messages out to every worker process and owns the
+    # shared peer registry. Speaks newline-delimited JSON.
+    def __init__(self, path):
+        self.path = path
+        self.subscribers = set()
+        self.registry = PeerRegistry()
+        self.owners = {}
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+        logger.info("Брокер слушает %s", self.path)
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        owned = self.owners[writer] = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message.get('op')
+                if op == 'publish':
+                    self.publish(message['data'])
+                    continue
+                if op == 'subscribe':
+                    self.subscribers.add(writer)
+                    continue
+                reply = await self.handle_registry(op, message, owned)
+                reply['id'] = message.get('id')
+                writer.write(json.dumps(reply).encode() + b'\n')
+        except (ConnectionError, json.JSONDecodeError) as e:
+            logger.warning("Брокер: соединение с воркером прервано: %s", e)
+        finally:
+            # A worker that died takes its registrations with it, and the
+            # other workers' presence subscribers hear that they left.
+            self.subscribers.discard(writer)
+            gone, seq = await self.registry.unregister_many(owned)
+            if seq is not None:
+                logger.warning("Брокер: воркер отключился, ушло пиров: %d", len(gone))
+                for data in presence_emits({'seq': seq, 'left': gone}, gone):
+                    self.publish(data)
+            del self.owners[writer]
+            writer.close()
+
+    def publish(self, data):
+        frame = json.dumps({'data': data}).encode() + b'\n'
+        for subscriber in self.subscribers:
+            subscriber.write(frame)
+
+    async def handle_registry(self, op, message, owned):
+        registry = self.registry
+        if op == 'register':
+            ok, seq = await registry.register(message['peer_id'], message['sid'],
+                                              message.get('features', ()))
+            if ok:
+                owned.add(message['sid'])
+            return {'ok': ok, 'seq': seq}
+        if op == 'restore':
+            # A worker that reconnected registers its sessions again; they
+            # rejoin presence in one delta.
+            joined, refused, seq = await registry.register_many(message['sessions'])
+            owned.update(sid for _, sid, _ in message['sessions'] if sid not in refused)
+            if seq is not None:
+                for data in presence_emits({'seq': seq, 'joined': joined}, joined):
+                    self.publish(data)
+            return {'refused': refused}
+        if op == 'unregister':
+            owned.discard(message['sid'])
+            peer_id, seq = await registry.unregister(message['sid'])
+            return {'peer_id': peer_id, 'seq': seq}
+        if op == 'lookup':
+            return {'sid': await registry.lookup(message['peer_id'])}
+        if op == 'route':
+            sid, features = await registry.route(message['peer_id'])
+            return {'sid': sid, 'features': features}
+        if op == 'list':
+            return {'peers': await registry.list_peers()}
+        if op == 'page':
+            peers, cursor, seq = await registry.page_peers(message.get('cursor'), message['limit'])
+            return {'peers': peers, 'cursor': cursor, 'seq': seq}
+        if op == 'online':
+            peers, seq = await registry.online(message['peers'])
+            return {'peers': peers, 'seq': seq}
+        if op == 'count':
+            return {'count': await registry.count()}
+        return {'error': f'unknown op {op}'}
+
+
+class BrokerClient:
+    # One connection per worker process, shared by the socket.io manager and
+    # the registry. Replies are matched to requests by id. If the broker
+    # goes away, pending and new requests fail with ConnectionError while
+    # the connection is retried in the background; `on_reconnect` then runs
+    # (the registry re-registers its sessions) and pubsub messages resume.
+    def __init__(self, path):
+        self.path = path
+        self.reader = None
+        self.writer = None
+        self.messages = asyncio.Queue()
+        self.on_reconnect = None
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = None
+        self._task = None
+
+    async def connect(self):
+        if self._task is not None:
+            if self.writer is None:
+                raise ConnectionError('broker connection lost')
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._task is None:
+                await self._open()
+                self._task = asyncio.create_task(self._run())
+
+    async def _open(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.writer.write(b'{"op": "subscribe"}\n')
+
+    async def _run(self):
+        while True:
+            try:
+                await self._read_loop()
+                logger.error("❌ Соединение с брокером потеряно")
+            except (ConnectionError, ValueError) as e:
+                logger.error("❌ Соединение с брокером потеряно: %s", e)
+            self._lost()
+            delay = 0.1
+            while True:
+                await asyncio.sleep(delay)
+                try:
+                    await self._open()
+                    break
+                except OSError as e:
+                    logger.warning("Брокер недоступен: %s", e)
+                    delay = min(delay * 2, RECONNECT_DELAY_MAX)
+            logger.info("Соединение с брокером восстановлено")
+            if self.on_reconnect is not None:
+                asyncio.create_task(self.on_reconnect())
+
+    def _lost(self):
+        self.writer.close()
+        self.reader = self.writer = None
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('broker connection lost'))
+
+    async def _read_loop(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            if 'data' in message:
+                self.messages.put_nowait(message['data'])
+            else:
+                future = self._pending.pop(message.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+
+    async def publish(self, data):
+        await self.connect()
+        self.writer.write(json.dumps({'op': 'publish', 'data': data}).encode() + b'\n')
+
+    async def request(self, op, **fields):
+        await self.connect()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        fields.update(op=op, id=request_id)
+        self.writer.write(json.dumps(fields).encode() + b'\n')
+        return await future
+
+
+class BrokerManager(AsyncPubSubManager):
+    name = 'nexus-broker'
+
+    def __init__(self, client, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.client = client
+
+    async def emit(self, event, data, namespace=None, room=None, skip_sid=None,
+                   callback=None, to=None, **kwargs):
+        room = to or room
+        # Relays to a sid owned by this worker never need to leave the process.
+        if room is not None and self.is_connected(room, namespace or '/'):
+            kwargs['ignore_queue'] = True
+        return await super().emit(event, data, namespace=namespace, room=room,
+                                  skip_sid=skip_sid, callback=callback, **kwargs)
+
+    async def _publish(self, data):
+        await self.client.publish(data)
+
+    async def _listen(self):
+        await self.client.connect()
+        while True:
+            yield await self.client.messages.get()
+
+
+class BrokerRegistry:
+    # Registry shared by all workers through the broker. Lookups of the local
+    # sid -> peer_id mapping (every handler's own caller) stay in-process.
+    def __init__(self, client):
+        self.client = client
+        self.peers = {}
+        self.features = {}
+        client.on_reconnect = self.reregister
+
+    async def register(self, peer_id, sid, features=()):
+        reply = await self.client.request('register', peer_id=peer_id, sid=sid, features=list(features))
+        if reply['ok']:
+            self.peers[sid] = peer_id
+            self.features[sid] = list(features)
+        return reply['ok'], reply['seq']
+
+    async def reregister(self):
+        # The broker dropped our sessions when the connection did (and a
+        # restarted broker never had them); our clients are still here.
+        sessions = [[peer_id, sid, self.features.get(sid, [])] for sid, peer_id in self.peers.items()]
+        if not sessions:
+            return
+        try:
+            reply = await self.client.request('restore', sessions=sessions)
+        except ConnectionError:
+            return
+        for sid in reply['refused']:
+            logger.warning("peer_id %s занят на другом воркере, сессия %s не восстановлена", self.peers.get(sid), sid)
+            self.peers.pop(sid, None)
+            self.features.pop(sid, None)
+        logger.info("Сессий восстановлено в брокере: %d", len(sessions) - len(reply['refused']))
+
+    async def unregister(self, sid):
+        self.features.pop(sid, None)
+        if self.peers.pop(sid, None) is None:
+            return None, None
+        reply = await self.client.request('unregister', sid=sid)
+        return reply['peer_id'], reply['seq']
+
+    async def lookup(self, peer_id):
+        reply = await self.client.request('lookup', peer_id=peer_id)
+        return reply['sid']
+
+    async def route(self, peer_id):
+        reply = await self.client.request('route', peer_id=peer_id)
+        return reply['sid'], reply['features']
+
+    async def peer_of(self, sid):
+        return self.peers.get(sid)
+
+    async def list_peers(self):
+        reply = await self.client.request('list')
+        return reply['peers']
+
+    async def page_peers(self, cursor=None, limit=100):
+        reply = await self.client.request('page', cursor=cursor, limit=limit)
+        return reply['peers'], reply['cursor'], reply['seq']
+
+    async def online(self, peer_ids):
+        reply = await self.client.request('online', peers=list(peer_ids))
+        return reply['peers'], reply['seq']
+
+    async def count(self):
+        reply = await self.client.request('count')
+        return reply['count']
+
+    def local_count(self):
+        return len(self.peers)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    path = sys.argv[1] if len(sys.argv) > 1 else '/tmp/nexus-broker.sock'
+    try:
+        asyncio.run(Broker(path).serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,110 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Clients are told to reconnect at evenly spread times within this many
+# seconds, so a restart costs the replacement process about
+# clients / DRAIN_WINDOW registrations a second instead of all at once.
+DRAIN_WINDOW = float(os.environ.get('NEXUS_DRAIN_WINDOW', '10'))
+# After the window, how long to keep waiting for stragglers and for
+# handlers still relaying signals before the remaining sockets are cut.
+DRAIN_GRACE = float(os.environ.get('NEXUS_DRAIN_GRACE', '5'))
+# The reconnect window opens once something accepts connections on the
+# port again (a replacement process, or other SO_REUSEPORT workers), or
+# after this many seconds if nothing does.
+HANDOVER_TIMEOUT = float(os.environ.get('NEXUS_HANDOVER_TIMEOUT', '10'))
+# Sockets still open after the drain are cut after this long.
+SHUTDOWN_TIMEOUT = 1
+# Registry snapshot written on shutdown and read on startup; unset disables it.
+SNAPSHOT_PATH = os.environ.get('NEXUS_SNAPSHOT')
+# Older snapshots are ignored: their peers have long since reconnected elsewhere.
+SNAPSHOT_MAX_AGE = 60
+
+
+class Drainer:
+    # Shutdown state of one server process: whether it is draining and how
+    # many tracked handlers are still running.
+    def __init__(self, window=DRAIN_WINDOW, grace=DRAIN_GRACE):
+        self.window = window
+        self.grace = grace
+        self.draining = False
+        self.inflight = 0
+        self._idle = None
+
+    def tracked(self, handler):
+        @functools.wraps(handler)
+        async def wrapper(*args):
+            self.inflight += 1
+            try:
+                return await handler(*args)
+            finally:
+                self.inflight -= 1
+                if not self.inflight and self._idle is not None:
+                    self._idle.set()
+        return wrapper
+
+    async def wait_idle(self, timeout):
+        if not self.inflight:
+            return True
+        self._idle = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def reconnect_hints(self, sids):
+        # (sid, delay) pairs: one random delay in each of len(sids) equal
+        # slices of the window. Flatter than independent uniform delays,
+        # which still bunch up.
+        sids = list(sids)
+        random.shuffle(sids)
+        slot = self.window / max(1, len(sids))
+        for index, sid in enumerate(sids):
+            yield sid, round((index + random.random()) * slot, 3)
+
+
+async def wait_for_listener(host, port, timeout=HANDOVER_TIMEOUT):
+    host = {'0.0.0.0': '127.0.0.1', '::': '::1', '': '127.0.0.1', None: '127.0.0.1'}.get(host, host)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.1)
+    return False
+
+
+def save_snapshot(path, snapshot, window):
+    snapshot = dict(snapshot, written_at=time.time(), window=window)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(temporary, path)
+
+
+def load_snapshot(path, max_age=SNAPSHOT_MAX_AGE):
+    # The snapshot is consumed: a later restart must not bring it back.
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+        os.unlink(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("⚠️  Снимок реестра не прочитан: %s", e)
+        return None
+    if time.time() - snapshot.get('written_at', 0) > max_age:
+        logger.info("Снимок реестра устарел, пропущен: %s", path)
+        return None
+    return snapshot
@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+
+from broker import Broker
+from metrics import setup_logging
+
+
+def run_broker(path):
+    # Ctrl+C reaches every process in the group; the broker has to outlive
+    # the workers while they drain, so it waits for the launcher's terminate().
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging()
+    try:
+        asyncio.run(Broker(path).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+def run_worker(host, port, reuse_port):
+    # NEXUS_BROKER is inherited from the launcher, so the server module picks
+    # the shared registry and client manager when it is imported here.
+    import signaling_server_webrtc as server
+    asyncio.run(server.serve(host, port, reuse_port))
+
+
+def wait_for_socket(path, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Брокер не запустился: {path}")
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск нескольких процессов сигнального сервера")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--broker', default='/tmp/nexus-broker.sock')
+    parser.add_argument('--reuse-port', action='store_true',
+                        help="все воркеры слушают один порт (SO_REUSEPORT); "
+                             "клиенты должны использовать только websocket-транспорт")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    if os.path.exists(args.broker):
+        os.unlink(args.broker)
+    broker = context.Process(target=run_broker, args=(args.broker,), name='nexus-broker')
+    broker.start()
+    wait_for_socket(args.broker)
+    os.environ['NEXUS_BROKER'] = args.broker
+
+    # Without SO_REUSEPORT each worker gets its own port (port, port + 1, ...)
+    # for a sticky load balancer in front; long-polling sessions must keep
+    # hitting the worker that owns them.
+    workers = []
+    for index in range(args.workers):
+        port = args.port if args.reuse_port else args.port + index
+        worker = context.Process(target=run_worker, args=(args.host, port, args.reuse_port),
+                                 name=f'nexus-worker-{index}')
+        worker.start()
+        workers.append((worker, port))
+        print(f"🚀 Воркер {index} (PID {worker.pid}) → http://{args.host}:{port}")
+
+    print(f"📡 Брокер: {args.broker} | Воркеров: {args.workers}\n")
+    try:
+        for worker, _ in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("\n\n👋 Сервер остановлен пользователем")
+    finally:
+        for process in [worker for worker, _ in workers] + [broker]:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import atexit
+import bisect
+import itertools
+import logging
+import logging.handlers
+import queue
+
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_QUEUE_SIZE = 10000
+# Seconds; relaying a signal is an in-memory lookup plus one emit, so most
+# observations land in the sub-millisecond buckets.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Hands records to the listener thread as they are: the message is only
+    # %-formatted there, and a full queue drops the record instead of
+    # blocking the event loop.
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            logs_dropped.inc()
+
+
+def setup_logging(level=logging.INFO, queue_size=LOG_QUEUE_SIZE):
+    # Formatting and the stderr write happen on a QueueListener thread, so a
+    # burst of log lines costs the event loop one queue put each.
+    log_queue = queue.Queue(queue_size)
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    root = logging.getLogger()
+    root.handlers[:] = [DroppingQueueHandler(log_queue)]
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class Sampler:
+    # True for the first of every `every` calls; used to log one in N
+    # events on paths too hot to log each time.
+    def __init__(self, every):
+        self.every = max(1, every)
+        self._count = itertools.count()
+
+    def __call__(self):
+        return next(self._count) % self.every == 0
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+
+def _by_label(values, convert):
+    # {'a/b': value} keyed by label values, or the bare value when unlabeled.
+    if list(values) == [()]:
+        return convert(values[()])
+    return {'/'.join(map(str, label_values)): convert(value) for label_values, value in sorted(values.items())}
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        if not self.values and not self.labels:
+            lines.append(f'{self.name} 0')
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_labels(self.labels, label_values)} {value}')
+        return lines
+
+    def snapshot(self):
+        if not self.values and not self.labels:
+            return 0
+        return _by_label(self.values, lambda value: value)
+
+
+class Gauge:
+    # Sampled when /metrics is scraped; `collect` is a coroutine function
+    # returning the current value.
+    def __init__(self, name, help, collect):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.value = 0
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {self.value}']
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+inf last), sum, count]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                labels = _labels(self.labels + ('le',), label_values + (bound,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+    def snapshot(self):
+        return _by_label(self.values, lambda series: {'count': series[2], 'sum': round(series[1], 6)})
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, collect):
+        return self.add(Gauge(name, help, collect))
+
+    async def render(self):
+        # Prometheus text exposition format.
+        lines = []
+        for metric in self.metrics:
+            if isinstance(metric, Gauge):
+                metric.value = await metric.collect()
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        # Counters and histograms as plain JSON-ready data, for /stats.
+        # Gauges are left out: their collectors are coroutines.
+        return {metric.name: metric.snapshot() for metric in self.metrics if not isinstance(metric, Gauge)}
+
+
+metrics = MetricsRegistry()
+logs_dropped = metrics.counter('nexus_logs_dropped_total', 'Log records dropped because the log queue was full')
@@ -0,0 +1,210 @@
+import asyncio
+import os
+import time
+
+
+# (tokens per second, burst) per event. A `signals` batch spends one
+# `signal` token per signal in it, so batching is not a way around the limit.
+SID_LIMITS = {
+    'register': (0.5, 5),
+    'get_peers': (1, 5),
+    'subscribe_presence': (1, 5),
+    'get_presence_page': (20, 50),
+    'unsubscribe_presence': (1, 5),
+    'signal': (100, 400),
+}
+# Shared by every connection from one address.
+IP_LIMITS = {
+    'connect': (20, 100),
+    'register': (20, 100),
+    'get_peers': (20, 50),
+    'subscribe_presence': (20, 100),
+    'get_presence_page': (200, 500),
+    'unsubscribe_presence': (20, 100),
+    'signal': (2000, 8000),
+}
+# Multiplies every rate and burst above; handy when tuning under load.
+RATE_SCALE = float(os.environ.get('NEXUS_RATE_SCALE', '1'))
+MAX_CONNECTIONS = int(os.environ.get('NEXUS_MAX_CONNECTIONS', '10000'))
+MAX_CONNECTIONS_PER_IP = int(os.environ.get('NEXUS_MAX_CONNECTIONS_PER_IP', '100'))
+# Reverse proxies (or a local load test) that many clients share one
+# address behind. None by default. With NEXUS_FORWARDED_HEADER set, clients
+# connecting through one are limited by the address the proxy forwards;
+# without it, per-address limits don't apply to these at all. Per-sid
+# limits always do.
+TRUSTED_ADDRESSES = frozenset(filter(None, os.environ.get('NEXUS_TRUSTED_ADDRESSES', '').split(',')))
+# X-Forwarded-For style header (comma-separated hops) the trusted proxies set.
+FORWARDED_HEADER = os.environ.get('NEXUS_FORWARDED_HEADER')
+
+# Above this event-loop lag new connections and the expensive, retryable
+# requests are turned away until the loop catches up; signals for calls
+# already being set up keep flowing.
+LAG_THRESHOLD = float(os.environ.get('NEXUS_LAG_THRESHOLD', '0.2'))
+LAG_INTERVAL = 0.1
+# A throttled client is told at most this often.
+NOTIFY_INTERVAL = 1.0
+SHEDDABLE = frozenset(('connect', 'get_peers', 'subscribe_presence', 'get_presence_page'))
+
+SID_LIMIT = 'sid'
+IP_LIMIT = 'ip'
+SHED = 'shed'
+TOO_MANY_CONNECTIONS = 'connections'
+TOO_MANY_FROM_IP = 'ip_connections'
+
+
+def client_address(environ, trusted=TRUSTED_ADDRESSES, header=FORWARDED_HEADER):
+    # Only a trusted proxy's header is believed, and only its last hop: the
+    # proxy appended that one, anything before it came from the client.
+    address = environ.get('REMOTE_ADDR', 'unknown')
+    if header and address in trusted:
+        forwarded = environ.get('HTTP_' + header.upper().replace('-', '_'), '')
+        hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+        if hops:
+            return hops[-1]
+    return address
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate * RATE_SCALE
+        self.burst = burst * RATE_SCALE
+        self.tokens = self.burst
+        self.updated = now
+
+    def take(self, now, cost=1):
+        tokens = self.tokens + (now - self.updated) * self.rate
+        self.tokens = tokens if tokens < self.burst else self.burst
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def retry_after(self, cost=1):
+        return max(0.0, (cost - self.tokens) / self.rate) if self.rate else None
+
+
+class Address:
+    __slots__ = ('connections', 'buckets')
+
+    def __init__(self):
+        self.connections = 0
+        self.buckets = {}
+
+
+class Session:
+    __slots__ = ('ip', 'address', 'buckets', 'notified_at')
+
+    def __init__(self, ip, address):
+        self.ip = ip
+        self.address = address
+        self.buckets = {}
+        self.notified_at = float('-inf')
+
+
+class RateLimiter:
+    # Admission control for one server process. check() is a couple of dict
+    # lookups and float updates on buckets created the first time a sid or
+    # address uses an event, so the per-event cost is O(1).
+    def __init__(self, sid_limits=SID_LIMITS, ip_limits=IP_LIMITS, max_connections=MAX_CONNECTIONS,
+                 max_connections_per_ip=MAX_CONNECTIONS_PER_IP, lag_threshold=LAG_THRESHOLD,
+                 trusted=TRUSTED_ADDRESSES):
+        self.sid_limits = sid_limits
+        self.ip_limits = ip_limits
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        self.lag_threshold = lag_threshold
+        self.trusted = trusted
+        self.sessions = {}
+        self.addresses = {}
+        self.lag = 0.0
+        self.shedding = False
+
+    def connect(self, sid, ip):
+        # Returns None when the connection is admitted, otherwise the reason.
+        if self.shedding:
+            return SHED
+        if len(self.sessions) >= self.max_connections:
+            return TOO_MANY_CONNECTIONS
+        trusted = ip in self.trusted
+        address = self.addresses.get(ip)
+        if address is None:
+            address = self.addresses[ip] = Address()
+        if not trusted and address.connections >= self.max_connections_per_ip:
+            self._forget(ip, address)
+            return TOO_MANY_FROM_IP
+        now = time.monotonic()
+        if not trusted and not self._bucket(address.buckets, self.ip_limits, 'connect', now).take(now):
+            self._forget(ip, address)
+            return IP_LIMIT
+        address.connections += 1
+        self.sessions[sid] = Session(ip, None if trusted else address)
+        return None
+
+    def disconnect(self, sid):
+        session = self.sessions.pop(sid, None)
+        if session is None:
+            return
+        address = self.addresses.get(session.ip)
+        if address is not None:
+            address.connections -= 1
+            self._forget(session.ip, address)
+
+    def _forget(self, ip, address):
+        if address.connections <= 0:
+            del self.addresses[ip]
+
+    @staticmethod
+    def _bucket(buckets, limits, event, now):
+        bucket = buckets.get(event)
+        if bucket is None:
+            rate, burst = limits[event]
+            bucket = buckets[event] = TokenBucket(rate, burst, now)
+        return bucket
+
+    def check(self, sid, event, cost=1):
+        # Returns None when the event may run, otherwise SID_LIMIT, IP_LIMIT
+        # or SHED.
+        if self.shedding and event in SHEDDABLE:
+            return SHED
+        session = self.sessions.get(sid)
+        if session is None:
+            return None
+        now = time.monotonic()
+        bucket = self._bucket(session.buckets, self.sid_limits, event, now)
+        if not bucket.take(now, cost):
+            return SID_LIMIT
+        if session.address is not None and not self._bucket(
+                session.address.buckets, self.ip_limits, event, now).take(now, cost):
+            bucket.tokens += cost
+            return IP_LIMIT
+        return None
+
+    def should_notify(self, sid):
+        # A flooding client gets one error back per NOTIFY_INTERVAL rather
+        # than one per dropped event.
+        session = self.sessions.get(sid)
+        now = time.monotonic()
+        if session is None or now - session.notified_at < NOTIFY_INTERVAL:
+            return False
+        session.notified_at = now
+        return True
+
+    def retry_after(self, sid, event, cost=1):
+        session = self.sessions.get(sid)
+        bucket = session.buckets.get(event) if session is not None else None
+        return round(bucket.retry_after(cost), 2) if bucket is not None else LAG_INTERVAL
+
+    async def monitor_lag(self, interval=LAG_INTERVAL):
+        # How late a sleep(interval) wakes up is how long the loop was busy.
+        # Lag rises at once and decays by half per tick, so one slow tick
+        # turns shedding on but it takes a calm stretch to turn it off.
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.lag = lag if lag > self.lag else (self.lag + lag) / 2
+            self.shedding = self.lag > self.lag_threshold
@@ -0,0 +1,180 @@
+import sys
+from bisect import bisect_left, bisect_right, insort
+
+
+MAX_PEER_ID_LENGTH = 64
+
+
+def normalize_peer_id(peer_id):
+    # None for anything that can't be a peer id. Valid ids are interned, so
+    # every index and every later lookup shares one string object per peer.
+    if not isinstance(peer_id, str) or not 0 < len(peer_id) <= MAX_PEER_ID_LENGTH:
+        return None
+    return sys.intern(peer_id)
+
+
+class Session:
+    # One record per registered peer, indexed both by sid and by peer id.
+    # Peers restored from a snapshot have no sid until they register again.
+    __slots__ = ('peer_id', 'sid', 'features')
+
+    def __init__(self, peer_id, sid, features):
+        self.peer_id = peer_id
+        self.sid = sid
+        self.features = features
+
+
+class PeerRegistry:
+    # In-process registry: peer_id <-> sid for a single server process.
+    # Backends shared between processes implement the same coroutines.
+    # Every join/leave bumps `seq`, which presence deltas carry so clients can
+    # spot gaps. Peer ids are also kept sorted, updated in place on every
+    # join and leave, so snapshots page by cursor without re-sorting: every
+    # client asks for one right after it registers.
+    def __init__(self):
+        self.by_sid = {}
+        self.by_peer = {}
+        self.sorted_peers = []
+        self.seq = 0
+        # Nearly every peer asks for the same features; they share one tuple.
+        self._feature_sets = {(): ()}
+
+    def _features(self, features):
+        features = tuple(features)
+        return self._feature_sets.setdefault(features, features)
+
+    async def register(self, peer_id, sid, features=()):
+        # Returns (ok, seq); seq is None when nobody's presence changed.
+        ok, joined = self._register(peer_id, sid, features)
+        if not joined:
+            return ok, None
+        self.seq += 1
+        return True, self.seq
+
+    async def register_many(self, sessions):
+        # (peer_id, sid, features) registered together in one presence
+        # change, e.g. by a worker that reconnected to the broker. Returns
+        # (joined peer ids, refused sids, seq), seq None when nobody joined.
+        joined, refused = [], []
+        for peer_id, sid, features in sessions:
+            ok, is_new = self._register(peer_id, sid, features)
+            if not ok:
+                refused.append(sid)
+            elif is_new:
+                joined.append(peer_id)
+        if not joined:
+            return joined, refused, None
+        self.seq += 1
+        return joined, refused, self.seq
+
+    def _register(self, peer_id, sid, features):
+        # (ok, whether the peer is new to presence). A sid holds one peer id;
+        # to take another it unregisters first, so the old one's leave is
+        # published like any other.
+        current = self.by_peer.get(peer_id)
+        if current is not None and current.sid is not None:
+            return current.sid == sid, False
+        if sid in self.by_sid:
+            return False, False
+        if current is not None:
+            # Back after a restart: the peer never looked offline to anyone.
+            current.sid = sid
+            current.features = self._features(features)
+            self.by_sid[sid] = current
+            return True, False
+        session = Session(peer_id, sid, self._features(features))
+        self.by_sid[sid] = self.by_peer[peer_id] = session
+        insort(self.sorted_peers, peer_id)
+        return True, True
+
+    async def unregister(self, sid):
+        # Returns (peer_id, seq) of the leave, or (None, None).
+        session = self.by_sid.get(sid)
+        if session is None:
+            return None, None
+        self._remove(session)
+        self.seq += 1
+        return session.peer_id, self.seq
+
+    async def unregister_many(self, sids):
+        # Sessions that leave together (a worker process died) in one
+        # presence change. Returns (peer ids, seq), seq None when none of
+        # the sids was registered.
+        gone = [self.by_sid[sid] for sid in sids if sid in self.by_sid]
+        if not gone:
+            return [], None
+        for session in gone:
+            self._remove(session)
+        self.seq += 1
+        return [session.peer_id for session in gone], self.seq
+
+    def _remove(self, session):
+        self.by_sid.pop(session.sid, None)
+        del self.by_peer[session.peer_id]
+        index = bisect_left(self.sorted_peers, session.peer_id)
+        if index < len(self.sorted_peers) and self.sorted_peers[index] == session.peer_id:
+            del self.sorted_peers[index]
+
+    async def lookup(self, peer_id):
+        session = self.by_peer.get(peer_id)
+        return session.sid if session is not None else None
+
+    async def route(self, peer_id):
+        # (sid, features) of a peer, so relays know what the target understands.
+        session = self.by_peer.get(peer_id)
+        return (session.sid, session.features) if session is not None else (None, ())
+
+    async def peer_of(self, sid):
+        session = self.by_sid.get(sid)
+        return session.peer_id if session is not None else None
+
+    async def list_peers(self):
+        return list(self.by_peer)
+
+    async def page_peers(self, cursor=None, limit=100):
+        # Peers sorted by id after `cursor`; returns (peers, next_cursor, seq).
+        peers = self.sorted_peers
+        start = 0 if cursor is None else bisect_right(peers, cursor)
+        page = peers[start:start + limit]
+        next_cursor = page[-1] if start + limit < len(peers) else None
+        return page, next_cursor, self.seq
+
+    async def online(self, peer_ids):
+        return [peer_id for peer_id in peer_ids if peer_id in self.by_peer], self.seq
+
+    async def count(self):
+        return len(self.by_peer)
+
+    def local_count(self):
+        return len(self.by_sid)
+
+    def snapshot(self):
+        return {'seq': self.seq, 'peers': [[session.peer_id, list(session.features)]
+                                           for session in self.by_peer.values()]}
+
+    def restore(self, snapshot):
+        # Peers another process had registered are held here without a sid:
+        # they stay in presence while they reconnect, and a restored peer
+        # id can only be taken by that peer.
+        restored = 0
+        for peer_id, features in snapshot['peers']:
+            peer_id = normalize_peer_id(peer_id)
+            if peer_id is None or peer_id in self.by_peer:
+                continue
+            self.by_peer[peer_id] = Session(peer_id, None, self._features(features))
+            restored += 1
+        self.sorted_peers = sorted(self.by_peer)
+        self.seq = max(self.seq, snapshot['seq'])
+        return restored
+
+    def expire_restored(self):
+        # Restored peers that never came back leave in one presence change.
+        # Returns (peer_ids, seq), seq None when nobody was left.
+        gone = [session for session in self.by_peer.values() if session.sid is None]
+        if not gone:
+            return [], None
+        for session in gone:
+            del self.by_peer[session.peer_id]
+        self.sorted_peers = sorted(self.by_peer)
+        self.seq += 1
+        return [session.peer_id for session in gone], self.seq
@@ -1,85 +1,315 @@
 from aiohttp import web
 import socketio
+import asyncio
 import logging
+import signal as signals_module
 import socket
+import os
+import time
+from registry import PeerRegistry, normalize_peer_id, MAX_PEER_ID_LENGTH
+from broker import BrokerClient, BrokerManager, BrokerRegistry
+from metrics import metrics, setup_logging, Sampler
+from ratelimit import RateLimiter, client_address
+from status import StatusCache
+from drain import Drainer, SNAPSHOT_PATH, SHUTDOWN_TIMEOUT, save_snapshot, load_snapshot, wait_for_listener
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
+
+# NEXUS_BROKER points at a broker.py UNIX socket shared by several server
+# processes; without it the registry and rooms live in this process only.
+BROKER_PATH = os.environ.get('NEXUS_BROKER')
+if BROKER_PATH:
+    broker_client = BrokerClient(BROKER_PATH)
+    client_manager = BrokerManager(broker_client)
+    registry = BrokerRegistry(broker_client)
+else:
+    client_manager = None
+    registry = PeerRegistry()
+
+PRESENCE_ROOM = 'presence'
+PRESENCE_PAGE_SIZE = 500
+MAX_WATCHED_CONTACTS = 1000
+# Optional protocol extensions a client may ask for at register time.
+# 'signals': the client accepts batched `signals` frames.
+SUPPORTED_FEATURES = ('signals',)
+MAX_SIGNAL_BATCH = 64
+# Signal relays are logged one in NEXUS_SIGNAL_LOG_EVERY; the counters
+# below see every one of them.
+SIGNAL_LOG_EVERY = int(os.environ.get('NEXUS_SIGNAL_LOG_EVERY', '100'))
+# Anything else a client sends as a type is counted as 'other', so the
+# metric can't grow without bound.
+SIGNAL_TYPES = ('offer', 'answer', 'ice-candidate')
+
+signal_log_sample = Sampler(SIGNAL_LOG_EVERY)
+signals_total = metrics.counter('nexus_signals_total', 'Signals relayed, by signal type', ('type',))
+signal_batches_total = metrics.counter('nexus_signal_batches_total', 'Batched signals frames relayed')
+relay_seconds = metrics.histogram('nexus_signal_relay_seconds',
+                                  'Time from receiving a signal event to emitting it to the target', ('event',))
+registrations_total = metrics.counter('nexus_registrations_total', 'Register requests by result', ('result',))
+connections_total = metrics.counter('nexus_connections_total', 'Socket.IO connections accepted')
+disconnects_total = metrics.counter('nexus_disconnects_total', 'Socket.IO disconnections')
+errors_total = metrics.counter('nexus_errors_total', 'Rejected requests and server errors, by event and reason',
+                               ('event', 'reason'))
+throttled_total = metrics.counter('nexus_throttled_total', 'Events dropped by rate limits or load shedding',
+                                  ('event', 'reason'))
+connections_rejected_total = metrics.counter('nexus_connections_rejected_total',
+                                             'Connections refused by admission control', ('reason',))
+
+limiter = RateLimiter()
+drainer = Drainer()
+
 sio = socketio.AsyncServer(
     cors_allowed_origins='*',
     async_mode='aiohttp',
+    client_manager=client_manager,
     logger=False,
     engineio_logger=False
 )
 app = web.Application()
 sio.attach(app)
-peers = {}
-peer_sessions = {}
+
+
+async def local_connections():
+    return registry.local_count()
+
+
+metrics.gauge('nexus_peers_online', 'Registered peers across all server processes', registry.count)
+metrics.gauge('nexus_active_connections', 'Registered peers connected to this process', local_connections)
+
+
+async def event_loop_lag():
+    return limiter.lag
+
+
+async def load_shedding():
+    return int(limiter.shedding)
+
+
+metrics.gauge('nexus_event_loop_lag_seconds', 'Smoothed event loop lag', event_loop_lag)
+metrics.gauge('nexus_load_shedding', '1 while new connections and bulk requests are being shed', load_shedding)
+
+
+async def draining():
+    return int(drainer.draining)
+
+
+metrics.gauge('nexus_draining', '1 while the process is shutting down and moving clients away', draining)
+
+
+async def admit(sid, event, cost=1):
+    # Every handler starts here. A rejected event is dropped and the client
+    # is told, at most once per second.
+    reason = limiter.check(sid, event, cost)
+    if reason is None:
+        return True
+    throttled_total.inc(event, reason)
+    if limiter.should_notify(sid):
+        await sio.emit('error', {
+            'message': 'Слишком много запросов, повторите позже',
+            'code': 'rate_limited',
+            'event': event,
+            'retry_after': limiter.retry_after(sid, event, cost)
+        }, room=sid)
+    return False
+
+
+async def start_lag_monitor(app):
+    app['lag_monitor'] = asyncio.create_task(limiter.monitor_lag())
+
+
+async def stop_lag_monitor(app):
+    app['lag_monitor'].cancel()
+
+
+app.on_startup.append(start_lag_monitor)
+app.on_cleanup.append(stop_lag_monitor)
+
+
+def signal_type_label(signal_type):
+    return signal_type if signal_type in SIGNAL_TYPES else 'other'
 
 
 @sio.event
 async def connect(sid, environ):
-    client_ip = environ.get('REMOTE_ADDR', 'unknown')
-    logger.info(f"✅ Новое подключение | SID: {sid} | IP: {client_ip}")
+    client_ip = client_address(environ)
+    if drainer.draining:
+        connections_rejected_total.inc('draining')
+        raise socketio.exceptions.ConnectionRefusedError({
+            'message': 'Сервер перезапускается, повторите подключение позже',
+            'code': 'server_draining'
+        })
+    reason = limiter.connect(sid, client_ip)
+    if reason is not None:
+        connections_rejected_total.inc(reason)
+        # The client sees this as a connect_error and retries with backoff.
+        raise socketio.exceptions.ConnectionRefusedError({
+            'message': 'Сервер перегружен, повторите подключение позже',
+            'code': 'server_busy',
+            'reason': reason
+        })
+    connections_total.inc()
+    logger.info("✅ Новое подключение | SID: %s | IP: %s", sid, client_ip)
 
 
 @sio.event
 async def disconnect(sid):
-    if sid in peers:
-        peer_id = peers[sid]
-        logger.info(f"❌ Отключение | Пир: {peer_id} | SID: {sid}")
-        del peers[sid]
-        if peer_id in peer_sessions:
-            del peer_sessions[peer_id]
-        logger.info(f"📊 Пиров онлайн: {len(peer_sessions)}")
+    limiter.disconnect(sid)
+    disconnects_total.inc()
+    peer_id, seq = await registry.unregister(sid)
+    if peer_id is not None:
+        # While draining, peers leave only to reconnect to the replacement
+        # process; a delta each would be a storm to everyone still here.
+        if not drainer.draining:
+            await publish_presence(peer_id, seq, 'left', sid)
+        logger.info("❌ Отключение | Пир: %s | SID: %s", peer_id, sid)
     else:
-        logger.info(f"❌ Отключение незарегистрированного клиента | SID: {sid}")
+        logger.info("❌ Отключение незарегистрированного клиента | SID: %s", sid)
 
 
 @sio.event
+@drainer.tracked
 async def register(sid, data):
+    if not await admit(sid, 'register'):
+        return
     try:
         peer_id = data.get('peer_id')
         if not peer_id:
             await sio.emit('error', {'message': 'peer_id обязателен для регистрации'}, room=sid)
-            logger.warning(f"⚠️  Попытка регистрации без peer_id | SID: {sid}")
+            registrations_total.inc('invalid')
+            logger.warning("⚠️  Попытка регистрации без peer_id | SID: %s", sid)
+            return
+        peer_id = normalize_peer_id(peer_id)
+        if peer_id is None:
+            await sio.emit('error', {
+                'message': f'peer_id должен быть строкой не длиннее {MAX_PEER_ID_LENGTH} символов',
+                'code': 'invalid_peer_id'
+            }, room=sid)
+            registrations_total.inc('invalid')
+            logger.warning("⚠️  Недопустимый peer_id | SID: %s", sid)
             return
-        if peer_id in peer_sessions and peer_sessions[peer_id] != sid:
-            await sio.emit('error', {'message': f'peer_id "{peer_id}" уже используется'}, room=sid)
-            logger.warning(f"⚠️  Попытка использовать занятый peer_id: {peer_id} | SID: {sid}")
+        features = [f for f in data.get('features') or () if f in SUPPORTED_FEATURES]
+        previous = await registry.peer_of(sid)
+        if previous is not None and previous != peer_id:
+            # Switching peer ids on one connection: the old id leaves first.
+            previous, seq = await registry.unregister(sid)
+            if previous is not None:
+                await publish_presence(previous, seq, 'left', sid)
+                logger.info("🔁 Пир %s сменил peer_id на %s | SID: %s", previous, peer_id, sid)
+        ok, seq = await registry.register(peer_id, sid, features)
+        if not ok:
+            await sio.emit('error', {
+                'message': f'peer_id "{peer_id}" уже используется',
+                'code': 'peer_id_taken'
+            }, room=sid)
+            registrations_total.inc('taken')
+            logger.warning("⚠️  Попытка использовать занятый peer_id: %s | SID: %s", peer_id, sid)
             return
-        peers[sid] = peer_id
-        peer_sessions[peer_id] = sid
-        logger.info(f"📝 Зарегистрирован пир: {peer_id} | SID: {sid}")
-        logger.info(f"📊 Пиров онлайн: {len(peer_sessions)}")
-        await sio.emit('registered', {'status': 'ok','peer_id': peer_id}, room=sid)
+        if seq is not None:
+            await publish_presence(peer_id, seq, 'joined', sid)
+        registrations_total.inc('ok')
+        logger.info("📝 Зарегистрирован пир: %s | SID: %s", peer_id, sid)
+        await sio.emit('registered', {
+            'status': 'ok',
+            'peer_id': peer_id,
+            'features': list(SUPPORTED_FEATURES)
+        }, room=sid)
     except Exception as e:
-        logger.error(f"❌ Ошибка при регистрации | SID: {sid} | Ошибка: {e}")
+        errors_total.inc('register', 'exception')
+        logger.error("❌ Ошибка при регистрации | SID: %s | Ошибка: %s", sid, e)
         await sio.emit('error', {
             'message': 'Ошибка сервера при регистрации'
         }, room=sid)
 
 
+async def publish_presence(peer_id, seq, change, sid):
+    # One small delta per join/leave: to full-roster subscribers and to
+    # whoever has this peer in their contact list.
+    delta = {'seq': seq, change: [peer_id]}
+    await sio.emit('presence', delta, room=PRESENCE_ROOM, skip_sid=sid)
+    await sio.emit('presence', delta, room=f'presence:{peer_id}', skip_sid=sid)
+
+
+@sio.event
+async def subscribe_presence(sid, data):
+    if not await admit(sid, 'subscribe_presence'):
+        return
+    try:
+        data = data or {}
+        for room in sio.rooms(sid):
+            if room.startswith(PRESENCE_ROOM):
+                await sio.leave_room(sid, room)
+        contacts = data.get('contacts')
+        if contacts is not None:
+            contacts = [str(contact) for contact in contacts[:MAX_WATCHED_CONTACTS]]
+            for contact in contacts:
+                await sio.enter_room(sid, f'presence:{contact}')
+            online_peers, seq = await registry.online(contacts)
+            snapshot = {'mode': 'contacts', 'seq': seq, 'peers': online_peers, 'cursor': None}
+        else:
+            limit = min(int(data.get('limit') or PRESENCE_PAGE_SIZE), PRESENCE_PAGE_SIZE)
+            await sio.enter_room(sid, PRESENCE_ROOM)
+            page, cursor, seq = await registry.page_peers(None, limit)
+            snapshot = {'mode': 'all', 'seq': seq, 'peers': page, 'cursor': cursor}
+        await sio.emit('presence_snapshot', snapshot, room=sid)
+    except Exception as e:
+        errors_total.inc('subscribe_presence', 'exception')
+        logger.error("❌ Ошибка при подписке на присутствие | SID: %s | Ошибка: %s", sid, e)
+        await sio.emit('error', {'message': 'Ошибка сервера при подписке на присутствие'}, room=sid)
+
+
+@sio.event
+async def get_presence_page(sid, data):
+    if not await admit(sid, 'get_presence_page'):
+        return
+    try:
+        limit = min(int(data.get('limit') or PRESENCE_PAGE_SIZE), PRESENCE_PAGE_SIZE)
+        page, cursor, seq = await registry.page_peers(data.get('cursor'), limit)
+        await sio.emit('presence_page', {'seq': seq, 'peers': page, 'cursor': cursor}, room=sid)
+    except Exception as e:
+        errors_total.inc('get_presence_page', 'exception')
+        logger.error("❌ Ошибка при получении страницы присутствия | SID: %s | Ошибка: %s", sid, e)
+        await sio.emit('error', {'message': 'Ошибка сервера при получении списка пиров'}, room=sid)
+
+
+@sio.event
+async def unsubscribe_presence(sid, data):
+    if not await admit(sid, 'unsubscribe_presence'):
+        return
+    for room in sio.rooms(sid):
+        if room.startswith(PRESENCE_ROOM):
+            await sio.leave_room(sid, room)
+
+
 @sio.event
 async def get_peers(sid, data):
+    if not await admit(sid, 'get_peers'):
+        return
     try:
-        online_peers = list(peer_sessions.keys())
-        current_peer = peers.get(sid)
-        if current_peer:
-            online_peers = [p for p in online_peers if p != current_peer]
-        logger.info(f"📋 Запрос списка пиров от {current_peer or sid} | Найдено: {len(online_peers)}")
-        await sio.emit('peers_list', {'peers': online_peers}, room=sid)
+        current_peer = await registry.peer_of(sid)
+        limit = (data or {}).get('limit')
+        if limit:
+            # Paginated form; without a limit the full list is kept for old clients.
+            online_peers, cursor, _ = await registry.page_peers(data.get('cursor'), min(int(limit), PRESENCE_PAGE_SIZE))
+            response = {'peers': [p for p in online_peers if p != current_peer], 'cursor': cursor}
+        else:
+            online_peers = await registry.list_peers()
+            response = {'peers': [p for p in online_peers if p != current_peer]}
+        logger.info("📋 Запрос списка пиров от %s | Найдено: %d", current_peer or sid, len(response['peers']))
+        await sio.emit('peers_list', response, room=sid)
     except Exception as e:
-        logger. error(f"❌ Ошибка при получении списка пиров | SID: {sid} | Ошибка: {e}")
+        errors_total.inc('get_peers', 'exception')
+        logger.error("❌ Ошибка при получении списка пиров | SID: %s | Ошибка: %s", sid, e)
         await sio.emit('error', {'message': 'Ошибка сервера при получении списка пиров'}, room=sid)
 
 
 @sio.event
+@drainer.tracked
 async def signal(sid, data):
+    start = time.perf_counter()
+    if not await admit(sid, 'signal'):
+        return
     try:
         target_peer_id = data.get('target')
         signal_type = data.get('type')
@@ -88,111 +318,214 @@ async def signal(sid, data):
             await sio.emit('error', {
                 'message': 'Неполные данные сигнала'
             }, room=sid)
-            logger.warning(f"⚠️  Получен неполный сигнал от {sid}")
+            errors_total.inc('signal', 'incomplete')
+            logger.warning("⚠️  Получен неполный сигнал от %s", sid)
             return
-        if target_peer_id not in peer_sessions:
+        target_sid = await registry.lookup(target_peer_id)
+        if target_sid is None:
             await sio.emit('error', {
                 'message': f'Пир "{target_peer_id}" не найден или не в сети'
             }, room=sid)
-            logger.warning(f"⚠️  Попытка отправить сигнал несуществующему пиру: {target_peer_id}")
+            errors_total.inc('signal', 'unknown_target')
+            if signal_log_sample():
+                logger.warning("⚠️  Попытка отправить сигнал несуществующему пиру: %s", target_peer_id)
             return
-        target_sid = peer_sessions[target_peer_id]
-        sender_peer_id = peers.get(sid, 'unknown')
+        sender_peer_id = await registry.peer_of(sid) or 'unknown'
         signal_message = {
             'from': sender_peer_id,
             'type': signal_type,
             'data': signal_data
         }
         await sio.emit('signal', signal_message, room=target_sid)
-        logger.info(f"📡 Сигнал {signal_type} | {sender_peer_id} → {target_peer_id}")
+        relay_seconds.observe(time.perf_counter() - start, 'signal')
+        signals_total.inc(signal_type_label(signal_type))
+        if signal_log_sample():
+            logger.info("📡 Сигнал %s | %s → %s (в лог попадает 1 из %d)",
+                        signal_type, sender_peer_id, target_peer_id, SIGNAL_LOG_EVERY)
+    except Exception as e:
+        errors_total.inc('signal', 'exception')
+        logger.error("❌ Ошибка при передаче сигнала | SID: %s | Ошибка: %s", sid, e)
+        await sio.emit('error', {'message': 'Ошибка сервера при передаче сигнала'}, room=sid)
+
+
+@sio.event
+@drainer.tracked
+async def signals(sid, data):
+    # Several signals for one target in a single frame (typically a burst of
+    # ICE candidates). Targets that did not register the 'signals' feature
+    # get them unrolled into ordinary `signal` events.
+    start = time.perf_counter()
+    batch = data.get('signals') if isinstance(data, dict) else None
+    if not await admit(sid, 'signal', min(len(batch), MAX_SIGNAL_BATCH) if isinstance(batch, list) else 1):
+        return
+    try:
+        target_peer_id = data.get('target')
+        if not target_peer_id or not isinstance(batch, list) or not batch:
+            await sio.emit('error', {'message': 'Неполные данные сигнала'}, room=sid)
+            errors_total.inc('signals', 'incomplete')
+            logger.warning("⚠️  Получен неполный пакет сигналов от %s", sid)
+            return
+        if len(batch) > MAX_SIGNAL_BATCH:
+            await sio.emit('error', {'message': f'Слишком много сигналов в пакете (максимум {MAX_SIGNAL_BATCH})'}, room=sid)
+            errors_total.inc('signals', 'too_large')
+            logger.warning("⚠️  Пакет из %d сигналов от %s отклонён", len(batch), sid)
+            return
+        batch = [{'type': item['type'], 'data': item['data']} for item in batch
+                 if isinstance(item, dict) and item.get('type') and item.get('data')]
+        if not batch:
+            await sio.emit('error', {'message': 'Неполные данные сигнала'}, room=sid)
+            errors_total.inc('signals', 'incomplete')
+            return
+        target_sid, features = await registry.route(target_peer_id)
+        if target_sid is None:
+            await sio.emit('error', {
+                'message': f'Пир "{target_peer_id}" не найден или не в сети'
+            }, room=sid)
+            errors_total.inc('signals', 'unknown_target')
+            if signal_log_sample():
+                logger.warning("⚠️  Попытка отправить сигнал несуществующему пиру: %s", target_peer_id)
+            return
+        sender_peer_id = await registry.peer_of(sid) or 'unknown'
+        if 'signals' in features:
+            await sio.emit('signals', {'from': sender_peer_id, 'signals': batch}, room=target_sid)
+        else:
+            for item in batch:
+                await sio.emit('signal', {
+                    'from': sender_peer_id,
+                    'type': item['type'],
+                    'data': item['data']
+                }, room=target_sid)
+        relay_seconds.observe(time.perf_counter() - start, 'signals')
+        signal_batches_total.inc()
+        for item in batch:
+            signals_total.inc(signal_type_label(item['type']))
+        if signal_log_sample():
+            logger.info("📡 Сигналы ×%d (%s…) | %s → %s (в лог попадает 1 из %d)",
+                        len(batch), batch[0]['type'], sender_peer_id, target_peer_id, SIGNAL_LOG_EVERY)
     except Exception as e:
-        logger.error(f"❌ Ошибка при передаче сигнала | SID: {sid} | Ошибка: {e}")
+        errors_total.inc('signals', 'exception')
+        logger.error("❌ Ошибка при передаче пакета сигналов | SID: %s | Ошибка: %s", sid, e)
         await sio.emit('error', {'message': 'Ошибка сервера при передаче сигнала'}, room=sid)
 
 
-async def handle_root(request):
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>WebRTC Signaling Server</title>
-        <meta charset="utf-8">
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                max-width: 800px;
-                margin: 50px auto;
-                padding: 20px;
-                background: #f5f5f5;
-            }}
-            .container {{
-                background: white;
-                padding: 30px;
-                border-radius: 10px;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            }}
-            h1 {{ color: #333; }}
-            . status {{ 
-                color: #28a745; 
-                font-size: 24px;
-                font-weight: bold;
-            }}
-            .info {{
-                background: #e9ecef;
-                padding: 15px;
-                border-radius: 5px;
-                margin: 15px 0;
-            }}
-            code {{
-                background: #f8f9fa;
-                padding: 2px 6px;
-                border-radius: 3px;
-                font-family: monospace;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🚀 WebRTC Signaling Server</h1>
-            <p class="status">✅ Сервер работает! </p>
-            
-            <div class="info">
-                <h3>📊 Статистика:</h3>
-                <p>Пиров онлайн: <strong>{len(peer_sessions)}</strong></p>
-                <p>Активных соединений: <strong>{len(peers)}</strong></p>
-            </div>
-            
-            <div class="info">
-                <h3>📡 Подключение:</h3>
-                <p>Используйте Socket.IO клиент для подключения к этому серверу. </p>
-                <p>Endpoint: <code>{request.url}</code></p>
-            </div>
-            
-            <div class="info">
-                <h3>💡 Поддерживаемые события:</h3>
-                <ul>
-                    <li><code>register</code> - Регистрация пира</li>
-                    <li><code>get_peers</code> - Получить список пиров</li>
-                    <li><code>signal</code> - Передача WebRTC сигналов</li>
-                </ul>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    return web.Response(text=html, content_type='text/html')
-
-
-async def handle_health(request):
-    return web.json_response({
-        'status': 'healthy',
-        'peers_online': len(peer_sessions),
-        'active_connections': len(peers)
-    })
-
-
-app.router.add_get('/', handle_root)
-app.router.add_get('/health', handle_health)
+async def collect_stats():
+    return {
+        'pid': os.getpid(),
+        'uptime_seconds': round(time.monotonic() - started_at, 1),
+        'peers_online': await registry.count(),
+        'active_connections': registry.local_count(),
+        'event_loop_lag_seconds': round(limiter.lag, 4),
+        'load_shedding': limiter.shedding,
+        'draining': drainer.draining,
+        'metrics': metrics.snapshot()
+    }
+
+
+started_at = time.monotonic()
+status = StatusCache(collect_stats)
+app.on_startup.append(status.start)
+app.on_cleanup.append(status.stop)
+
+
+async def restore_registry(app):
+    # A process replacing one that just drained takes over its registry, so
+    # returning peers neither flap in presence nor lose their ids.
+    if not SNAPSHOT_PATH or BROKER_PATH:
+        return
+    snapshot = load_snapshot(SNAPSHOT_PATH)
+    if snapshot is None:
+        return
+    restored = registry.restore(snapshot)
+    logger.info("♻️  Восстановлено пиров из снимка: %d", restored)
+    app['restore_expiry'] = asyncio.create_task(expire_restored(snapshot['window'] + drainer.grace))
+
+
+async def expire_restored(delay):
+    await asyncio.sleep(delay)
+    gone, seq = registry.expire_restored()
+    if seq is None:
+        return
+    logger.info("Не вернулись после перезапуска: %d пиров", len(gone))
+    await sio.emit('presence', {'seq': seq, 'left': gone}, room=PRESENCE_ROOM)
+    for peer_id in gone:
+        await sio.emit('presence', {'seq': seq, 'left': [peer_id]}, room=f'presence:{peer_id}')
+
+
+async def drain(host, port):
+    # The listening socket is already closed, so a replacement process can
+    # bind the port while this one keeps serving its clients. They are
+    # only sent over once something is accepting connections there.
+    drainer.draining = True
+    if SNAPSHOT_PATH and not BROKER_PATH:
+        save_snapshot(SNAPSHOT_PATH, registry.snapshot(), drainer.window)
+    if not sio.eio.sockets:
+        return
+    if not await wait_for_listener(host, port):
+        logger.warning("⚠️  Остановка: замена на порту %s не появилась", port)
+    sids = [sid for sid, _ in sio.manager.get_participants('/', None)]
+    logger.info("🔻 Остановка: %d клиентов переподключатся в течение %.0f с", len(sids), drainer.window)
+    for sid, delay in drainer.reconnect_hints(sids):
+        await sio.emit('server_migrate', {'reconnect_after': delay}, room=sid)
+    deadline = time.monotonic() + drainer.window + drainer.grace
+    while sio.eio.sockets and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if not await drainer.wait_idle(max(0.0, deadline - time.monotonic())):
+        logger.warning("⚠️  Остановка: не дождались %d обработчиков", drainer.inflight)
+    if sio.eio.sockets:
+        logger.warning("⚠️  Остановка: %d клиентов не ушли сами и будут отключены", len(sio.eio.sockets))
+
+
+async def stop_restore_expiry(app):
+    if 'restore_expiry' in app:
+        app['restore_expiry'].cancel()
+
+
+async def serve(host, port, reuse_port=None):
+    # web.run_app stand-in. Its shutdown stops reading every socket before
+    # any hook runs, so draining happens here first: stop listening, move
+    # the clients, then let aiohttp close whatever is left. A second Ctrl+C
+    # skips the drain.
+    runner = web.AppRunner(app, shutdown_timeout=SHUTDOWN_TIMEOUT)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=reuse_port)
+    await site.start()
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    draining = None
+
+    def on_signal(signum):
+        if not stop.is_set():
+            stop.set()
+        elif signum == signals_module.SIGINT and draining is not None:
+            draining.cancel()
+
+    for signum in (signals_module.SIGINT, signals_module.SIGTERM):
+        loop.add_signal_handler(signum, on_signal, signum)
+    try:
+        await stop.wait()
+        await site.stop()
+        draining = asyncio.create_task(drain(host, port))
+        try:
+            await draining
+        except asyncio.CancelledError:
+            logger.warning("⚠️  Остановка без ожидания клиентов")
+    finally:
+        await runner.cleanup()
+
+
+app.on_startup.append(restore_registry)
+app.on_cleanup.append(stop_restore_expiry)
+
+
+async def handle_metrics(request):
+    return web.Response(text=await metrics.render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+app.router.add_get('/', status.handle_root)
+app.router.add_get('/health', status.handle_health)
+app.router.add_get('/stats', status.handle_stats)
+app.router.add_get('/metrics', handle_metrics)
 
 
 def get_local_ip():
@@ -218,6 +551,8 @@ def print_startup_info(host, port):
     print("\n📊 МОНИТОРИНГ:\n")
     print(f"   Веб-интерфейс:    http://localhost:{port}/")
     print(f"   Health check:     http://localhost:{port}/health")
+    print(f"   Статистика JSON:  http://localhost:{port}/stats")
+    print(f"   Метрики:          http://localhost:{port}/metrics")
     print("\n" + "=" * 70)
     print("📡 СЕРВЕР ГОТОВ К ПРИЕМУ ПОДКЛЮЧЕНИЙ")
     print("=" * 70)
@@ -229,13 +564,7 @@ if __name__ == '__main__':
     PORT = 8080
     print_startup_info(HOST, PORT)
     try:
-        web.run_app(
-            app,
-            host=HOST,
-            port=PORT,
-            print=None 
-        )
-    except KeyboardInterrupt:
+        asyncio.run(serve(HOST, PORT))
         print("\n\n👋 Сервер остановлен пользователем")
     except Exception as e:
-        logger.error(f"❌ Критическая ошибка: {e}")
\ No newline at end of file
+        logger.error("❌ Критическая ошибка: %s", e)
\ No newline at end of file
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import os
+
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between snapshots. Scrapers hitting /, /health or /stats more
+# often than this get the same prebuilt bytes (or a 304) every time.
+STATUS_INTERVAL = float(os.environ.get('NEXUS_STATUS_INTERVAL', '1'))
+# Different Host headers render different endpoint lines; past this many
+# per snapshot the page is still served, just not cached.
+MAX_CACHED_PAGES = 16
+
+STATUS_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <title>WebRTC Signaling Server</title>
+    <meta charset="utf-8">
+    <style>
+        body {
+            font-family: Arial, sans-serif;
+            max-width: 800px;
+            margin: 50px auto;
+            padding: 20px;
+            background: #f5f5f5;
+        }
+        .container {
+            background: white;
+            padding: 30px;
+            border-radius: 10px;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+        }
+        h1 { color: #333; }
+        .status {
+            color: #28a745;
+            font-size: 24px;
+            font-weight: bold;
+        }
+        .info {
+            background: #e9ecef;
+            padding: 15px;
+            border-radius: 5px;
+            margin: 15px 0;
+        }
+        code {
+            background: #f8f9fa;
+            padding: 2px 6px;
+            border-radius: 3px;
+            font-family: monospace;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>🚀 WebRTC Signaling Server</h1>
+        <p class="status">✅ Сервер работает! </p>
+
+        <div class="info">
+            <h3>📊 Статистика:</h3>
+@@STATS@@
+            <p>Подробнее: <a href="/stats"><code>/stats</code></a>, <a href="/metrics"><code>/metrics</code></a></p>
+        </div>
+
+        <div class="info">
+            <h3>📡 Подключение:</h3>
+            <p>Используйте Socket.IO клиент для подключения к этому серверу. </p>
+            <p>Endpoint: <code>@@ENDPOINT@@</code></p>
+        </div>
+
+        <div class="info">
+            <h3>💡 Поддерживаемые события:</h3>
+            <ul>
+                <li><code>register</code> - Регистрация пира</li>
+                <li><code>get_peers</code> - Получить список пиров</li>
+                <li><code>subscribe_presence</code> - Снимок онлайн-пиров и поток изменений</li>
+                <li><code>signal</code> - Передача WebRTC сигналов</li>
+                <li><code>signals</code> - Пакетная передача сигналов (ICE-кандидаты)</li>
+            </ul>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+STATS_FRAGMENT = """            <p>Пиров онлайн: <strong>{peers_online}</strong></p>
+            <p>Активных соединений: <strong>{active_connections}</strong></p>"""
+
+# Split once at import: rendering is then a join of five byte strings.
+_HEAD, _, _REST = STATUS_TEMPLATE.partition('@@STATS@@')
+_MIDDLE, _, _TAIL = _REST.partition('@@ENDPOINT@@')
+_HEAD, _MIDDLE, _TAIL = _HEAD.encode(), _MIDDLE.encode(), _TAIL.encode()
+
+
+def etag_of(body):
+    return '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+
+class Cached:
+    __slots__ = ('body', 'etag', 'content_type')
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.etag = etag_of(body)
+        self.content_type = content_type
+
+
+class StatusCache:
+    # Serves the status page, /health and /stats from a snapshot rebuilt by
+    # a timer task. `collect` is a coroutine function returning the stats
+    # dict; it must include peers_online and active_connections.
+    def __init__(self, collect, interval=STATUS_INTERVAL):
+        self.collect = collect
+        self.interval = interval
+        self.health = None
+        self.stats = None
+        self.fragment = b''
+        self.pages = {}
+
+    async def refresh(self):
+        stats = await self.collect()
+        self.health = Cached(json.dumps({
+            'status': 'healthy',
+            'peers_online': stats['peers_online'],
+            'active_connections': stats['active_connections']
+        }).encode(), 'application/json')
+        self.stats = Cached(json.dumps(stats, ensure_ascii=False).encode(), 'application/json')
+        self.fragment = STATS_FRAGMENT.format(**stats).encode()
+        self.pages = {}
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                # Keep serving the last snapshot.
+                logger.error("❌ Ошибка при обновлении статуса: %s", e)
+
+    async def start(self, app):
+        await self.refresh()
+        app['status_refresh'] = asyncio.create_task(self.run())
+
+    async def stop(self, app):
+        app['status_refresh'].cancel()
+
+    def page(self, endpoint):
+        cached = self.pages.get(endpoint)
+        if cached is None:
+            body = b''.join((_HEAD, self.fragment, _MIDDLE, html.escape(endpoint).encode(), _TAIL))
+            cached = Cached(body, 'text/html')
+            if len(self.pages) < MAX_CACHED_PAGES:
+                self.pages[endpoint] = cached
+        return cached
+
+    def respond(self, request, cached):
+        headers = {
+            'ETag': cached.etag,
+            'Cache-Control': f'public, max-age={max(1, int(self.interval))}'
+        }
+        if cached.etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=cached.body, content_type=cached.content_type, charset='utf-8', headers=headers)
+
+    async def ready(self):
+        # Outside aiohttp's startup hooks (e.g. a bare test client) the first
+        # request builds the snapshot.
+        if self.stats is None:
+            await self.refresh()
+
+    async def handle_root(self, request):
+        await self.ready()
+        return self.respond(request, self.page(str(request.url)))
+
+    async def handle_health(self, request):
+        await self.ready()
+        return self.respond(request, self.health)
+
+    async def handle_stats(self, request):
+        await self.ready()
+        return self.respond(request, self.stats)